@@ -1 +1,19 @@
-__all__ = ["corpus_views", "filters"]
+__all__ = [
+    "blimp",
+    "build",
+    "commands",
+    "compression",
+    "confidence",
+    "corpus_views",
+    "dedup",
+    "export",
+    "filters",
+    "gc_tuning",
+    "plan",
+    "reparse",
+    "sampling",
+    "sentence_ids",
+    "stats",
+    "threaded_io",
+    "validate",
+]
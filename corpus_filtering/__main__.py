@@ -8,6 +8,14 @@ In order to be executable from the CLI, filter-writer classes must "register" th
 with the `@register_filter` decorator, defined in `filters/core_filters.py`. See the
 function documentation there for more info.
 
+So that the CLI starts quickly, filters can instead (or additionally) be registered by
+their `FilterSpec`, which records the filter's import path and metadata, either with
+`register_lazy_filter` (this is how the filters in `stanza_filters.py` are registered;
+see `filters/__init__.py`) or, for filters defined in other packages, through the
+"corpus_filtering.filters" entry-point group (see `FilterRegistry` in
+`filters/core_filters.py`). Only the module of the filter that is actually chosen as the
+subcommand is then imported, so e.g. `--help` never imports stanza or torch.
+
 Each filter-writer corresponds to a "subcommand," meaning a filter-writer class named
 `MyFilter` might be invoked like this:
 
@@ -15,6 +23,11 @@ Each filter-writer corresponds to a "subcommand," meaning a filter-writer class
     python -m corpus_filtering MyFilter ...[args]...
     ```
 
+Besides the filters, a few other subcommands (e.g. `dedup`) operate on corpuses without
+filtering them. They are defined in the same way as filter-writers, but are registered in
+`CLI_COMMANDS` (see `commands.py`) and executed with their `run` method instead of
+`filter_write`.
+
 A filter-writer may declare two class variables that are used to define the
 corresponding CLI subcommand.
 
@@ -111,10 +124,11 @@ Dev notes:
     trying to reproduce that logic in a simple assert statement or something similar.
 """
 
+import sys
 from argparse import ArgumentParser
 from typing import Optional, Type
 
-from corpus_filtering import filters
+from corpus_filtering import commands, filters
 
 
 PARSER_CONFIG = {
@@ -123,43 +137,101 @@ PARSER_CONFIG = {
 }
 
 SUBPARSERS_CONFIG = {
-    "title": "Filter Class",
-    "description": "A Python class implementing CorpusFilterWriter.",
+    "title": "Filter Class or Command",
+    "description": "A Python class implementing CorpusFilterWriter, or another command.",
     "dest": "filter_cls",
     "required": True,
-    "help": "Filter class choices",
-    "metavar": f"[{', '.join(filters.CLI_FILTERS.keys())}]",
+    "help": "Filter class and command choices",
 }
 
-parser = ArgumentParser(**PARSER_CONFIG)
-subparsers = parser.add_subparsers(**SUBPARSERS_CONFIG)
 
-for cli_subcmd_name, filter_cls in filters.CLI_FILTERS.items():
+def get_subcmd_name(argv: list[str]) -> Optional[str]:
+    """Find the name of the chosen subcommand without importing or parsing anything.
+
+    The top-level parser has no arguments besides `-h`, so the subcommand is simply the
+    first argument that isn't an option.
+    """
+    return next((arg for arg in argv if not arg.startswith("-")), None)
+
+
+def add_subparser(subparsers, cli_subcmd_name: str, cli_subcmd_cls: Type):
+    """Add the subcommand defined by a filter-writer or command class to the parser."""
     cli_subcmd_constructor_kwargs: dict = getattr(
-        filter_cls, "cli_subcmd_constructor_kwargs", {}
+        cli_subcmd_cls, "cli_subcmd_constructor_kwargs", {}
     )
 
     subparser: ArgumentParser = subparsers.add_parser(
         cli_subcmd_name, **cli_subcmd_constructor_kwargs
     )
 
-    cli_subcmd_arguments = getattr(filter_cls, "cli_subcmd_arguments", [])
+    cli_subcmd_arguments = getattr(cli_subcmd_cls, "cli_subcmd_arguments", [])
     for cli_argument in cli_subcmd_arguments:
         args = cli_argument.get("args", [])
         kwargs = cli_argument.get("kwargs", {})
         subparser.add_argument(*args, **kwargs)
 
-args = parser.parse_args()
 
-parsed_args = vars(args)
-chosen_filter_cls_name: str = parsed_args.pop("filter_cls")
+def build_parser(chosen_subcmd_name: Optional[str] = None) -> ArgumentParser:
+    """Build the CLI argument parser.
+
+    Every registered filter and command gets a subcommand, but only the class of the
+    chosen subcommand is imported to define its arguments; the other subcommands are
+    never parsed, so they are left empty.
+
+    Args:
+        chosen_subcmd_name: the name of the subcommand given on the command line, if any.
+    Returns:
+        The argument parser.
+    """
+    subcmd_names = [*filters.CLI_FILTERS.keys(), *commands.CLI_COMMANDS.keys()]
+    assert len(set(subcmd_names)) == len(
+        subcmd_names
+    ), "Filter and command names must be distinct"
+
+    parser = ArgumentParser(**PARSER_CONFIG)
+    subparsers = parser.add_subparsers(
+        **SUBPARSERS_CONFIG, metavar=f"[{', '.join(subcmd_names)}]"
+    )
+
+    for cli_subcmd_name in subcmd_names:
+        if cli_subcmd_name != chosen_subcmd_name:
+            subparsers.add_parser(cli_subcmd_name)
+        elif cli_subcmd_name in commands.CLI_COMMANDS:
+            add_subparser(
+                subparsers, cli_subcmd_name, commands.load_command(cli_subcmd_name)
+            )
+        else:
+            add_subparser(
+                subparsers, cli_subcmd_name, filters.CLI_FILTERS[cli_subcmd_name]
+            )
+
+    return parser
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    parser = build_parser(get_subcmd_name(argv))
+    args = parser.parse_args(argv)
+
+    parsed_args = vars(args)
+    chosen_filter_cls_name: str = parsed_args.pop("filter_cls")
+
+    if chosen_filter_cls_name in commands.CLI_COMMANDS:
+        command = commands.load_command(chosen_filter_cls_name)(**parsed_args)
+        command.run()
+        return
+
+    chosen_filter_cls: Optional[
+        Type[filters.CorpusFilterWriter]
+    ] = filters.CLI_FILTERS.get(chosen_filter_cls_name, None)
+
+    if chosen_filter_cls:
+        # close explicitly, so that outputs buffered by background writers are flushed
+        with chosen_filter_cls(**parsed_args) as corpus_filter:
+            corpus_filter.filter_write()
+    else:  # this should never happen
+        print("Invalid filter chosen. Aborting!")
 
-chosen_filter_cls: Optional[Type[filters.CorpusFilterWriter]] = filters.CLI_FILTERS.get(
-    chosen_filter_cls_name, None
-)
 
-if chosen_filter_cls:
-    corpus_filter: filters.CorpusFilterWriter = chosen_filter_cls(**parsed_args)
-    corpus_filter.filter_write()
-else:  # this should never happen
-    print("Invalid filter chosen. Aborting!")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""Conversion of the BLiMP `.jsonl` paradigm files into one indexed, annotated corpus.
+
+Every line of a BLiMP paradigm file is a JSON record holding a minimal pair
+(`sentence_good` and `sentence_bad`) along with its paradigm (`UID`) and `pairID`. The
+`blimp-corpus` command streams all the given paradigm files, extracts the good and/or
+bad sentences of every pair, and annotates the deduplicated union of the sentences of
+all paradigms with a single Stanza pipeline, in batches. For example:
+
+    python -m corpus_filtering blimp-corpus data/blimp/*.jsonl data/blimp/annotated
+
+The output directory then contains:
+
+    * `blimp.pkl`: the annotated sentences, as pickled `stanza.Document` objects of (up
+        to) `--batch-size` sentences each, like the output of `stanza_serialize.py`
+        (frame-per-document compressed if its name ends in e.g. `.zst`; see `--name`).
+    * `blimp.index.json`: the text of every annotated sentence, the byte offset and
+        first sentence of every document, and, for every paradigm, the pair IDs and the
+        indices of the good and bad sentence of each pair.
+
+`BlimpCorpus` reads the sentences of any one paradigm back by seeking to just the
+documents that hold them. The `validate` command reads its BLiMP sentences from such a
+directory when it finds an index in its `--blimp-dir`.
+"""
+
+import argparse
+import bisect
+import itertools
+import json
+import os
+from collections.abc import Iterable, Iterator
+from typing import Any, Optional
+
+from tqdm import tqdm
+
+from corpus_filtering.commands import CorpusCommand
+from corpus_filtering.compression import dump_pickle, get_codec, load_pickle
+
+__all__ = [
+    "BLIMP_INDEX_NAME",
+    "iter_blimp_pairs",
+    "BlimpCorpus",
+    "BlimpCorpusCommand",
+]
+
+BLIMP_INDEX_NAME = "blimp.index.json"
+DEFAULT_CORPUS_NAME = "blimp.pkl"
+DEFAULT_BATCH_SIZE = 10000
+PROCESSORS = "tokenize,pos,lemma,depparse,constituency"
+SENTENCE_KINDS = ("good", "bad")
+
+
+def iter_blimp_pairs(jsonl_paths: Iterable[str]) -> Iterator[dict[str, Any]]:
+    """Stream the minimal pairs of BLiMP paradigm files.
+
+    Args:
+        jsonl_paths: Paths to BLiMP `.jsonl` files, one JSON record per line.
+    Returns:
+        An iterator over the records, each with (at least) the keys `paradigm`,
+        `pair_id`, `good` and `bad`. The paradigm is the record's `UID`, or else the
+        name of its file; the pair ID is its `pairID`, or else its line number.
+    """
+    for path in jsonl_paths:
+        default_paradigm = os.path.basename(path).split(".")[0]
+        with open(path, "r", encoding="utf-8") as f:
+            for line_num, line in enumerate(f):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                yield {
+                    "paradigm": record.get("UID", default_paradigm),
+                    "pair_id": str(record.get("pairID", line_num)),
+                    "good": " ".join(record["sentence_good"].split()),
+                    "bad": " ".join(record["sentence_bad"].split()),
+                }
+
+
+class BlimpCorpus:
+    """Read access to an indexed, annotated BLiMP corpus written by `blimp-corpus`."""
+
+    def __init__(self, directory: str):
+        """Constructor for BlimpCorpus.
+
+        Args:
+            directory: The output directory of `blimp-corpus`.
+        """
+        with open(os.path.join(directory, BLIMP_INDEX_NAME), "r") as f:
+            self.index = json.load(f)
+        self.corpus_path = os.path.join(directory, self.index["corpus"])
+        self._codec = get_codec(self.corpus_path)
+        self._doc_starts = [start for _, start in self.index["docs"]]
+
+    @property
+    def paradigms(self) -> list[str]:
+        return list(self.index["paradigms"])
+
+    def __contains__(self, paradigm: str) -> bool:
+        return paradigm in self.index["paradigms"]
+
+    def pairs(
+        self, paradigm: str
+    ) -> Iterator[tuple[str, Optional[str], Optional[str]]]:
+        """The (pair ID, good sentence, bad sentence) texts of a paradigm's pairs.
+
+        Sentences of a kind that was not extracted are `None`.
+        """
+        entry = self.index["paradigms"][paradigm]
+        texts = self.index["sentences"]
+        for idx, pair_id in enumerate(entry["pair_ids"]):
+            yield (
+                pair_id,
+                *(
+                    texts[entry[kind][idx]] if kind in entry else None
+                    for kind in SENTENCE_KINDS
+                ),
+            )
+
+    def sentences(self, paradigm: str, kind: str = "good") -> list:
+        """The annotated (Stanza) sentences of a paradigm, in pair order.
+
+        Args:
+            paradigm: The name of the paradigm, e.g. "passive_1".
+            kind: "good" or "bad".
+        """
+        sent_ids = self.index["paradigms"][paradigm][kind]
+        by_doc: dict[int, list[int]] = {}
+        for sent_id in set(sent_ids):
+            by_doc.setdefault(
+                bisect.bisect_right(self._doc_starts, sent_id) - 1, []
+            ).append(sent_id)
+
+        sents = {}
+        with open(self.corpus_path, "rb") as f:
+            for doc_idx, doc_sent_ids in sorted(by_doc.items()):
+                offset, start = self.index["docs"][doc_idx]
+                f.seek(offset)
+                doc = load_pickle(f, self._codec)
+                for sent_id in doc_sent_ids:
+                    sents[sent_id] = doc.sentences[sent_id - start]
+        return [sents[sent_id] for sent_id in sent_ids]
+
+
+class BlimpCorpusCommand(CorpusCommand):
+    """Extract the sentences of BLiMP paradigm files and annotate them all at once, into
+    one annotated corpus indexed by paradigm and pair.
+    """
+
+    cli_subcmd_constructor_kwargs = {
+        "description": f"Description:\n{__doc__}",
+        "formatter_class": argparse.RawDescriptionHelpFormatter,
+    }
+
+    cli_subcmd_arguments = [
+        {
+            "args": ["jsonl_paths"],
+            "kwargs": {
+                "nargs": "+",
+                "help": "Paths to the BLiMP .jsonl paradigm files.",
+                "metavar": "jsonl_path",
+            },
+        },
+        {
+            "args": ["out_dir"],
+            "kwargs": {
+                "help": "Directory where the annotated corpus and its index should be "
+                "written.",
+                "metavar": "output_dir",
+            },
+        },
+        {
+            "args": ["--sentences"],
+            "kwargs": {
+                "choices": ["good", "bad", "both"],
+                "default": "good",
+                "dest": "sentence_kinds",
+                "help": "Which sentences of each pair to extract. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["--name"],
+            "kwargs": {
+                "default": DEFAULT_CORPUS_NAME,
+                "dest": "corpus_name",
+                "help": "File name of the annotated corpus in the output directory; "
+                "add e.g. .zst to compress it. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["-b", "--batch-size"],
+            "kwargs": {
+                "type": int,
+                "default": DEFAULT_BATCH_SIZE,
+                "dest": "batch_size",
+                "help": "How many sentences to annotate per batch, i.e. per "
+                "`stanza.Document`. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["--pretokenized"],
+            "kwargs": {
+                "action": "store_true",
+                "help": "Treat the sentences as already whitespace-tokenized. By "
+                "default, Stanza tokenizes them, since BLiMP sentences are not.",
+            },
+        },
+    ]
+
+    def __init__(
+        self,
+        jsonl_paths: list[str],
+        out_dir: str,
+        sentence_kinds: str = "good",
+        corpus_name: str = DEFAULT_CORPUS_NAME,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        pretokenized: bool = False,
+    ):
+        """Constructor for BlimpCorpusCommand.
+
+        Args:
+            jsonl_paths: Paths to the BLiMP `.jsonl` paradigm files.
+            out_dir: Directory where the annotated corpus and its index are written.
+            sentence_kinds: "good", "bad" or "both".
+            corpus_name: File name of the annotated corpus.
+            batch_size: How many sentences to annotate per `stanza.Document`.
+            pretokenized: Whether the sentences are already whitespace-tokenized.
+        """
+        assert batch_size > 0, "The batch size must be positive"
+        self.jsonl_paths = jsonl_paths
+        self.out_dir = out_dir
+        self.kinds = SENTENCE_KINDS if sentence_kinds == "both" else (sentence_kinds,)
+        self.corpus_name = corpus_name
+        self.batch_size = batch_size
+        self.pretokenized = pretokenized
+
+    def _extract(self) -> tuple[list[str], dict[str, dict[str, list]]]:
+        """Extract the deduplicated sentences and the index entries of the paradigms."""
+        sent_ids: dict[str, int] = {}
+        paradigms: dict[str, dict[str, list]] = {}
+        for pair in iter_blimp_pairs(self.jsonl_paths):
+            entry = paradigms.setdefault(
+                pair["paradigm"], {"pair_ids": [], **{kind: [] for kind in self.kinds}}
+            )
+            entry["pair_ids"].append(pair["pair_id"])
+            for kind in self.kinds:
+                entry[kind].append(sent_ids.setdefault(pair[kind], len(sent_ids)))
+        return list(sent_ids), paradigms
+
+    def run(self):
+        import stanza
+
+        sents, paradigms = self._extract()
+        num_extracted = sum(
+            len(entry[kind]) for entry in paradigms.values() for kind in self.kinds
+        )
+        print(
+            f"Extracted {num_extracted} sentences ({len(sents)} unique) from "
+            f"{len(paradigms)} paradigms."
+        )
+
+        pipeline = stanza.Pipeline(
+            lang="en",
+            processors=PROCESSORS,
+            tokenize_pretokenized=self.pretokenized,
+            tokenize_no_ssplit=True,  # one sentence per line
+        )
+        os.makedirs(self.out_dir, exist_ok=True)
+        corpus_path = os.path.join(self.out_dir, self.corpus_name)
+        codec = get_codec(corpus_path)
+        docs = []
+        with open(corpus_path, "wb") as f_out, tqdm(
+            total=len(sents), desc="Annotating sentences", dynamic_ncols=True
+        ) as progress:
+            sents_iter = iter(sents)
+            start = 0
+            while True:
+                batch = list(itertools.islice(sents_iter, self.batch_size))
+                if not batch:
+                    break
+                # without `tokenize_pretokenized`, and with `tokenize_no_ssplit`, Stanza
+                # only splits sentences at blank lines
+                doc = pipeline(("\n" if self.pretokenized else "\n\n").join(batch))
+                assert len(doc.sentences) == len(batch), "Stanza split or merged lines"
+                docs.append((f_out.tell(), start))
+                dump_pickle(doc, f_out, codec)
+                start += len(batch)
+                progress.update(len(batch))
+
+        index = {
+            "corpus": self.corpus_name,
+            "kinds": list(self.kinds),
+            "pretokenized": self.pretokenized,
+            "num_sents": len(sents),
+            "docs": docs,
+            "sentences": sents,
+            "paradigms": paradigms,
+        }
+        with open(os.path.join(self.out_dir, BLIMP_INDEX_NAME), "w") as f:
+            json.dump(index, f)
+        print(
+            f"Wrote {len(sents)} annotated sentences to {corpus_path}, indexed in "
+            f"{BLIMP_INDEX_NAME}."
+        )
@@ -0,0 +1,464 @@
+"""Regeneration of all the filtered corpuses that the training configs refer to.
+
+Every training config in `config/corpus/` names a corpus (`corpus_name`) and the
+directory it is read from (`data.base_dir`). The `build-all` command maps each config to
+the filter(s) that produce its corpus, and writes `{split}.accept.corpus` and
+`{split}.reject.corpus`, along with statistics about them (`{split}.stats.json`; see
+`corpus_filtering.stats`), to its `base_dir` for each split of the annotated Gulordava
+corpus (`train`, `valid` and `test`):
+
+    python -m corpus_filtering build-all -j 8
+
+A config's filters are listed under its `filters` key, if it has one (a sentence is then
+rejected if any of them rejects it); otherwise, its `corpus_name` is taken to be the
+name of its filter. Configs that name no registered filter (e.g. `full`, the unfiltered
+corpus) are skipped.
+
+The corpuses built from the same split share passes over it: each worker process reads
+the split once and runs the filters of a group of corpuses over every sentence, so the
+(slow) unpickling of the annotated corpus is not repeated for every filter.
+
+A manifest (`build.json`) in each `base_dir` records, for every split, a hash of the
+build's inputs: the annotated split (see `corpus_fingerprint`), the source code of the
+filters and the contents of their word lists (and, with `--alt-parses`, the index of
+the cache of alternative parses the filters also evaluate their predicates on; see
+`corpus_filtering.reparse`). A corpus whose inputs are unchanged since it was last
+built is skipped, unless `--force` is given.
+"""
+
+import argparse
+import glob
+import hashlib
+import inspect
+import json
+import multiprocessing as mp
+import os
+from typing import Any, Optional
+
+from corpus_filtering import filters
+from corpus_filtering.commands import CorpusCommand
+from corpus_filtering.corpus_views.masked_corpus_views import corpus_fingerprint
+from corpus_filtering.filters.word_lists import (
+    REPO_ROOT,
+    load_word_list,
+    resolve_data_path,
+)
+from corpus_filtering.reparse import CACHE_INDEX_NAME
+from corpus_filtering.stats import FilterStats
+from corpus_filtering.threaded_io import prefetch
+from corpus_filtering.validate import find_annotated
+
+__all__ = ["CorpusBuild", "load_corpus_builds", "BuildAllCommand"]
+
+DEFAULT_CONFIG_DIR = "config/corpus"
+DEFAULT_CORPUS_DIR = "data/gulordava_corpus"
+DEFAULT_SPLITS = ("train", "valid", "test")
+MANIFEST_NAME = "build.json"
+
+
+class CorpusBuild:
+    """A corpus named by a training config, and the filters that produce it."""
+
+    def __init__(self, name: str, base_dir: str, filter_names: list[str]):
+        """Constructor for CorpusBuild.
+
+        Args:
+            name: The `corpus_name` of the config.
+            base_dir: The directory the corpus is written to.
+            filter_names: The names of the filters that produce the corpus.
+        """
+        self.name = name
+        self.base_dir = base_dir
+        self.filter_names = filter_names
+
+    def output_paths(self, split: str) -> tuple[str, str]:
+        """The paths of the accepted and rejected sentences of a split."""
+        return (
+            os.path.join(self.base_dir, f"{split}.accept.corpus"),
+            os.path.join(self.base_dir, f"{split}.reject.corpus"),
+        )
+
+    def stats_path(self, split: str) -> str:
+        """The path of the statistics of a split; see `corpus_filtering.stats`."""
+        return os.path.join(self.base_dir, f"{split}.stats.json")
+
+    def read_manifest(self) -> dict[str, Any]:
+        path = os.path.join(self.base_dir, MANIFEST_NAME)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def write_manifest(self, manifest: dict[str, Any]):
+        os.makedirs(self.base_dir, exist_ok=True)
+        with open(os.path.join(self.base_dir, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    def inputs_hash(
+        self, input_path: str, filter_kwargs: Optional[dict[str, Any]] = None
+    ) -> str:
+        """Hash of everything a split of the corpus is built from."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(corpus_fingerprint(input_path).encode("utf-8"))
+        if filter_kwargs:
+            digest.update(f"top_k={filter_kwargs['top_k']}".encode("utf-8"))
+            index_path = os.path.join(filter_kwargs["alt_parses_dir"], CACHE_INDEX_NAME)
+            with open(index_path, "rb") as f:
+                digest.update(f.read())
+        for filter_name in self.filter_names:
+            digest.update(filter_name.encode("utf-8"))
+            for path in filter_source_paths(filter_name):
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+            for word_list_path in filters.CLI_FILTERS.spec(filter_name).word_lists:
+                with open(resolve_data_path(word_list_path), "rb") as f:
+                    digest.update(f.read())
+        return digest.hexdigest()
+
+
+def filter_source_paths(filter_name: str) -> list[str]:
+    """The source files a filter's behavior depends on: those of the classes it inherits
+    from (outside of the standard library) and of the modules of the
+    `corpus_filtering.filters` package (e.g. the trigger matcher and word lists)."""
+    filter_cls = filters.CLI_FILTERS[filter_name]
+    packages = {"corpus_filtering", filter_cls.__module__.split(".")[0]}
+    paths = set(glob.glob(os.path.join(os.path.dirname(filters.__file__), "*.py")))
+    for cls in inspect.getmro(filter_cls):
+        if cls.__module__.split(".")[0] in packages:
+            paths.add(inspect.getsourcefile(cls))
+    return sorted(os.path.abspath(path) for path in paths)
+
+
+def load_corpus_builds(config_dir: str) -> tuple[list[CorpusBuild], list[str]]:
+    """Read the corpus configs and map each one to its filters.
+
+    Args:
+        config_dir: The directory of corpus configs, e.g. "config/corpus".
+    Returns:
+        The corpuses to build, and the names of the configs that name no filter.
+    """
+    import yaml
+
+    builds = []
+    unfiltered = []
+    for path in sorted(glob.glob(os.path.join(config_dir, "*.yaml"))):
+        with open(path, "r") as f:
+            config = yaml.safe_load(f) or {}
+        name = config.get("corpus_name") or os.path.splitext(os.path.basename(path))[0]
+        filter_names = config.get("filters") or (
+            [name] if name in filters.CLI_FILTERS else []
+        )
+        base_dir = config.get("data", {}).get("base_dir")
+        if not filter_names or not base_dir:
+            unfiltered.append(name)
+            continue
+        for filter_name in filter_names:
+            assert filter_name in filters.CLI_FILTERS, f"{path}: unknown {filter_name}"
+        # `root_dir` is the directory training is launched from, i.e. the repository
+        base_dir = base_dir.replace("${root_dir}", str(REPO_ROOT))
+        builds.append(CorpusBuild(name, base_dir, list(filter_names)))
+    return builds, unfiltered
+
+
+def run_builds(
+    task: tuple[str, list[CorpusBuild], str, dict[str, Any]]
+) -> dict[str, Any]:
+    """Build one split of a group of corpuses, in a single pass over the split, in a
+    worker process.
+
+    Args:
+        task:
+            The split, the corpuses to build, the path to the annotated split, and
+            extra keyword arguments of the filters (e.g. their alternative parses).
+    Returns:
+        The split, and the number of accepted and rejected sentences of each corpus.
+    """
+    split, builds, input_path, filter_kwargs = task
+    from corpus_filtering.corpus_views import PickleStanzaDocCorpusView
+
+    # per corpus: the filter that writes its outputs, followed by any others, which
+    # are only used for their predicates
+    corpus_filters = []
+    for build in builds:
+        os.makedirs(build.base_dir, exist_ok=True)
+        accept_path, reject_path = build.output_paths(split)
+        corpus_filters.append(
+            [
+                filters.CLI_FILTERS[filter_name](
+                    f_in=input_path,
+                    f_accept_out_path=accept_path if idx == 0 else os.devnull,
+                    f_reject_out_path=reject_path if idx == 0 else None,
+                    **filter_kwargs,
+                )
+                for idx, filter_name in enumerate(build.filter_names)
+            ]
+        )
+    # the predicates `filter_write` would evaluate, e.g. also on alternative parses
+    corpus_predicates = [
+        [corpus_filter._sent_predicate() for corpus_filter in build_filters]
+        for build_filters in corpus_filters
+    ]
+
+    all_stats = [FilterStats() for _ in builds]
+    for sent in prefetch(PickleStanzaDocCorpusView(input_path)):
+        num_tokens = len(sent.words)
+        for build_filters, predicates, stats in zip(
+            corpus_filters, corpus_predicates, all_stats
+        ):
+            reject = False
+            trigger = None
+            for corpus_filter, exclude_sent in zip(build_filters, predicates):
+                corpus_filter._last_trigger = None
+                if exclude_sent(sent):
+                    reject, trigger = True, corpus_filter._last_trigger
+                    break
+            stats.add(num_tokens, reject, trigger)
+            build_filters[0]._write(sent, reject)
+    for build, build_filters, stats in zip(builds, corpus_filters, all_stats):
+        build_filters[0]._finish()
+        for corpus_filter in build_filters:
+            corpus_filter.close()
+        stats.save(build.stats_path(split))
+
+    return {
+        "split": split,
+        "counts": {
+            build.name: tuple(stats.num_sents)
+            for build, stats in zip(builds, all_stats)
+        },
+    }
+
+
+class BuildAllCommand(CorpusCommand):
+    """(Re)build every filtered corpus that a training config in config/corpus/ refers
+    to, skipping the corpuses whose inputs have not changed since they were last built.
+    """
+
+    cli_subcmd_constructor_kwargs = {
+        "description": f"Description:\n{__doc__}",
+        "formatter_class": argparse.RawDescriptionHelpFormatter,
+    }
+
+    cli_subcmd_arguments = [
+        {
+            "args": ["--configs"],
+            "kwargs": {
+                "default": DEFAULT_CONFIG_DIR,
+                "dest": "config_dir",
+                "help": "Directory of the corpus configs. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["--corpus-dir"],
+            "kwargs": {
+                "default": DEFAULT_CORPUS_DIR,
+                "dest": "corpus_dir",
+                "help": "Directory of the annotated splits, as {split}.pkl (optionally "
+                "compressed). Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["--splits"],
+            "kwargs": {
+                "nargs": "+",
+                "default": list(DEFAULT_SPLITS),
+                "help": "The splits to filter. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["-c", "--corpora"],
+            "kwargs": {
+                "nargs": "+",
+                "dest": "corpus_names",
+                "help": "Only build these corpuses. Default: all of them.",
+            },
+        },
+        {
+            "args": ["-j", "--workers"],
+            "kwargs": {
+                "type": int,
+                "default": os.cpu_count(),
+                "dest": "num_workers",
+                "help": "Number of worker processes. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["--alt-parses"],
+            "kwargs": {
+                "dest": "alt_parses_dir",
+                "help": "Path to a cache of alternative parses (see the `reparse` "
+                "command), for the filters to also evaluate their predicates on.",
+            },
+        },
+        {
+            "args": ["--top-k"],
+            "kwargs": {
+                "type": int,
+                "default": 3,
+                "dest": "top_k",
+                "help": "How many parses of each sentence to evaluate the predicates "
+                "on with --alt-parses. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["--force"],
+            "kwargs": {
+                "action": "store_true",
+                "help": "Rebuild the corpuses even if their inputs have not changed.",
+            },
+        },
+        {
+            "args": ["-n", "--dry-run"],
+            "kwargs": {
+                "action": "store_true",
+                "dest": "dry_run",
+                "help": "Only print what would be built.",
+            },
+        },
+    ]
+
+    def __init__(
+        self,
+        config_dir: str = DEFAULT_CONFIG_DIR,
+        corpus_dir: str = DEFAULT_CORPUS_DIR,
+        splits: Optional[list[str]] = None,
+        corpus_names: Optional[list[str]] = None,
+        num_workers: Optional[int] = None,
+        alt_parses_dir: Optional[str] = None,
+        top_k: int = 3,
+        force: bool = False,
+        dry_run: bool = False,
+    ):
+        """Constructor for BuildAllCommand.
+
+        Args:
+            config_dir: Directory of the corpus configs.
+            corpus_dir: Directory of the annotated splits.
+            splits: The splits to filter. Defaults to train, valid and test.
+            corpus_names: Only build these corpuses. Optional; defaults to all.
+            num_workers: Number of worker processes. Defaults to the number of CPUs.
+            alt_parses_dir: Path to a cache of alternative parses. Optional.
+            top_k: How many parses of each sentence to evaluate the predicates on.
+            force: Whether to rebuild corpuses whose inputs have not changed.
+            dry_run: Whether to only print what would be built.
+        """
+        # relative to the working directory, or else to the repository root
+        self.config_dir, self.corpus_dir = (
+            path if os.path.isdir(path) else str(resolve_data_path(path))
+            for path in (config_dir, corpus_dir)
+        )
+        self.splits = splits or list(DEFAULT_SPLITS)
+        self.corpus_names = corpus_names
+        self.num_workers = num_workers or os.cpu_count()
+        assert alt_parses_dir is None or os.path.exists(
+            os.path.join(alt_parses_dir, CACHE_INDEX_NAME)
+        ), f"No alternative parses in {alt_parses_dir}"
+        self.filter_kwargs = (
+            {"alt_parses_dir": alt_parses_dir, "top_k": top_k} if alt_parses_dir else {}
+        )
+        self.force = force
+        self.dry_run = dry_run
+
+    def _plan(self) -> dict[str, list[tuple[CorpusBuild, str]]]:
+        """Find the corpuses to build for each split, and the hashes of their inputs."""
+        builds, unfiltered = load_corpus_builds(self.config_dir)
+        if unfiltered:
+            print(f"Skipping configs that name no filter: {', '.join(unfiltered)}")
+        if self.corpus_names:
+            unknown = set(self.corpus_names) - {build.name for build in builds}
+            assert not unknown, f"No filtered corpus config for {', '.join(unknown)}"
+            builds = [build for build in builds if build.name in self.corpus_names]
+
+        plan = {}
+        for split in self.splits:
+            input_path = find_annotated(self.corpus_dir, split)
+            if input_path is None:
+                print(f"Warning: no annotated {split} split in {self.corpus_dir}")
+                continue
+            plan[split] = []
+            for build in builds:
+                inputs_hash = build.inputs_hash(input_path, self.filter_kwargs)
+                built = build.read_manifest().get(split, {})
+                up_to_date = built.get("inputs_hash") == inputs_hash and all(
+                    os.path.exists(path) for path in build.output_paths(split)
+                )
+                if up_to_date and not self.force:
+                    print(f"{build.name} ({split}): up to date")
+                else:
+                    plan[split].append((build, inputs_hash))
+        return plan
+
+    def _tasks(self, plan: dict[str, list[tuple[CorpusBuild, str]]]) -> list[tuple]:
+        """Split the corpuses of every split into about `num_workers` groups in total,
+        each of which is built in one pass over its split."""
+        num_splits = sum(1 for planned in plan.values() if planned)
+        groups_per_split = max(1, self.num_workers // max(num_splits, 1))
+        tasks = []
+        for split, planned in plan.items():
+            input_path = find_annotated(self.corpus_dir, split)
+            builds = [build for build, _ in planned]
+            for group_idx in range(min(groups_per_split, len(builds))):
+                tasks.append(
+                    (
+                        split,
+                        builds[group_idx::groups_per_split],
+                        input_path,
+                        self.filter_kwargs,
+                    )
+                )
+        return tasks
+
+    def run(self):
+        plan = self._plan()
+        for split, planned in plan.items():
+            for build, _ in planned:
+                print(f"{build.name} ({split}): {' + '.join(build.filter_names)}")
+        if self.dry_run or not any(plan.values()):
+            return
+
+        # a build that fails partway must not be mistaken for being up to date
+        for split, planned in plan.items():
+            for build, _ in planned:
+                manifest = build.read_manifest()
+                manifest.pop(split, None)
+                build.write_manifest(manifest)
+
+        tasks = self._tasks(plan)
+        # import the filters and compile their word lists before forking, so that the
+        # workers share them (see `filters/word_lists.py`)
+        filter_names = {
+            filter_name
+            for _, builds, _, _ in tasks
+            for build in builds
+            for filter_name in build.filter_names
+        }
+        for filter_name in filter_names:
+            filters.CLI_FILTERS[filter_name]
+            for word_list_path in filters.CLI_FILTERS.spec(filter_name).word_lists:
+                load_word_list(word_list_path)
+
+        inputs_hashes = {
+            (split, build.name): inputs_hash
+            for split, planned in plan.items()
+            for build, inputs_hash in planned
+        }
+        builds_by_name = {
+            build.name: build for planned in plan.values() for build, _ in planned
+        }
+        with mp.Pool(min(self.num_workers, len(tasks))) as pool:
+            for result in pool.imap_unordered(run_builds, tasks):
+                split = result["split"]
+                for name, (num_accepted, num_rejected) in result["counts"].items():
+                    build = builds_by_name[name]
+                    manifest = build.read_manifest()
+                    manifest[split] = {
+                        "inputs_hash": inputs_hashes[split, name],
+                        "filters": build.filter_names,
+                        "num_accepted": num_accepted,
+                        "num_rejected": num_rejected,
+                    }
+                    build.write_manifest(manifest)
+                    print(
+                        f"Built {name} ({split}): accepted {num_accepted}, rejected "
+                        f"{num_rejected}"
+                    )
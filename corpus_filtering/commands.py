@@ -0,0 +1,51 @@
+"""CLI subcommands other than the filters themselves (e.g. `dedup`).
+
+Commands mirror filter-writers: a command is a class that declares its CLI interface with
+the `cli_subcmd_constructor_kwargs` and `cli_subcmd_arguments` class variables (see
+`__main__.py` for how these are used), whose constructor accepts the parsed arguments as
+keyword arguments, and whose `run` method does the work.
+
+Like the built-in filters, commands are registered by import path in `CLI_COMMANDS`, so
+that a command's module (and its dependencies) is only imported when it is invoked.
+"""
+
+from abc import ABC, abstractmethod
+import importlib
+from typing import Type
+
+__all__ = ["CLI_COMMANDS", "CorpusCommand", "load_command"]
+
+
+class CorpusCommand(ABC):
+    """A CLI subcommand that is not a filter."""
+
+    @abstractmethod
+    def run(self):
+        """Execute the command."""
+
+
+CLI_COMMANDS: dict[str, str] = {
+    "blimp-corpus": "corpus_filtering.blimp:BlimpCorpusCommand",
+    "build-all": "corpus_filtering.build:BuildAllCommand",
+    "combine-masks": (
+        "corpus_filtering.corpus_views.masked_corpus_views:CombineMasksCommand"
+    ),
+    "dedup": "corpus_filtering.dedup:DedupCommand",
+    "export-dataset": "corpus_filtering.export:ExportDatasetCommand",
+    "plan": "corpus_filtering.plan:PlanCommand",
+    "reparse": "corpus_filtering.reparse:ReparseCommand",
+    "sample": "corpus_filtering.sampling:SampleCommand",
+    "validate": "corpus_filtering.validate:ValidateCommand",
+}
+
+
+def load_command(name: str) -> Type[CorpusCommand]:
+    """Import and return the class implementing a registered command.
+
+    Args:
+        name: The name of the CLI subcommand.
+    Returns:
+        The command class.
+    """
+    module_name, _, cls_name = CLI_COMMANDS[name].partition(":")
+    return getattr(importlib.import_module(module_name), cls_name)
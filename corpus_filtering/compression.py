@@ -0,0 +1,179 @@
+"""Helpers for transparently reading and writing zstd- or lz4-compressed corpus files.
+
+The codec is chosen by file extension: `.zst`/`.zstd` for zstd and `.lz4` for lz4. Any
+other extension means the file is read and written uncompressed, exactly as before.
+
+Text files (e.g. the plaintext filtered corpuses) are compressed as one continuous
+stream. Pickled `stanza.Document` files are instead compressed frame-per-document: every
+pickled object is compressed into its own, independent frame, and the frames are simply
+concatenated. This keeps the file a valid zstd/lz4 stream (i.e. `zstdcat`/`lz4cat` will
+still decompress the whole thing), while also preserving the byte-offset seeking NLTK's
+`StreamBackedCorpusView` relies on: every frame starts at a byte offset in the raw file,
+so seeking to the start of a frame and decompressing a single frame yields exactly one
+document.
+
+The `zstandard` and `lz4` packages are only required when actually reading or writing a
+file with the corresponding extension.
+"""
+
+import io
+import os
+import pickle
+from types import ModuleType
+from typing import IO, Any, BinaryIO, Optional
+
+__all__ = [
+    "get_codec",
+    "open_compressed",
+    "dump_pickle",
+    "load_pickle",
+]
+
+CODEC_EXTENSIONS = {
+    ".zst": "zstd",
+    ".zstd": "zstd",
+    ".lz4": "lz4",
+}
+
+# How many (compressed) bytes to read from the underlying file at a time when
+# decompressing a single frame. Any bytes read past the end of the frame are given back
+# by seeking backwards, so this only affects performance, not correctness.
+FRAME_READ_SIZE = 1 << 16
+
+
+def get_codec(path: str) -> Optional[str]:
+    """Infer the compression codec of a file from its extension.
+
+    Args:
+        path: Path to the (possibly compressed) file.
+
+    Returns:
+        "zstd" or "lz4" if the extension corresponds to one of those codecs, `None` if
+        the file is not compressed.
+    """
+    return CODEC_EXTENSIONS.get(os.path.splitext(str(path))[1].lower())
+
+
+def _import_codec(codec: str) -> ModuleType:
+    """Lazily import the module implementing a codec, so that the optional compression
+    dependencies are only needed by users who actually work with compressed files."""
+    package = {"zstd": "zstandard", "lz4": "lz4"}[codec]
+    try:
+        if codec == "zstd":
+            import zstandard
+
+            return zstandard
+        else:
+            import lz4.frame
+
+            return lz4.frame
+    except ImportError as e:
+        raise ImportError(
+            f"Reading or writing {codec}-compressed files requires the `{package}` "
+            f"package. Install it with `conda install {package}`."
+        ) from e
+
+
+def open_compressed(path: str, mode: str = "r", encoding: str = "utf-8") -> IO:
+    """Drop-in replacement for `open` that (de)compresses the file as a single stream if
+    its extension indicates it is compressed.
+
+    Args:
+        path: Path to the file.
+        mode: One of the usual `open` modes, e.g. "r", "w", "a", "rb" or "wb".
+        encoding: Encoding to use in text mode; ignored in binary mode.
+
+    Returns:
+        A file object. For uncompressed paths, this is exactly what `open` returns.
+    """
+    codec = get_codec(path)
+    binary = "b" in mode
+    if codec is None:
+        return open(path, mode, encoding=None if binary else encoding)
+
+    module = _import_codec(codec)
+    raw_mode = mode.replace("t", "").replace("b", "") + "b"
+    if codec == "zstd" and raw_mode == "rb":
+        # `zstandard.open` stops reading after the first frame by default, which would
+        # silently truncate files consisting of several concatenated frames.
+        stream: IO = module.ZstdDecompressor().stream_reader(
+            open(path, "rb"), read_across_frames=True
+        )
+        stream = io.BufferedReader(stream)  # type: ignore[arg-type]
+    else:
+        stream = module.open(path, raw_mode)
+    if binary:
+        return stream
+    return io.TextIOWrapper(stream, encoding=encoding)  # type: ignore[arg-type]
+
+
+def _compress_frame(data: bytes, codec: str) -> bytes:
+    """Compress `data` into a single, self-contained frame."""
+    module = _import_codec(codec)
+    if codec == "zstd":
+        return module.ZstdCompressor().compress(data)
+    return module.compress(data)
+
+
+def _read_frame(stream: BinaryIO, codec: str) -> bytes:
+    """Decompress exactly one frame starting at the current position of `stream`.
+
+    On return, `stream` is positioned at the first byte after the frame, i.e. at the
+    start of the next frame (or at EOF).
+
+    Raises:
+        EOFError: if `stream` is at EOF, or the file ends partway through the frame.
+    """
+    module = _import_codec(codec)
+    if codec == "zstd":
+        decompressor = module.ZstdDecompressor().decompressobj()
+    else:
+        decompressor = module.LZ4FrameDecompressor()
+
+    chunks = []
+    bytes_read = 0
+    while not decompressor.eof:
+        data = stream.read(FRAME_READ_SIZE)
+        if not data:
+            if bytes_read:
+                raise EOFError(f"Truncated {codec} frame at end of file.")
+            raise EOFError
+        bytes_read += len(data)
+        chunks.append(decompressor.decompress(data))
+
+    unused = len(decompressor.unused_data or b"")
+    if unused:
+        stream.seek(-unused, io.SEEK_CUR)
+    return b"".join(chunks)
+
+
+def dump_pickle(obj: Any, stream: BinaryIO, codec: Optional[str] = None) -> None:
+    """Pickle `obj` to `stream`, as its own compressed frame if `codec` is given.
+
+    Args:
+        obj: The object to pickle, typically a `stanza.Document`.
+        stream: A file object opened for (raw, uncompressed) binary writing.
+        codec: "zstd", "lz4" or `None`; see `get_codec`.
+    """
+    if codec is None:
+        pickle.dump(obj, stream)
+    else:
+        stream.write(_compress_frame(pickle.dumps(obj), codec))
+
+
+def load_pickle(stream: BinaryIO, codec: Optional[str] = None) -> Any:
+    """Unpickle the next object from `stream`, the inverse of `dump_pickle`.
+
+    Args:
+        stream: A file object opened for (raw, uncompressed) binary reading.
+        codec: "zstd", "lz4" or `None`; see `get_codec`.
+
+    Returns:
+        The next unpickled object.
+
+    Raises:
+        EOFError: if there are no more objects in the stream, as with `pickle.load`.
+    """
+    if codec is None:
+        return pickle.load(stream)
+    return pickle.loads(_read_frame(stream, codec))
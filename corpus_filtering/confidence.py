@@ -0,0 +1,223 @@
+"""Per-word confidence scores of Stanza's POS tags and dependency heads.
+
+Filters inherit the errors of the parses they read: a sentence whose construction the
+parser got wrong (e.g. a verb tagged as a noun) slips through. With `--confidence`,
+`stanza_serialize.py` also scores every word of every sentence it annotates, and writes
+the scores to a sidecar next to the annotated corpus (`<corpus>.conf`):
+
+    * the POS confidence of a word is the probability the tagger gave its most likely
+        UPOS tag;
+    * its head confidence is the probability the parser gave its most likely head.
+
+Both are quantized to a byte (0-255) each, so the sidecar is 2 bytes per word. The
+sentences whose least confident word falls below some threshold are the ones worth
+re-parsing (see `corpus_filtering.reparse`).
+
+Scoring runs the POS and depparse models of the pipeline over the annotated document
+once more, reading the probabilities their `predict` methods discard; it reaches into
+Stanza internals that are stable across 1.4-1.5, but may need updating for later
+versions.
+
+The sidecar is a sequence of blocks, one per `stanza.Document` of the corpus (so it can
+be appended to along with the corpus), each a one-line JSON header (the number of
+sentences and words) followed by the number of words of each sentence (unsigned 16-bit),
+the POS confidences and the head confidences of all the words.
+"""
+
+import json
+from array import array
+from collections.abc import Iterable
+from typing import IO
+
+__all__ = [
+    "CONFIDENCE_EXTENSION",
+    "score_document",
+    "write_confidences",
+    "ParseConfidences",
+]
+
+CONFIDENCE_EXTENSION = ".conf"
+
+
+def _quantize(probs) -> bytes:
+    """Quantize a (1-D) tensor of probabilities to a byte each."""
+    return bytes((probs * 255).round().byte().tolist())
+
+
+def _run_scored(processor, doc, data_loader_cls, unpack_batch, score_batch) -> list:
+    """Run a processor's model over an annotated document like its `process` method
+    does, but collect what `score_batch` returns for each sentence (rather than the
+    predictions), in document order."""
+    import torch
+    from stanza.models.common.utils import unsort
+
+    model = processor.trainer.model
+    device = next(model.parameters()).device
+    loader = data_loader_cls(
+        doc,
+        processor.config["batch_size"],
+        processor.config,
+        processor.pretrain,
+        vocab=processor.vocab,
+        evaluation=True,
+        sort_during_eval=True,
+    )
+    scores = []
+    model.eval()
+    with torch.no_grad():
+        for batch in loader:
+            inputs, orig_idx, word_orig_idx, sentlens, wordlens, text = unpack_batch(
+                batch, device
+            )
+            batch_scores = score_batch(
+                model, inputs, (word_orig_idx, sentlens, wordlens, text)
+            )
+            scores += unsort(batch_scores, orig_idx)
+    if loader.data_orig_idx is not None:
+        scores = unsort(scores, loader.data_orig_idx)
+    return scores
+
+
+def _pos_confidences(processor, doc) -> list[bytes]:
+    from stanza.models.pos.data import DataLoader
+    from stanza.models.pos.trainer import unpack_batch
+    from torch.nn.utils.rnn import (
+        PackedSequence,
+        pack_padded_sequence,
+        pad_packed_sequence,
+    )
+
+    def score_batch(model, inputs, rest):
+        # the tagger only returns its argmax, so capture the UPOS logits on the way
+        logits = []
+        hook = model.upos_clf.register_forward_hook(
+            lambda module, args, output: logits.append(output)
+        )
+        try:
+            model(*inputs, *rest)
+        finally:
+            hook.remove()
+        sentlens = rest[1]
+        batch_sizes = pack_padded_sequence(
+            inputs[0], sentlens, batch_first=True
+        ).batch_sizes
+        probs = pad_packed_sequence(
+            PackedSequence(logits[0], batch_sizes), batch_first=True
+        )[0]
+        probs = probs.softmax(-1).max(-1)[0].cpu()
+        return [_quantize(probs[i, :length]) for i, length in enumerate(sentlens)]
+
+    return _run_scored(processor, doc, DataLoader, unpack_batch, score_batch)
+
+
+def _head_confidences(processor, doc) -> list[bytes]:
+    import torch
+    from stanza.models.depparse.data import DataLoader
+    from stanza.models.depparse.trainer import unpack_batch
+
+    def score_batch(model, inputs, rest):
+        # log-probabilities of every head (incl. the root) of every word
+        _, preds = model(*inputs, *rest)
+        head_log_probs = torch.from_numpy(preds[0])
+        sentlens = rest[1]
+        return [
+            _quantize(head_log_probs[i, 1:length, :length].exp().max(-1)[0])
+            for i, length in enumerate(sentlens)
+        ]
+
+    return _run_scored(processor, doc, DataLoader, unpack_batch, score_batch)
+
+
+def score_document(pipeline, doc) -> list[tuple[bytes, bytes]]:
+    """Score the POS tags and dependency heads of an annotated document.
+
+    Args:
+        pipeline: The `stanza.Pipeline` that annotated the document.
+        doc: The annotated `stanza.Document`.
+    Returns:
+        The (POS confidences, head confidences) of every sentence, one byte per word.
+    """
+    pos = _pos_confidences(pipeline.processors["pos"], doc)
+    heads = _head_confidences(pipeline.processors["depparse"], doc)
+    for sent, sent_pos, sent_heads in zip(doc.sentences, pos, heads):
+        assert len(sent.words) == len(sent_pos) == len(sent_heads), "Misaligned scores"
+    return list(zip(pos, heads))
+
+
+def write_confidences(f: IO[bytes], confidences: Iterable[tuple[bytes, bytes]]):
+    """Append the confidences of the sentences of one document to a sidecar."""
+    confidences = list(confidences)
+    num_words = array("H", (len(pos) for pos, _ in confidences))
+    header = {"num_sents": len(confidences), "num_words": sum(num_words)}
+    f.write(json.dumps(header).encode("utf-8") + b"\n")
+    num_words.tofile(f)
+    for pos, _ in confidences:
+        f.write(pos)
+    for _, heads in confidences:
+        f.write(heads)
+
+
+class ParseConfidences:
+    """The confidence scores of the sentences of an annotated corpus, read from its
+    sidecar; sentences are numbered in corpus order, from 0."""
+
+    def __init__(self, word_offsets: array, pos: bytes, heads: bytes):
+        """Constructor for ParseConfidences.
+
+        Args:
+            word_offsets:
+                The index of the first word of every sentence among all words, followed
+                by the total number of words.
+            pos: The quantized POS confidence of every word.
+            heads: The quantized head confidence of every word.
+        """
+        self.word_offsets = word_offsets
+        self.pos = pos
+        self.heads = heads
+
+    @classmethod
+    def load(cls, path: str) -> "ParseConfidences":
+        """Read a sidecar written with `write_confidences`."""
+        word_offsets = array("Q", [0])
+        pos = bytearray()
+        heads = bytearray()
+        with open(path, "rb") as f:
+            while True:
+                line = f.readline()
+                if not line:
+                    break
+                header = json.loads(line)
+                num_words = array("H")
+                num_words.fromfile(f, header["num_sents"])
+                for count in num_words:
+                    word_offsets.append(word_offsets[-1] + count)
+                pos += f.read(header["num_words"])
+                heads += f.read(header["num_words"])
+        return cls(word_offsets, bytes(pos), bytes(heads))
+
+    def __len__(self) -> int:
+        return len(self.word_offsets) - 1
+
+    def sentence(self, sent_id: int) -> tuple[list[float], list[float]]:
+        """The (POS confidences, head confidences) of the words of a sentence."""
+        start, end = self.word_offsets[sent_id], self.word_offsets[sent_id + 1]
+        return (
+            [score / 255 for score in self.pos[start:end]],
+            [score / 255 for score in self.heads[start:end]],
+        )
+
+    def min_confidence(self, sent_id: int) -> float:
+        """The lowest confidence of any POS tag or head of a sentence."""
+        start, end = self.word_offsets[sent_id], self.word_offsets[sent_id + 1]
+        if start == end:
+            return 1.0
+        return min(min(self.pos[start:end]), min(self.heads[start:end])) / 255
+
+    def uncertain(self, threshold: float) -> list[int]:
+        """The IDs of the sentences with any POS tag or head less confident than
+        `threshold`."""
+        return [
+            sent_id
+            for sent_id in range(len(self))
+            if self.min_confidence(sent_id) < threshold
+        ]
@@ -1,3 +1,25 @@
-from .pickle_corpus_views import PickleStanzaDocCorpusView
+import importlib
 
-__all__ = ["PickleStanzaDocCorpusView"]
+from .compact_sentences import CompactSentence, CompactWord, Feats
+from .masked_corpus_views import MASK_EXTENSION, MaskedCorpusView
+from .sentence_index import SENTENCE_INDEX_EXTENSION, SentenceIndex
+
+__all__ = [
+    "CompactSentence",
+    "CompactWord",
+    "Feats",
+    "MASK_EXTENSION",
+    "MaskedCorpusView",
+    "PickleStanzaDocCorpusView",
+    "SENTENCE_INDEX_EXTENSION",
+    "SentenceIndex",
+]
+
+
+def __getattr__(name: str):
+    """Lazily import `PickleStanzaDocCorpusView` (PEP 562), so that importing this
+    package (e.g. for `MaskedCorpusView`) does not import nltk."""
+    if name == "PickleStanzaDocCorpusView":
+        module = importlib.import_module(f"{__name__}.pickle_corpus_views")
+        return module.PickleStanzaDocCorpusView
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
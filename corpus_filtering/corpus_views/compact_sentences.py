@@ -0,0 +1,154 @@
+"""Compact, slotted stand-ins for the Stanza `Sentence` and `Word` objects of a corpus.
+
+Stanza's `Word` keeps every annotation behind a property, and its `feats` is a
+"|"-joined string that filters search with `in` (e.g. `"Reflex=Yes" in word.feats`);
+its `Sentence` additionally holds the tokens, the entities, the constituency tree and
+the dependencies (tuples of full `Word` objects), all of which are built when a document
+is unpickled and kept alive for as long as any of its sentences is.
+
+`CompactSentence` and `CompactWord` keep only the attributes filters read:
+
+    * `CompactSentence`: `text`, `words` and `dependencies`;
+    * `CompactWord`: `id`, `text`, `lemma`, `upos`, `xpos`, `feats`, `head` and
+        `deprel`.
+
+Words are `__slots__` objects with plain attributes, and their strings are interned, so
+that e.g. every "nsubj" in a corpus is one object (and comparing it with "nsubj" is an
+identity check). `feats` is an interned `Feats` set of "Key=Value" strings, shared by
+all the words with the same features, in which `in` is a hash lookup. The dependencies are
+only built if a filter asks for them (many filters only look at `words` unless a trigger
+word occurs; see `corpus_filtering.filters.triggers`).
+
+`_exclude_sent` code written against Stanza objects runs unchanged on compact ones.
+Corpus views yield them when constructed with `compact=True` (filters: `--compact`).
+"""
+
+import sys
+from typing import Optional
+
+__all__ = ["Feats", "CompactWord", "CompactSentence"]
+
+# Upper bound on the number of distinct feature strings memoized by `Feats.of`
+MAX_FEATS_MEMO_SIZE = 1 << 16
+
+
+class Feats(frozenset):
+    """The morphological features of a word, as a set of "Key=Value" strings.
+
+    `str()` gives back the "|"-joined string Stanza stores, e.g. "Number=Sing|Person=3".
+    """
+
+    __slots__ = ("_feats",)
+
+    _memo: dict[str, "Feats"] = {}
+
+    def __new__(cls, feats: str):
+        self = super().__new__(cls, feats.split("|"))
+        self._feats = feats
+        return self
+
+    @classmethod
+    def of(cls, feats: Optional[str]) -> Optional["Feats"]:
+        """The (shared) `Feats` of a feature string, or `None` if there are none."""
+        if feats is None:
+            return None
+        memo = cls._memo
+        result = memo.get(feats)
+        if result is None:
+            result = cls(feats)
+            if len(memo) < MAX_FEATS_MEMO_SIZE:
+                memo[feats] = result
+        return result
+
+    def __reduce__(self):
+        return Feats.of, (self._feats,)
+
+    def __str__(self) -> str:
+        return self._feats
+
+    def __repr__(self) -> str:
+        return f"Feats({self._feats!r})"
+
+
+def _intern(string: Optional[str]) -> Optional[str]:
+    return None if string is None else sys.intern(string)
+
+
+class CompactWord:
+    """A word of a `CompactSentence`; see the module docstring."""
+
+    __slots__ = ("id", "text", "lemma", "upos", "xpos", "feats", "head", "deprel")
+
+    def __init__(
+        self,
+        id: int,
+        text: str,
+        lemma: Optional[str] = None,
+        upos: Optional[str] = None,
+        xpos: Optional[str] = None,
+        feats: Optional[Feats] = None,
+        head: Optional[int] = None,
+        deprel: Optional[str] = None,
+    ):
+        self.id = id
+        self.text = text
+        self.lemma = lemma
+        self.upos = upos
+        self.xpos = xpos
+        self.feats = feats
+        self.head = head
+        self.deprel = deprel
+
+    @classmethod
+    def from_stanza(cls, word) -> "CompactWord":
+        """Convert a Stanza `Word`."""
+        return cls(
+            word.id,
+            _intern(word.text),
+            _intern(word.lemma),
+            _intern(word.upos),
+            _intern(word.xpos),
+            Feats.of(word.feats),
+            word.head,
+            _intern(word.deprel),
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"CompactWord(id={self.id}, text={self.text!r}, lemma={self.lemma!r}, "
+            f"upos={self.upos!r}, head={self.head}, deprel={self.deprel!r})"
+        )
+
+
+# the head of the root word in `CompactSentence.dependencies`, like Stanza's
+ROOT = CompactWord(0, "ROOT")
+
+
+class CompactSentence:
+    """A sentence of compact words; see the module docstring."""
+
+    __slots__ = ("text", "words", "_dependencies")
+
+    def __init__(self, text: str, words: list[CompactWord]):
+        self.text = text
+        self.words = words
+        self._dependencies: Optional[list[tuple[CompactWord, str, CompactWord]]] = None
+
+    @classmethod
+    def from_stanza(cls, sent) -> "CompactSentence":
+        """Convert a Stanza `Sentence`."""
+        return cls(sent.text, [CompactWord.from_stanza(word) for word in sent.words])
+
+    @property
+    def dependencies(self) -> list[tuple[CompactWord, str, CompactWord]]:
+        """The (head, deprel, word) triple of every word, like Stanza's."""
+        if self._dependencies is None:
+            words = self.words
+            self._dependencies = [
+                (words[word.head - 1] if word.head else ROOT, word.deprel, word)
+                for word in words
+            ]
+        return self._dependencies
+
+    def __repr__(self) -> str:
+        return f"CompactSentence({self.text!r})"
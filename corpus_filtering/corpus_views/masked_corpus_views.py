@@ -0,0 +1,274 @@
+"""Filtered corpuses represented as masks over a base corpus, rather than as copies of it.
+
+A filtered corpus is usually almost all of its base corpus, so writing it out as text
+(as `train.accept.corpus`) duplicates multi-GB of data per filter. A `MaskedCorpusView`
+instead stores the path to the (plaintext) base corpus, a fingerprint of it, and a
+bitmap with one bit per sentence (i.e. per non-blank line) of the base corpus saying
+whether the sentence is kept. Iterating over the view streams the kept sentences from
+the base corpus, whitespace-normalized, exactly as a filter would have written them.
+
+Filters write masks when their accept output path ends in `.mask`. Masks over the same
+base corpus combine with `&` (kept by both filters), `|` (kept by either) and `~`, e.g.
+with the `combine-masks` command, so new combinations of filters need no refiltering.
+
+Mask files consist of a one-line JSON header (base corpus path and fingerprint, number
+of sentences, and for the masks written by a filter, which of its partitions the mask
+keeps) followed by the zlib-compressed bitmap, in which bit `i % 8` (least
+significant first) of byte `i // 8` is set if sentence `i` is kept.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import zlib
+from collections.abc import Iterable, Iterator
+from typing import Optional
+
+from corpus_filtering.commands import CorpusCommand
+from corpus_filtering.compression import open_compressed
+
+__all__ = [
+    "MASK_EXTENSION",
+    "corpus_fingerprint",
+    "count_sents",
+    "MaskedCorpusView",
+    "CombineMasksCommand",
+]
+
+MASK_EXTENSION = ".mask"
+
+# How much of the start and the end of the base corpus go into its fingerprint
+FINGERPRINT_CHUNK_SIZE = 1 << 20
+
+
+def corpus_fingerprint(path: str) -> str:
+    """Cheaply fingerprint a (possibly multi-GB) corpus file.
+
+    Hashes the size of the file and its first and last MiB, which catches the base
+    corpus being replaced, truncated or appended to, without reading all of it.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode("utf-8"), digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_CHUNK_SIZE))
+        if size > FINGERPRINT_CHUNK_SIZE:
+            f.seek(max(size - FINGERPRINT_CHUNK_SIZE, FINGERPRINT_CHUNK_SIZE))
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def count_sents(path: str) -> int:
+    """Count the sentences (non-blank lines) of a plaintext base corpus."""
+    with open_compressed(path, "r") as f:
+        return sum(1 for line in f if line.strip())
+
+
+class MaskedCorpusView:
+    """The sentences of a base corpus that are kept by a bitmap mask."""
+
+    def __init__(
+        self,
+        base_path: str,
+        bitmap: bytes,
+        num_sents: int,
+        fingerprint: Optional[str] = None,
+        partition: Optional[str] = None,
+    ):
+        """Constructor for MaskedCorpusView.
+
+        Args:
+            base_path: Path to the plaintext base corpus, one sentence per line.
+            bitmap: One bit per sentence of the base corpus; set if the sentence is kept.
+            num_sents: The number of sentences (non-blank lines) in the base corpus.
+            fingerprint:
+                The fingerprint of the base corpus when the mask was made. Optional; if
+                `None`, it is computed from the base corpus as it is now.
+            partition:
+                "accept" or "reject" if the mask keeps the sentences a filter accepted
+                or rejected, respectively. Optional; `None` for other masks, e.g.
+                combinations of masks of several filters.
+        """
+        assert partition in (None, "accept", "reject"), f"Invalid partition {partition}"
+        assert len(bitmap) == (num_sents + 7) // 8, "Bitmap does not match num_sents"
+        self.base_path = os.path.abspath(base_path)
+        self.bitmap = bytes(bitmap)
+        self.num_sents = num_sents
+        self.fingerprint = fingerprint or corpus_fingerprint(base_path)
+        self.partition = partition
+
+    @classmethod
+    def from_decisions(
+        cls,
+        base_path: str,
+        kept: Iterable[bool],
+        num_sents: Optional[int] = None,
+        partition: Optional[str] = None,
+    ) -> "MaskedCorpusView":
+        """Build a mask from one keep/drop decision per sentence of the base corpus."""
+        bitmap = bytearray((num_sents + 7) // 8 if num_sents is not None else 0)
+        idx = -1
+        for idx, keep in enumerate(kept):
+            if idx >> 3 >= len(bitmap):
+                bitmap.append(0)
+            if keep:
+                bitmap[idx >> 3] |= 1 << (idx & 7)
+        return cls(
+            base_path,
+            bitmap,
+            idx + 1 if num_sents is None else num_sents,
+            partition=partition,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "MaskedCorpusView":
+        """Read a mask file written by `save`."""
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            bitmap = zlib.decompress(f.read())
+        return cls(
+            header["base_path"],
+            bitmap,
+            header["num_sents"],
+            header["fingerprint"],
+            header.get("partition"),
+        )
+
+    def save(self, path: str):
+        """Write the mask to file."""
+        header = {
+            "base_path": self.base_path,
+            "fingerprint": self.fingerprint,
+            "num_sents": self.num_sents,
+            "num_kept": self.num_kept,
+            "partition": self.partition,
+        }
+        with open(path, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            f.write(zlib.compress(self.bitmap))
+
+    @property
+    def num_kept(self) -> int:
+        return bin(int.from_bytes(self.bitmap, "little")).count("1")
+
+    def __contains__(self, sent_id: int) -> bool:
+        """Whether the sentence with the given index in the base corpus is kept."""
+        return bool(self.bitmap[sent_id >> 3] >> (sent_id & 7) & 1)
+
+    def __len__(self) -> int:
+        return self.num_kept
+
+    def __iter__(self) -> Iterator[str]:
+        """Stream the kept sentences from the base corpus."""
+        assert (
+            corpus_fingerprint(self.base_path) == self.fingerprint
+        ), f"{self.base_path} has changed since the mask was made"
+        bitmap = self.bitmap
+        sent_id = 0
+        with open_compressed(self.base_path, "r") as f_base:
+            for line in f_base:
+                sent = " ".join(line.split())
+                if not sent:
+                    continue
+                if bitmap[sent_id >> 3] >> (sent_id & 7) & 1:
+                    yield sent
+                sent_id += 1
+        assert sent_id == self.num_sents, f"{self.base_path} has changed"
+
+    def _combine(self, other: "MaskedCorpusView", op) -> "MaskedCorpusView":
+        assert (
+            self.fingerprint == other.fingerprint and self.num_sents == other.num_sents
+        ), "Masks must be over the same base corpus"
+        bits = op(
+            int.from_bytes(self.bitmap, "little"),
+            int.from_bytes(other.bitmap, "little"),
+        )
+        return MaskedCorpusView(
+            self.base_path,
+            bits.to_bytes(len(self.bitmap), "little"),
+            self.num_sents,
+            self.fingerprint,
+            # e.g. the sentences rejected by either of two filters
+            self.partition if self.partition == other.partition else None,
+        )
+
+    def __and__(self, other: "MaskedCorpusView") -> "MaskedCorpusView":
+        return self._combine(other, lambda a, b: a & b)
+
+    def __or__(self, other: "MaskedCorpusView") -> "MaskedCorpusView":
+        return self._combine(other, lambda a, b: a | b)
+
+    def __invert__(self) -> "MaskedCorpusView":
+        all_sents = (1 << self.num_sents) - 1
+        bits = ~int.from_bytes(self.bitmap, "little") & all_sents
+        partition = {"accept": "reject", "reject": "accept"}.get(self.partition)
+        return MaskedCorpusView(
+            self.base_path,
+            bits.to_bytes(len(self.bitmap), "little"),
+            self.num_sents,
+            self.fingerprint,
+            partition,
+        )
+
+
+class CombineMasksCommand(CorpusCommand):
+    """Combine the masks written by several filters over the same base corpus.
+
+    With `--op and` (the default), the result keeps the sentences that every filter
+    kept, i.e. it is the corpus filtered by all of the filters at once; with `--op or`,
+    it keeps the sentences that any of the filters kept.
+    """
+
+    cli_subcmd_constructor_kwargs = {
+        "description": f"Description:\n{__doc__}",
+        "formatter_class": argparse.RawDescriptionHelpFormatter,
+    }
+
+    cli_subcmd_arguments = [
+        {
+            "args": ["out_path"],
+            "kwargs": {
+                "help": "Path to file where the combined mask should be written.",
+                "metavar": "output_mask_path",
+            },
+        },
+        {
+            "args": ["mask_paths"],
+            "kwargs": {
+                "nargs": "+",
+                "help": "Paths to the masks to combine.",
+                "metavar": "mask_path",
+            },
+        },
+        {
+            "args": ["--op"],
+            "kwargs": {
+                "choices": ["and", "or"],
+                "default": "and",
+                "help": "How to combine the masks. Default: %(default)s.",
+            },
+        },
+    ]
+
+    def __init__(self, out_path: str, mask_paths: list[str], op: str = "and"):
+        """Constructor for CombineMasksCommand.
+
+        Args:
+            out_path: Path to where the combined mask should be written.
+            mask_paths: Paths to the masks to combine.
+            op: "and" or "or".
+        """
+        self.out_path = out_path
+        self.mask_paths = mask_paths
+        self.op = op
+
+    def run(self):
+        combined = MaskedCorpusView.load(self.mask_paths[0])
+        for mask_path in self.mask_paths[1:]:
+            mask = MaskedCorpusView.load(mask_path)
+            combined = combined & mask if self.op == "and" else combined | mask
+        combined.save(self.out_path)
+        print(
+            f"Kept {combined.num_kept} of {combined.num_sents} sentences; wrote the "
+            f"combined mask to {self.out_path}."
+        )
@@ -1,8 +1,19 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
 from nltk.corpus.reader.util import PickleCorpusView
-import stanza
+
+from corpus_filtering.compression import get_codec, load_pickle
+from corpus_filtering.corpus_views.compact_sentences import CompactSentence
+from corpus_filtering.corpus_views.sentence_index import SentenceIndex
+from corpus_filtering.gc_tuning import collect_between_blocks
 
 __all__ = ["PickleStanzaDocCorpusView"]
 
+# How many decoded documents random access keeps in memory by default
+DEFAULT_DOC_CACHE_SIZE = 4
+
 
 class PickleStanzaDocCorpusView(PickleCorpusView):
     """Wrapper around NLTK's `PickleCorpusView` to read in pickled `stanza.Document`
@@ -15,17 +26,98 @@ class PickleStanzaDocCorpusView(PickleCorpusView):
         https://github.com/nltk/nltk/issues/2331
         https://github.com/nltk/nltk/issues/3124
 
+    If the file extension is `.zst`/`.zstd` or `.lz4`, each `Document` is expected to be
+    its own zstd/lz4 frame (as written by `stanza_serialize.py`); see
+    `corpus_filtering.compression` for details. Since every frame starts at a known
+    offset in the raw file, NLTK's byte-offset seeking works unchanged.
+
+    If `compact` is set, the sentences are converted to `CompactSentence` objects, which
+    filters can read like Stanza's, at a fraction of the memory; see
+    `corpus_filtering.corpus_views.compact_sentences`.
+
+    Iterating over the view reads the corpus sequentially, as NLTK does. Indexing it
+    (`view[i]`, `view[i:j]`) and `len(view)` instead go through a `SentenceIndex` of the
+    documents of the corpus (built and saved next to it on first use; see
+    `corpus_filtering.corpus_views.sentence_index`), so any sentence is read by
+    unpickling just the document that holds it, and the `doc_cache_size` documents read
+    last are kept in an LRU cache for nearby lookups. Slices are returned as lists.
+
     For more detailed documentation of this class and the methods below, please refer to
     the NLTK docs:
         https://www.nltk.org/api/nltk.corpus.reader.util.html#nltk.corpus.reader.util.PickleCorpusView
     """
 
-    def __init__(self, fileid, doc_block_size=1):
+    def __init__(
+        self,
+        fileid,
+        doc_block_size=1,
+        compact=False,
+        doc_cache_size=DEFAULT_DOC_CACHE_SIZE,
+    ):
         super().__init__(fileid)
         self._encoding = None  # This fixes the bug with NLTK's PickleCorpusView
+        self._codec = get_codec(fileid)
         self.BLOCK_SIZE = doc_block_size
+        self._compact = compact
+        # random access state: see `__getitem__`
+        self._sentence_index: Optional[SentenceIndex] = None
+        self._doc_cache: OrderedDict[int, list] = OrderedDict()
+        self._doc_cache_size = max(doc_cache_size, 1)
+        self._doc_stream = None
+        self._doc_lock = threading.Lock()
 
     def read_block(self, stream):
-        docs = super().read_block(stream)
+        collect_between_blocks()  # frees the blocks read so far, in "manual" GC mode
+        docs = []
+        for _ in range(self.BLOCK_SIZE):
+            try:
+                docs.append(load_pickle(stream, self._codec))
+            except EOFError:
+                break
         sents = [s for doc in docs for s in doc.sentences]  # flatten Sentence lists
+        if self._compact:
+            return [CompactSentence.from_stanza(s) for s in sents]
         return sents
+
+    @property
+    def sentence_index(self) -> SentenceIndex:
+        if self._sentence_index is None:
+            self._sentence_index = SentenceIndex.for_corpus(self._fileid)
+        return self._sentence_index
+
+    def __len__(self):
+        return len(self.sentence_index)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        doc_idx, sent_idx = self.sentence_index.locate(i)
+        return self._get_doc_sents(doc_idx)[sent_idx]
+
+    def _get_doc_sents(self, doc_idx: int) -> list:
+        """The sentences of a document, from the LRU cache or else read from file."""
+        with self._doc_lock:
+            sents = self._doc_cache.get(doc_idx)
+            if sents is not None:
+                self._doc_cache.move_to_end(doc_idx)
+                return sents
+            if self._doc_stream is None:
+                self._doc_stream = open(self._fileid, "rb")
+            self._doc_stream.seek(self.sentence_index.docs[doc_idx][0])
+            sents = load_pickle(self._doc_stream, self._codec).sentences
+            if self._compact:
+                sents = [CompactSentence.from_stanza(s) for s in sents]
+            self._doc_cache[doc_idx] = sents
+            if len(self._doc_cache) > self._doc_cache_size:
+                self._doc_cache.popitem(last=False)
+            return sents
+
+    def close(self):
+        super().close()
+        with self._doc_lock:
+            if self._doc_stream is not None:
+                self._doc_stream.close()
+            self._doc_stream = None
+            self._doc_cache.clear()
@@ -0,0 +1,182 @@
+"""A persistent index of the sentences of an annotated corpus, by document.
+
+An annotated corpus is a sequence of pickled `stanza.Document` objects, so finding its
+n-th sentence sequentially means unpickling every document before it. A `SentenceIndex`
+records the byte offset and first sentence of every document (like the index of
+`blimp-corpus`), so that the document holding any sentence can be read directly: see
+`PickleStanzaDocCorpusView.__getitem__`.
+
+Building an index takes one pass over the corpus, after which it is saved next to it
+(`<corpus>.index.json`) and reused as long as the corpus is unchanged. Annotated corpora
+are appended to one document at a time (by `stanza_serialize.py`), so if the corpus has
+grown since, and the bytes of its first and last indexed documents are unchanged (e.g.
+it was not serialized again, to the same path), only the new documents are indexed; if
+it changed in any other way, it is indexed again from scratch.
+"""
+
+import bisect
+import hashlib
+import json
+import os
+from typing import Optional
+
+from corpus_filtering.compression import get_codec, load_pickle
+from corpus_filtering.gc_tuning import collect_between_blocks, tune_gc
+
+__all__ = ["SENTENCE_INDEX_EXTENSION", "SentenceIndex"]
+
+SENTENCE_INDEX_EXTENSION = ".index.json"
+
+
+def _prefix_hash(corpus_path: str, docs: list[tuple[int, int]], end_offset: int) -> str:
+    """A digest of the bytes of the first and last indexed documents of a corpus."""
+    digest = hashlib.blake2b(digest_size=16)
+    if docs:
+        first_end = docs[1][0] if len(docs) > 1 else end_offset
+        with open(corpus_path, "rb") as f:
+            for start, end in {(docs[0][0], first_end), (docs[-1][0], end_offset)}:
+                f.seek(start)
+                digest.update(f.read(end - start))
+    return digest.hexdigest()
+
+
+class SentenceIndex:
+    """The byte offset and first sentence of every document of an annotated corpus."""
+
+    def __init__(
+        self,
+        docs: list[tuple[int, int]],
+        num_sents: int,
+        end_offset: int,
+        corpus_size: int,
+        corpus_mtime: float,
+        prefix_hash: str,
+    ):
+        """Constructor for SentenceIndex.
+
+        Args:
+            docs: The (byte offset, index of the first sentence) of every document.
+            num_sents: The number of sentences of the corpus.
+            end_offset: The byte offset right after the last document.
+            corpus_size: The size of the corpus file when it was indexed.
+            corpus_mtime: The modification time of the corpus file when it was indexed.
+            prefix_hash: A digest of the first and last indexed documents' bytes.
+        """
+        self.docs = docs
+        self.num_sents = num_sents
+        self.end_offset = end_offset
+        self.corpus_size = corpus_size
+        self.corpus_mtime = corpus_mtime
+        self.prefix_hash = prefix_hash
+        self._doc_starts = [start for _, start in docs]
+
+    def __len__(self) -> int:
+        return self.num_sents
+
+    def locate(self, sent_id: int) -> tuple[int, int]:
+        """The (index of the document, index within the document) of a sentence."""
+        if not 0 <= sent_id < self.num_sents:
+            raise IndexError("sentence index out of range")
+        doc_idx = bisect.bisect_right(self._doc_starts, sent_id) - 1
+        return doc_idx, sent_id - self._doc_starts[doc_idx]
+
+    @classmethod
+    def build(
+        cls, corpus_path: str, base: Optional["SentenceIndex"] = None
+    ) -> "SentenceIndex":
+        """Index a corpus in one pass, or only the documents after those of `base`."""
+        codec = get_codec(corpus_path)
+        stat = os.stat(corpus_path)
+        docs = list(base.docs) if base else []
+        num_sents = base.num_sents if base else 0
+        # every document is garbage as soon as it is counted, see `gc_tuning`
+        with tune_gc("manual"), open(corpus_path, "rb") as f:
+            f.seek(base.end_offset if base else 0)
+            while True:
+                offset = f.tell()
+                try:
+                    doc = load_pickle(f, codec)
+                except EOFError:
+                    break
+                docs.append((offset, num_sents))
+                num_sents += len(doc.sentences)
+                del doc
+                collect_between_blocks()
+        return cls(
+            docs,
+            num_sents,
+            offset,
+            stat.st_size,
+            stat.st_mtime,
+            _prefix_hash(corpus_path, docs, offset),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "SentenceIndex":
+        with open(path, "r") as f:
+            index = json.load(f)
+        return cls(
+            [tuple(doc) for doc in index["docs"]],
+            index["num_sents"],
+            index["end_offset"],
+            index["corpus_size"],
+            index["corpus_mtime"],
+            # indexes saved before prefix hashes were recorded are never extended
+            index.get("prefix_hash", ""),
+        )
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "num_sents": self.num_sents,
+                    "end_offset": self.end_offset,
+                    "corpus_size": self.corpus_size,
+                    "corpus_mtime": self.corpus_mtime,
+                    "prefix_hash": self.prefix_hash,
+                    "docs": self.docs,
+                },
+                f,
+            )
+
+    def is_current(self, corpus_path: str) -> bool:
+        """Whether the corpus is unchanged since it was indexed."""
+        stat = os.stat(corpus_path)
+        return (self.corpus_size, self.corpus_mtime) == (stat.st_size, stat.st_mtime)
+
+    @classmethod
+    def load_current(cls, corpus_path: str) -> Optional["SentenceIndex"]:
+        """The index of a corpus saved next to it, if any and if it is up to date."""
+        index_path = corpus_path + SENTENCE_INDEX_EXTENSION
+        if not os.path.exists(index_path):
+            return None
+        index = cls.load(index_path)
+        return index if index.is_current(corpus_path) else None
+
+    def is_prefix_of(self, corpus_path: str) -> bool:
+        """Whether the corpus still starts with the documents indexed, so that the
+        index can be extended with the documents appended since."""
+        return self.corpus_size <= os.stat(corpus_path).st_size and (
+            self.prefix_hash == _prefix_hash(corpus_path, self.docs, self.end_offset)
+        )
+
+    @classmethod
+    def for_corpus(cls, corpus_path: str) -> "SentenceIndex":
+        """The index of a corpus: loaded from its sidecar if it is up to date, and
+        otherwise (re)built, and saved if the sidecar's directory is writable."""
+        index_path = corpus_path + SENTENCE_INDEX_EXTENSION
+        index = None
+        if os.path.exists(index_path):
+            index = cls.load(index_path)
+            if index.is_current(corpus_path):
+                return index
+        if index is not None and index.is_prefix_of(corpus_path):
+            # appended to (or touched) since: index the new documents, if any
+            index = cls.build(corpus_path, base=index)
+        else:
+            index = cls.build(corpus_path)
+        try:
+            index.save(index_path)
+        except OSError:
+            pass  # e.g. a read-only directory; the index is just not reused
+        return index
@@ -0,0 +1,258 @@
+"""Sentence-level deduplication of plaintext corpuses, so that each distinct sentence is
+annotated and filtered only once.
+
+Deduplication runs ahead of annotation. It writes the unique sentences of a corpus (in
+order of first occurrence) to a new corpus, along with a dedup index, which records which
+unique sentence each line of the original corpus is a copy of. Only the unique corpus is
+annotated and filtered; when a filter is given the dedup index, it re-expands its
+decisions to every line of the original corpus, so its outputs contain the same
+sentences, in the same order and with the same multiplicity, as if the original corpus
+had been annotated and filtered directly. For example:
+
+    python -m corpus_filtering dedup train.corpus train.uniq.corpus train.dedup
+    python stanza_serialize.py w train.uniq.corpus train.uniq.pkl
+    python -m corpus_filtering passive train.uniq.pkl train.accept.corpus \\
+        -r train.reject.corpus --dedup-index train.dedup
+
+Sentences are compared by the 64-bit BLAKE2b fingerprint of their normalized form, where
+normalization only collapses runs of whitespace, since anything more aggressive (e.g.
+lowercasing) could change the annotations and therefore the filters' decisions. Blank
+lines are dropped, just as annotating the original corpus would drop them. With 64-bit
+fingerprints, the probability of any collision is negligible (about 3 in a million for
+10 million distinct sentences).
+
+The dedup index file consists of a one-line JSON header, followed by one unsigned 32-bit
+unique-sentence ID per line of the original corpus, followed by the 64-bit fingerprint of
+every unique sentence, in unique-ID order. The latter serve as a compact on-disk hash set
+of the sentences in the corpus (see `DedupIndex.lookup`).
+"""
+
+import argparse
+from array import array
+import hashlib
+import json
+import os
+from typing import Optional, TextIO
+
+from tqdm import tqdm
+
+from corpus_filtering.commands import CorpusCommand
+from corpus_filtering.compression import open_compressed
+from corpus_filtering.sentence_ids import SentenceIdWriter
+
+__all__ = ["normalize_sent", "fingerprint", "DedupIndex", "DedupCommand"]
+
+# unique-sentence ID of blank lines, which do not correspond to any sentence
+NO_SENT = 0xFFFFFFFF
+
+
+def normalize_sent(line: str) -> str:
+    """Normalize a line of a whitespace-tokenized corpus by collapsing whitespace.
+
+    For pretokenized input, this is also the text of the `Sentence` Stanza produces.
+    """
+    return " ".join(line.split())
+
+
+def fingerprint(sent: str) -> int:
+    """Compute the 64-bit fingerprint of a normalized sentence."""
+    digest = hashlib.blake2b(sent.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class DedupIndex:
+    """Mapping from the lines of a corpus to the unique sentences they are copies of."""
+
+    def __init__(self, source_path: str, unique_ids: array, fingerprints: array):
+        """Constructor for DedupIndex.
+
+        Args:
+            source_path: Path to the original (non-deduplicated) corpus.
+            unique_ids:
+                Array (typecode "I") with the ID of the unique sentence on each line of
+                the original corpus, or `NO_SENT` for blank lines.
+            fingerprints:
+                Array (typecode "Q") with the fingerprint of each unique sentence.
+        """
+        self.source_path = source_path
+        self.unique_ids = unique_ids
+        self.fingerprints = fingerprints
+        self._fingerprint_to_id: Optional[dict[int, int]] = None
+
+    @property
+    def num_unique(self) -> int:
+        return len(self.fingerprints)
+
+    @classmethod
+    def build(cls, f_in_path: str, f_unique_out_path: str) -> "DedupIndex":
+        """Deduplicate a corpus, writing its unique sentences to file.
+
+        Args:
+            f_in_path: Path to the original corpus, one sentence per line.
+            f_unique_out_path: Path to where the unique sentences should be written.
+        Returns:
+            The dedup index of the original corpus.
+        """
+        unique_ids = array("I")
+        fingerprints = array("Q")
+        seen: dict[int, int] = {}
+        with open_compressed(f_in_path, "r") as f_in, open_compressed(
+            f_unique_out_path, "w"
+        ) as f_out:
+            for line in tqdm(f_in, desc="Deduplicating lines", dynamic_ncols=True):
+                sent = normalize_sent(line)
+                if not sent:
+                    unique_ids.append(NO_SENT)
+                    continue
+                fp = fingerprint(sent)
+                unique_id = seen.get(fp)
+                if unique_id is None:
+                    unique_id = seen[fp] = len(fingerprints)
+                    fingerprints.append(fp)
+                    f_out.write(f"{sent}\n")
+                unique_ids.append(unique_id)
+        index = cls(os.path.abspath(f_in_path), unique_ids, fingerprints)
+        index._fingerprint_to_id = seen
+        return index
+
+    def save(self, path: str):
+        """Write the dedup index to file."""
+        header = {
+            "source_path": self.source_path,
+            "num_lines": len(self.unique_ids),
+            "num_unique": self.num_unique,
+        }
+        with open(path, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            self.unique_ids.tofile(f)
+            self.fingerprints.tofile(f)
+
+    @classmethod
+    def load(cls, path: str) -> "DedupIndex":
+        """Read a dedup index written by `save`."""
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            unique_ids = array("I")
+            unique_ids.fromfile(f, header["num_lines"])
+            fingerprints = array("Q")
+            fingerprints.fromfile(f, header["num_unique"])
+        return cls(header["source_path"], unique_ids, fingerprints)
+
+    def lookup(self, sent: str) -> Optional[int]:
+        """Find the unique-sentence ID of a sentence by its fingerprint.
+
+        Args:
+            sent: The sentence; it is normalized before fingerprinting.
+        Returns:
+            The ID of the sentence among the unique sentences, or `None` if the sentence
+            does not occur in the corpus.
+        """
+        if self._fingerprint_to_id is None:
+            self._fingerprint_to_id = {fp: i for i, fp in enumerate(self.fingerprints)}
+        return self._fingerprint_to_id.get(fingerprint(normalize_sent(sent)))
+
+    def expand(
+        self,
+        rejects: bytearray,
+        f_accept_out: TextIO,
+        f_reject_out: Optional[TextIO] = None,
+        source_path: Optional[str] = None,
+        accept_ids: Optional[SentenceIdWriter] = None,
+        reject_ids: Optional[SentenceIdWriter] = None,
+    ):
+        """Re-expand per-unique-sentence filter decisions to the original corpus.
+
+        Streams the original corpus and writes each of its (non-blank) lines to the
+        accept or reject output according to the decision for its unique sentence.
+
+        Args:
+            rejects:
+                The filter decision (nonzero meaning reject) for each unique sentence,
+                in unique-ID order.
+            f_accept_out: File handle where accepted sentences should be written.
+            f_reject_out:
+                File handle where rejected sentences should be written. Optional; if
+                `None`, rejected sentences will be discarded.
+            source_path:
+                Path to the original corpus, if it has moved since the index was built.
+            accept_ids:
+                Where to record the IDs (in the original corpus) of the accepted
+                sentences. Optional; see `corpus_filtering.sentence_ids`.
+            reject_ids: Likewise, for the rejected sentences.
+        """
+        assert (
+            len(rejects) == self.num_unique
+        ), f"Got {len(rejects)} decisions for {self.num_unique} unique sentences!"
+        sent_id = -1
+        with open_compressed(source_path or self.source_path, "r") as f_source:
+            for line, unique_id in zip(f_source, self.unique_ids):
+                if unique_id == NO_SENT:
+                    continue
+                sent_id += 1
+                out_line = f"{normalize_sent(line)}\n"
+                if not rejects[unique_id]:
+                    f_accept_out.write(out_line)
+                    if accept_ids is not None:
+                        accept_ids.add(sent_id)
+                elif f_reject_out:
+                    f_reject_out.write(out_line)
+                    if reject_ids is not None:
+                        reject_ids.add(sent_id)
+
+
+class DedupCommand(CorpusCommand):
+    """Deduplicate a plaintext corpus (one sentence per line) ahead of annotation.
+
+    Writes the unique sentences of the corpus, in order of first occurrence, and a dedup
+    index. Annotate the unique sentences, then pass the dedup index to a filter with
+    `--dedup-index` to get outputs identical to filtering the original corpus.
+    """
+
+    cli_subcmd_constructor_kwargs = {
+        "description": f"Description:\n{__doc__}",
+        "formatter_class": argparse.RawDescriptionHelpFormatter,
+    }
+
+    cli_subcmd_arguments = [
+        {
+            "args": ["f_in_path"],
+            "kwargs": {
+                "help": "Path to the input corpus.",
+                "metavar": "input_file_path",
+            },
+        },
+        {
+            "args": ["f_unique_out_path"],
+            "kwargs": {
+                "help": "Path to file where the unique sentences should be written.",
+                "metavar": "unique_file_path",
+            },
+        },
+        {
+            "args": ["index_path"],
+            "kwargs": {
+                "help": "Path to file where the dedup index should be written.",
+                "metavar": "index_file_path",
+            },
+        },
+    ]
+
+    def __init__(self, f_in_path: str, f_unique_out_path: str, index_path: str):
+        """Constructor for DedupCommand.
+
+        Args:
+            f_in_path: Path to the input corpus.
+            f_unique_out_path: Path to where the unique sentences should be written.
+            index_path: Path to where the dedup index should be written.
+        """
+        self.f_in_path = f_in_path
+        self.f_unique_out_path = f_unique_out_path
+        self.index_path = index_path
+
+    def run(self):
+        index = DedupIndex.build(self.f_in_path, self.f_unique_out_path)
+        index.save(self.index_path)
+        print(
+            f"Kept {index.num_unique} unique sentences out of {len(index.unique_ids)} "
+            f"lines; wrote the dedup index to {self.index_path}."
+        )
@@ -0,0 +1,282 @@
+"""Export of a (filtered) corpus as a pre-tokenized, sharded training dataset.
+
+Training tokenizes its corpus on the fly, so every run (i.e. every architecture and seed)
+re-tokenizes the same accepted sentences. `export-dataset` instead tokenizes them once,
+and writes the token IDs to shards that dataloaders can memory-map and stream without
+running the tokenizer at all. For example:
+
+    python -m corpus_filtering passive train.pkl train.accept.corpus -r train.reject.corpus
+    python -m corpus_filtering export-dataset train.accept.corpus passive-train/
+
+By default the sentences are split into 256 shards, which matches the training config
+(`train_shards_per_worker: 32` times `dataloader_num_workers: 8`), so that each
+dataloader worker streams its own shards. Sentences are assigned to shards in order, in
+contiguous runs of (almost) equal numbers of sentences.
+
+The output directory contains, for every shard `i`:
+
+    * `shard-{i:05d}.ids`: the token IDs of all the sentences in the shard, concatenated,
+        as a flat array of the dtype recorded in the manifest (native byte order).
+    * `shard-{i:05d}.offsets`: `num_sents + 1` uint64 offsets into the `.ids` array,
+        such that sentence `j` of the shard is `ids[offsets[j]:offsets[j + 1]]`.
+
+as well as `manifest.json`, which records the dtype, the number of shards, sentences
+and tokens, and the source corpus and tokenizer. `TokenShard` and `load_shards` read the
+shards back with `numpy.memmap`.
+"""
+
+import argparse
+import itertools
+import json
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+from corpus_filtering.commands import CorpusCommand
+from corpus_filtering.compression import open_compressed
+from corpus_filtering.corpus_views.masked_corpus_views import (
+    MASK_EXTENSION,
+    MaskedCorpusView,
+)
+from corpus_filtering.filters.word_lists import resolve_data_path
+
+__all__ = ["TokenShard", "load_shards", "ExportDatasetCommand"]
+
+DEFAULT_TOKENIZER = "models/tokenizer/gulordava.json"
+# `train_shards_per_worker` * `dataloader_num_workers` in `config/train.yaml`
+DEFAULT_NUM_SHARDS = 32 * 8
+MANIFEST_NAME = "manifest.json"
+# How many sentences to tokenize per call to the (multithreaded) tokenizer
+TOKENIZE_BATCH_SIZE = 10000
+
+
+def shard_file_name(shard_idx: int, kind: str) -> str:
+    return f"shard-{shard_idx:05d}.{kind}"
+
+
+class TokenShard:
+    """Memory-mapped, read-only view of the tokenized sentences in one shard."""
+
+    def __init__(self, dataset_dir: str, shard_idx: int, dtype: str):
+        """Constructor for TokenShard.
+
+        Args:
+            dataset_dir: The output directory of `export-dataset`.
+            shard_idx: The index of the shard.
+            dtype: The dtype of the token IDs, as recorded in the manifest.
+        """
+        self.offsets = np.memmap(
+            os.path.join(dataset_dir, shard_file_name(shard_idx, "offsets")),
+            dtype=np.uint64,
+            mode="r",
+        )
+        ids_path = os.path.join(dataset_dir, shard_file_name(shard_idx, "ids"))
+        # `np.memmap` cannot map empty files
+        self.ids = (
+            np.memmap(ids_path, dtype=dtype, mode="r")
+            if os.path.getsize(ids_path)
+            else np.empty(0, dtype=dtype)
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        """The token IDs of the `idx`-th sentence of the shard."""
+        if idx < 0:
+            idx += len(self)
+        return self.ids[self.offsets[idx] : self.offsets[idx + 1]]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+def load_shards(dataset_dir: str) -> list[TokenShard]:
+    """Open all the shards written by `export-dataset` to a directory."""
+    with open(os.path.join(dataset_dir, MANIFEST_NAME), "r") as f:
+        manifest = json.load(f)
+    return [
+        TokenShard(dataset_dir, shard_idx, manifest["dtype"])
+        for shard_idx in range(manifest["num_shards"])
+    ]
+
+
+class ExportDatasetCommand(CorpusCommand):
+    """Tokenize a plaintext corpus once and write it as sharded, memory-mappable arrays
+    of token IDs, for training without on-the-fly tokenization.
+    """
+
+    cli_subcmd_constructor_kwargs = {
+        "description": f"Description:\n{__doc__}",
+        "formatter_class": argparse.RawDescriptionHelpFormatter,
+    }
+
+    cli_subcmd_arguments = [
+        {
+            "args": ["f_in_path"],
+            "kwargs": {
+                "help": "Path to the (e.g. accepted) corpus, one sentence per line, "
+                "or to a .mask over a base corpus.",
+                "metavar": "input_file_path",
+            },
+        },
+        {
+            "args": ["out_dir"],
+            "kwargs": {
+                "help": "Directory where the shards and manifest should be written.",
+                "metavar": "output_dir",
+            },
+        },
+        {
+            "args": ["-t", "--tokenizer"],
+            "kwargs": {
+                "default": DEFAULT_TOKENIZER,
+                "dest": "tokenizer_path",
+                "help": "Path to a `tokenizers` JSON file, relative to the working "
+                "directory or else to the repository root. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["-n", "--num-shards"],
+            "kwargs": {
+                "type": int,
+                "default": DEFAULT_NUM_SHARDS,
+                "dest": "num_shards",
+                "help": "Number of shards. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["--no-special-tokens"],
+            "kwargs": {
+                "action": "store_false",
+                "dest": "add_special_tokens",
+                "help": "Do not add the tokenizer's special tokens (e.g. BOS/EOS).",
+            },
+        },
+    ]
+
+    def __init__(
+        self,
+        f_in_path: str,
+        out_dir: str,
+        tokenizer_path: str = DEFAULT_TOKENIZER,
+        num_shards: int = DEFAULT_NUM_SHARDS,
+        add_special_tokens: bool = True,
+    ):
+        """Constructor for ExportDatasetCommand.
+
+        Args:
+            f_in_path:
+                Path to the corpus, one sentence per line, or to a `MaskedCorpusView`
+                saved as a `.mask` file.
+            out_dir: Directory where the shards and manifest should be written.
+            tokenizer_path: Path to the `tokenizers` JSON file.
+            num_shards: Number of shards.
+            add_special_tokens: Whether to add the tokenizer's special tokens.
+        """
+        assert num_shards > 0, "There must be at least one shard"
+        self.f_in_path = f_in_path
+        self.out_dir = out_dir
+        # relative to the working directory, or else to the repository root
+        self.tokenizer_path = (
+            tokenizer_path
+            if os.path.exists(tokenizer_path)
+            else resolve_data_path(tokenizer_path)
+        )
+        self.num_shards = num_shards
+        self.add_special_tokens = add_special_tokens
+
+    def _iter_sents(self):
+        if self.f_in_path.endswith(MASK_EXTENSION):
+            yield from MaskedCorpusView.load(self.f_in_path)
+            return
+        with open_compressed(self.f_in_path, "r") as f_in:
+            for line in f_in:
+                sent = line.strip()
+                if sent:
+                    yield sent
+
+    def run(self):
+        from tokenizers import Tokenizer
+
+        tokenizer = Tokenizer.from_file(str(self.tokenizer_path))
+        dtype = np.dtype(
+            np.uint16 if tokenizer.get_vocab_size() <= 1 << 16 else np.uint32
+        )
+
+        # a first, cheap pass to count the sentences, so that shards can be contiguous
+        num_sents = sum(1 for _ in self._iter_sents())
+        shard_bounds = [
+            num_sents * shard_idx // self.num_shards
+            for shard_idx in range(self.num_shards + 1)
+        ]
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        sents = iter(
+            tqdm(
+                self._iter_sents(),
+                total=num_sents,
+                desc="Tokenizing sentences",
+                dynamic_ncols=True,
+            )
+        )
+        num_tokens = 0
+        for shard_idx in range(self.num_shards):
+            shard_size = shard_bounds[shard_idx + 1] - shard_bounds[shard_idx]
+            num_tokens += self._write_shard(
+                shard_idx, itertools.islice(sents, shard_size), tokenizer, dtype
+            )
+
+        manifest = {
+            "source_path": os.path.abspath(self.f_in_path),
+            "tokenizer_path": os.path.abspath(self.tokenizer_path),
+            "add_special_tokens": self.add_special_tokens,
+            "dtype": dtype.name,
+            "num_shards": self.num_shards,
+            "num_sents": num_sents,
+            "num_tokens": num_tokens,
+            "shard_num_sents": [
+                end - start for start, end in zip(shard_bounds, shard_bounds[1:])
+            ],
+        }
+        with open(os.path.join(self.out_dir, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f, indent=2)
+        print(
+            f"Wrote {num_sents} sentences ({num_tokens} tokens) in {self.num_shards} "
+            f"shards to {self.out_dir}."
+        )
+
+    def _write_shard(self, shard_idx: int, sents, tokenizer, dtype: np.dtype) -> int:
+        """Tokenize the sentences of one shard and write its `.ids` and `.offsets`."""
+        offset = 0
+        with open(
+            os.path.join(self.out_dir, shard_file_name(shard_idx, "ids")), "wb"
+        ) as f_ids, open(
+            os.path.join(self.out_dir, shard_file_name(shard_idx, "offsets")), "wb"
+        ) as f_offsets:
+            np.zeros(1, dtype=np.uint64).tofile(f_offsets)
+            while True:
+                batch = list(itertools.islice(sents, TOKENIZE_BATCH_SIZE))
+                if not batch:
+                    break
+                encodings = tokenizer.encode_batch(
+                    batch, add_special_tokens=self.add_special_tokens
+                )
+                lengths = np.fromiter(
+                    (len(encoding.ids) for encoding in encodings),
+                    dtype=np.uint64,
+                    count=len(encodings),
+                )
+                ids = np.fromiter(
+                    itertools.chain.from_iterable(
+                        encoding.ids for encoding in encodings
+                    ),
+                    dtype=dtype,
+                    count=int(lengths.sum()),
+                )
+                ids.tofile(f_ids)
+                (offset + np.cumsum(lengths)).astype(np.uint64).tofile(f_offsets)
+                offset += int(lengths.sum())
+        return offset
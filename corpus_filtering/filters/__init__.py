@@ -1,15 +1,158 @@
 from collections.abc import Iterable
+import importlib
 from typing import List, Type
 
 from .core_filters import *
-from .core_filters import CLI_FILTERS
-from .stanza_filters import (
-    PickleStanzaDocCorpusFilterWriter,
-    NModNSubjFilteredCorpusWriter,
-)
+from .core_filters import CLI_FILTERS, FilterSpec, register_lazy_filter
 
 __all__ = [
     "CLI_FILTERS",
+    "FilterSpec",
     "PickleStanzaDocCorpusFilterWriter",
     "NModNSubjFilteredCorpusWriter",
 ]
+
+# Filters that ship with this package. They are registered by their specs so that
+# importing this package (and e.g. running `python -m corpus_filtering --help`) does not
+# import `stanza_filters`, and with it, stanza and torch.
+_STANZA_FILTERS = "corpus_filtering.filters.stanza_filters"
+for _spec in [
+    FilterSpec(
+        "pp-mod-subj",
+        f"{_STANZA_FILTERS}:NModNSubjFilteredCorpusWriter",
+        annotations=("depparse",),
+        blimp_paradigms=("distractor_agreement_relational_noun",),
+    ),
+    FilterSpec(
+        "rel-cl",
+        f"{_STANZA_FILTERS}:RelativeClauseFilteredCorpusWriter",
+        annotations=("depparse",),
+        blimp_paradigms=("distractor_agreement_relative_clause",),
+    ),
+    FilterSpec(
+        "re-irr-sv-agr",
+        f"{_STANZA_FILTERS}:NSubjBlimpFilteredCorpusWriter",
+        annotations=("depparse",),
+        word_lists=("data/blimp/re-irr-sv-agr/nouns.txt",),
+        blimp_paradigms=(
+            "regular_plural_subject_verb_agreement_1",
+            "regular_plural_subject_verb_agreement_2",
+            "irregular_plural_subject_verb_agreement_1",
+            "irregular_plural_subject_verb_agreement_2",
+        ),
+    ),
+    FilterSpec(
+        "superlative-quantifier",
+        f"{_STANZA_FILTERS}:SuperlativeQuantifierFilteredCorpusWriter",
+        annotations=("pos", "depparse"),
+        blimp_paradigms=(
+            "superlative_quantifiers_1",
+            "superlative_quantifiers_2",
+        ),
+    ),
+    FilterSpec(
+        "existential-there-quantifier",
+        f"{_STANZA_FILTERS}:ExistentialThereQuantifierFilteredCorpusWriter",
+        annotations=("lemma", "depparse"),
+        blimp_paradigms=("existential_there_quantifiers_1",),
+    ),
+    FilterSpec(
+        "det-adj-noun",
+        f"{_STANZA_FILTERS}:DeterminerAdjectiveNounFilteredCorpusWriter",
+        annotations=("pos",),
+        blimp_paradigms=(
+            "determiner_noun_agreement_with_adjective_1",
+            "determiner_noun_agreement_with_adj_2",
+            "determiner_noun_agreement_with_adj_irregular_1",
+            "determiner_noun_agreement_with_adj_irregular_2",
+        ),
+    ),
+    FilterSpec(
+        "det-noun",
+        f"{_STANZA_FILTERS}:DeterminerNounAgreementFilteredCorpusWriter",
+        annotations=("lemma", "depparse"),
+        word_lists=("data/blimp/det-noun/nouns.txt",),
+        blimp_paradigms=(
+            "determiner_noun_agreement_1",
+            "determiner_noun_agreement_2",
+            "determiner_noun_agreement_irregular_1",
+            "determiner_noun_agreement_irregular_2",
+        ),
+    ),
+    FilterSpec(
+        "binding-c-command",
+        f"{_STANZA_FILTERS}:BindingCCommandFilteredCorpusWriter",
+        annotations=("pos", "depparse"),
+        blimp_paradigms=("principle_A_c_command",),
+    ),
+    FilterSpec(
+        "binding-case",
+        f"{_STANZA_FILTERS}:BindingCaseFilteredCorpusWriter",
+        annotations=("pos", "depparse"),
+        blimp_paradigms=(
+            "principle_A_case_1",
+            "principle_A_case_2",
+        ),
+    ),
+    FilterSpec(
+        "binding-domain",
+        f"{_STANZA_FILTERS}:BindingDomainFilteredCorpusWriter",
+        annotations=("pos", "depparse"),
+        blimp_paradigms=(
+            "principle_A_domain_1",
+            "principle_A_domain_2",
+            "principle_A_domain_3",
+        ),
+    ),
+    FilterSpec(
+        "binding-reconstruction",
+        f"{_STANZA_FILTERS}:BindingReconstructionFilteredCorpusWriter",
+        annotations=("pos", "depparse"),
+        blimp_paradigms=("principle_A_reconstruction",),
+    ),
+    FilterSpec(
+        "passive",
+        f"{_STANZA_FILTERS}:PassiveFilteredCorpusWriter",
+        annotations=("pos", "lemma", "depparse"),
+        word_lists=("data/blimp/passive/verbs.txt",),
+        blimp_paradigms=(
+            "passive_1",
+            "passive_2",
+        ),
+    ),
+    FilterSpec(
+        "npi-only",
+        f"{_STANZA_FILTERS}:OnlyNPIFilteredCorpusWriter",
+        annotations=("depparse",),
+        word_lists=("data/blimp/npi/npis.txt",),
+        blimp_paradigms=(
+            "only_npi_licensor_present",
+            "only_npi_scope",
+        ),
+    ),
+    FilterSpec(
+        "npi-sent-neg",
+        f"{_STANZA_FILTERS}:SententialNegationNPIFilteredCorpusWriter",
+        annotations=("depparse",),
+        word_lists=("data/blimp/npi/npis.txt",),
+        blimp_paradigms=(
+            "sentential_negation_npi_licensor_present",
+            "sentential_negation_npi_scope",
+        ),
+    ),
+    FilterSpec(
+        "npi-sim-ques",
+        f"{_STANZA_FILTERS}:SimpleQuestionNPIFilteredCorpusWriter",
+        annotations=("depparse",),
+        word_lists=("data/blimp/npi/npis.txt",),
+        blimp_paradigms=("matrix_question_npi_licensor_present",),
+    ),
+]:
+    register_lazy_filter(_spec)
+
+
+def __getattr__(name: str):
+    """Lazily import the classes re-exported from `stanza_filters` (PEP 562)."""
+    if name in ("PickleStanzaDocCorpusFilterWriter", "NModNSubjFilteredCorpusWriter"):
+        return getattr(importlib.import_module(_STANZA_FILTERS), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,11 +1,31 @@
 from abc import abstractmethod, ABC
+from collections.abc import Callable, Iterator, Mapping
+from dataclasses import dataclass, replace
 import functools
+import importlib
+import importlib.metadata
 from typing import final, Generator, Generic, Optional, TextIO, Type, TypeVar, Union
+import warnings
 
 from tqdm import tqdm
 
+from corpus_filtering.compression import open_compressed
+from corpus_filtering.corpus_views.masked_corpus_views import (
+    MASK_EXTENSION,
+    MaskedCorpusView,
+    count_sents,
+)
+from corpus_filtering.dedup import NO_SENT, DedupIndex
+from corpus_filtering.gc_tuning import GC_MODES, tune_gc
+from corpus_filtering.sentence_ids import IDS_EXTENSION, SentenceIdWriter
+from corpus_filtering.stats import FilterStats
+from corpus_filtering.threaded_io import DEFAULT_QUEUE_DEPTH, BackgroundWriter
+
 __all__ = [
     "register_filter",
+    "register_lazy_filter",
+    "FilterSpec",
+    "FilterRegistry",
     "CorpusFilterWriter",
     "CorpusFilterTextFileWriter",
 ]
@@ -29,10 +49,38 @@ class CorpusFilterWriter(ABC, Generic[T]):
     (adjusting their constructors accordingly).
     """
 
+    # statistics collected during `filter_write`, if any, and where to save them; see
+    # `corpus_filtering.stats`
+    _stats: Optional[FilterStats] = None
+    _stats_path: Optional[str] = None
+    # what caused the last rejected sentence to be rejected, if the filter records it
+    _last_trigger: Optional[str] = None
+    # how the cyclic GC is tuned during `filter_write`; see `corpus_filtering.gc_tuning`
+    _gc_mode: str = "default"
+
     @final
     def filter_write(self):
-        for sent in tqdm(self._get_sents(), desc="Filtering lines", dynamic_ncols=True):
-            self._write(sent, reject=self._exclude_sent(sent))
+        stats = self._stats
+        exclude_sent = self._sent_predicate()
+        with tune_gc(self._gc_mode) as gc_monitor:
+            sents = tqdm(self._get_sents(), desc="Filtering lines", dynamic_ncols=True)
+            if stats is None:
+                for sent in sents:
+                    self._write(sent, reject=exclude_sent(sent))
+            else:
+                for sent in sents:
+                    self._last_trigger = None
+                    reject = exclude_sent(sent)
+                    stats.add(
+                        self._sent_num_tokens(sent),
+                        reject,
+                        self._last_trigger if reject else None,
+                    )
+                    self._write(sent, reject)
+            self._finish()
+        if stats is not None:
+            stats.gc = gc_monitor.to_dict()
+            stats.save(self._stats_path)
 
     def __enter__(self):
         """Used by Python's `with` statement."""
@@ -83,6 +131,31 @@ class CorpusFilterWriter(ABC, Generic[T]):
             match that expected by `_exclude_sent` and `_write`.
         """
 
+    def _sent_predicate(self) -> Callable[[T], bool]:
+        """The predicate `filter_write` evaluates on every sentence: `_exclude_sent`,
+        unless a subclass wraps it (e.g. to also evaluate it on alternative analyses of
+        the sentence)."""
+        return self._exclude_sent
+
+    def _finish(self):
+        """Hook called by `filter_write` once every sentence has been processed, e.g. to
+        flush output that subclasses buffer in `_write`."""
+        pass
+
+    def _sent_num_tokens(self, sent: T) -> int:
+        """The length of a sentence in tokens, for statistics. Subclasses may override
+        this if their atoms are not whitespace-tokenized strings."""
+        return len(str(sent).split())
+
+    def _triggered_by(self, trigger: Optional[str]) -> bool:
+        """Record what caused the sentence to be rejected (e.g. the lemma of a word from
+        a word list), for statistics, and return True.
+
+        Meant to be used as `return self._triggered_by(word.lemma)` in `_exclude_sent`.
+        """
+        self._last_trigger = trigger
+        return True
+
     @abstractmethod
     def _write(self, sent: T, reject: bool):
         """Process the writing to disk of a given input atom based on the given
@@ -110,6 +183,29 @@ class CorpusFilterTextFileWriter(CorpusFilterWriter[T]):
     of the input corpus' atoms to a string value, e.g. if the input corpus' atoms
     consist of structured or annotated data.
 
+    Output paths ending in `.zst`/`.zstd` or `.lz4` are transparently compressed with
+    zstd or lz4, respectively; see `corpus_filtering.compression`.
+
+    If the input corpus is the deduplicated version of some original corpus, pass the
+    dedup index to have the outputs re-expanded to the original corpus, in its order and
+    with its duplicates; see `corpus_filtering.dedup`. In that case, the outputs are
+    written once all sentences have been processed, from the (normalized) lines of the
+    original corpus rather than from `_sent_to_str`.
+
+    If the accept output path ends in `.mask`, no text is written: instead, once all
+    sentences have been processed, a `MaskedCorpusView` of the accepted sentences over
+    the plaintext base corpus (the original corpus of the dedup index, if any, or else
+    the one passed as `base_corpus_path`) is saved there, and likewise for the rejected
+    sentences if the reject output path ends in `.mask`; see
+    `corpus_filtering.corpus_views.masked_corpus_views`.
+
+    With `write_ids`, the position in the source corpus of every sentence of each text
+    output is also recorded in a `.ids` sidecar next to it; see
+    `corpus_filtering.sentence_ids`.
+
+    By default, outputs are written by background threads, so that filtering does not
+    wait on storage; see `corpus_filtering.threaded_io`.
+
     It is recommended that this class and its subclasses be used with a `with` block to
     ensure that the output file handles are properly closed on garbage collection or
     program exit.
@@ -119,21 +215,98 @@ class CorpusFilterTextFileWriter(CorpusFilterWriter[T]):
         {
             "args": ["f_accept_out_path"],
             "kwargs": {
-                "help": "Path to file where accepted sentences should be written.",
+                "help": "Path to file where accepted sentences should be written. "
+                "Compressed if the extension is .zst or .lz4; written as a mask over "
+                "the base corpus if the extension is .mask.",
                 "metavar": "accepted_file_path",
             },
         },
         {
             "args": ["-r", "--reject"],
             "kwargs": {
-                "help": "Path to file where rejected sentences should be written.",
+                "help": "Path to file where rejected sentences should be written. "
+                "Compressed if the extension is .zst or .lz4; written as a mask over "
+                "the base corpus if the extension is .mask.",
                 "metavar": "rejected_file_path",
                 "dest": "f_reject_out_path",
             },
         },
+        {
+            "args": ["--dedup-index"],
+            "kwargs": {
+                "help": "Path to the dedup index (written by the `dedup` command) of the "
+                "original corpus, if the input corpus is deduplicated. The outputs are "
+                "then re-expanded to the lines of the original corpus.",
+                "metavar": "dedup_index_path",
+                "dest": "dedup_index_path",
+            },
+        },
+        {
+            "args": ["--stats"],
+            "kwargs": {
+                "help": "Path to file where statistics about the accepted and rejected "
+                "sentences (counts, lengths, top triggers) should be written as JSON.",
+                "metavar": "stats_path",
+                "dest": "stats_path",
+            },
+        },
+        {
+            "args": ["--ids"],
+            "kwargs": {
+                "action": "store_true",
+                "help": "Also write the IDs (positions in the source corpus) of the "
+                "sentences of each text output to a sidecar file, named after the "
+                "output with an added .ids extension.",
+                "dest": "write_ids",
+            },
+        },
+        {
+            "args": ["--gc"],
+            "kwargs": {
+                "choices": GC_MODES,
+                "default": "default",
+                "help": "How to tune Python's cyclic garbage collector during the "
+                "filtering pass: leave it as is (default), freeze the objects made at "
+                "startup and collect less often (freeze), or also collect only between "
+                "blocks of the input (manual). GC pauses are reported in --stats.",
+                "dest": "gc_mode",
+            },
+        },
+        {
+            "args": ["--io-queue-depth"],
+            "kwargs": {
+                "type": int,
+                "default": DEFAULT_QUEUE_DEPTH,
+                "help": "How many chunks of output (and batches of input, for filters "
+                "that read in the background) may wait on I/O threads before filtering "
+                "blocks; 0 does all I/O on the main thread. Default: %(default)s.",
+                "metavar": "io_queue_depth",
+                "dest": "io_queue_depth",
+            },
+        },
+        {
+            "args": ["--base-corpus"],
+            "kwargs": {
+                "help": "Path to the plaintext corpus the input corpus was annotated "
+                "from, over which .mask outputs are written. Not needed with "
+                "--dedup-index.",
+                "metavar": "base_corpus_path",
+                "dest": "base_corpus_path",
+            },
+        },
     ]
 
-    def __init__(self, f_accept_out_path: str, f_reject_out_path: Optional[str] = None):
+    def __init__(
+        self,
+        f_accept_out_path: str,
+        f_reject_out_path: Optional[str] = None,
+        dedup_index_path: Optional[str] = None,
+        base_corpus_path: Optional[str] = None,
+        stats_path: Optional[str] = None,
+        io_queue_depth: int = DEFAULT_QUEUE_DEPTH,
+        write_ids: bool = False,
+        gc_mode: str = "default",
+    ):
         """Constructor for CorpusFilterTextFileWriter.
 
         Args:
@@ -143,13 +316,86 @@ class CorpusFilterTextFileWriter(CorpusFilterWriter[T]):
             f_reject_out_path:
                 Path to where sentences for which the predicate evaluates True should
                 be written. Optional; if `None`, rejected sentences will be discarded.
+            dedup_index_path:
+                Path to the dedup index of the original corpus, if the input corpus is
+                deduplicated. Optional; if `None`, sentences are written as they are
+                processed.
+            base_corpus_path:
+                Path to the plaintext corpus the input corpus was annotated from, over
+                which `.mask` outputs are written. Only needed for `.mask` outputs
+                without a dedup index.
+            stats_path:
+                Path to where statistics about the filter's decisions should be written
+                as JSON. Optional; if `None`, no statistics are collected.
+            io_queue_depth:
+                The maximum number of chunks of output waiting to be written by the
+                background writer threads (see `corpus_filtering.threaded_io`). If 0,
+                outputs are written synchronously.
+            write_ids:
+                Whether to write the IDs of the sentences of each text output to a
+                `.ids` sidecar next to it; see `corpus_filtering.sentence_ids`.
+            gc_mode:
+                How to tune the cyclic GC during `filter_write`: "default", "freeze" or
+                "manual"; see `corpus_filtering.gc_tuning`.
         """
-        self._f_accept_out: Optional[TextIO] = open(
-            f_accept_out_path, "w", encoding="utf-8"
-        )
+        self._f_accept_out: Optional[TextIO] = None
         self._f_reject_out: Optional[TextIO] = None
-        if f_reject_out_path:
-            self._f_reject_out = open(f_reject_out_path, "w", encoding="utf-8")
+        self._accept_mask_path: Optional[str] = None
+        self._reject_mask_path: Optional[str] = None
+        if f_accept_out_path.endswith(MASK_EXTENSION):
+            self._accept_mask_path = f_accept_out_path
+            if f_reject_out_path:
+                assert f_reject_out_path.endswith(
+                    MASK_EXTENSION
+                ), "Reject output must also be a .mask if the accept output is"
+                self._reject_mask_path = f_reject_out_path
+        else:
+            assert not (
+                f_reject_out_path and f_reject_out_path.endswith(MASK_EXTENSION)
+            ), "Reject output can only be a .mask if the accept output is"
+            self._f_accept_out = self._open_out(f_accept_out_path, io_queue_depth)
+            if f_reject_out_path:
+                self._f_reject_out = self._open_out(f_reject_out_path, io_queue_depth)
+
+        self._dedup_index: Optional[DedupIndex] = None
+        # filter decisions (nonzero meaning reject), buffered if the outputs are only
+        # written by `_finish`
+        self._rejects = bytearray()
+        if dedup_index_path:
+            self._dedup_index = DedupIndex.load(dedup_index_path)
+        self._base_corpus_path = base_corpus_path
+        if stats_path:
+            self._stats = FilterStats()
+            self._stats_path = stats_path
+        self._gc_mode = gc_mode
+        if self._accept_mask_path:
+            assert (
+                self._dedup_index or base_corpus_path
+            ), "Writing a .mask requires the base corpus (or a dedup index)"
+
+        # sidecars of the IDs of the sentences in the text outputs, and the ID of the
+        # next sentence (if written as it is processed)
+        self._accept_ids: Optional[SentenceIdWriter] = None
+        self._reject_ids: Optional[SentenceIdWriter] = None
+        self._next_sent_id = 0
+        if write_ids and not self._accept_mask_path:
+            ids_base_path = base_corpus_path
+            if self._dedup_index is not None:
+                ids_base_path = self._dedup_index.source_path
+            self._accept_ids = SentenceIdWriter(
+                f_accept_out_path + IDS_EXTENSION, ids_base_path
+            )
+            if f_reject_out_path:
+                self._reject_ids = SentenceIdWriter(
+                    f_reject_out_path + IDS_EXTENSION, ids_base_path
+                )
+
+    @staticmethod
+    def _open_out(path: str, io_queue_depth: int) -> TextIO:
+        f_out = open_compressed(path, "w")
+        if io_queue_depth > 0:
+            return BackgroundWriter(f_out, io_queue_depth)  # type: ignore[return-value]
+        return f_out
 
     def close(self):
         """Do file handle cleanup so this class can be used in a `with` block."""
@@ -159,6 +405,12 @@ class CorpusFilterTextFileWriter(CorpusFilterWriter[T]):
         if self._f_reject_out is not None:
             self._f_reject_out.close()
             self._f_reject_out = None
+        if self._accept_ids is not None:
+            self._accept_ids.close()
+            self._accept_ids = None
+        if self._reject_ids is not None:
+            self._reject_ids.close()
+            self._reject_ids = None
 
     def _sent_to_str(self, sent: T) -> str:
         """Method that subclasses may override if the type of input corpus' atoms are
@@ -184,16 +436,225 @@ class CorpusFilterTextFileWriter(CorpusFilterWriter[T]):
                 `_exclude_sent` and generated by `_get_sents`.
             reject: boolean governing how this sentence is sorted.
         """
+        if self._dedup_index is not None or self._accept_mask_path:
+            self._rejects.append(reject)
+            return
         sent_str = self._sent_to_str(sent)
         out_line = f"{sent_str}\n"
         assert self._f_accept_out is not None, "Accept output file was closed!"
+        sent_id = self._next_sent_id
+        self._next_sent_id += 1
         if not reject:
             self._f_accept_out.write(out_line)
+            if self._accept_ids is not None:
+                self._accept_ids.add(sent_id)
         elif reject and self._f_reject_out:
             self._f_reject_out.write(out_line)
+            if self._reject_ids is not None:
+                self._reject_ids.add(sent_id)
+
+    def _finish(self):
+        """Write the buffered decisions as masks, or re-expand them to the original
+        corpus if deduplicated."""
+        if self._accept_mask_path:
+            self._write_masks()
+        elif self._dedup_index is not None:
+            assert self._f_accept_out is not None, "Accept output file was closed!"
+            self._dedup_index.expand(
+                self._rejects,
+                self._f_accept_out,
+                self._f_reject_out,
+                accept_ids=self._accept_ids,
+                reject_ids=self._reject_ids,
+            )
+
+    def _write_masks(self):
+        rejects = self._rejects
+        if self._dedup_index is not None:
+            base_path = self._base_corpus_path or self._dedup_index.source_path
+            kept = (
+                not rejects[unique_id]
+                for unique_id in self._dedup_index.unique_ids
+                if unique_id != NO_SENT
+            )
+            num_sents = None
+        else:
+            base_path = self._base_corpus_path
+            kept = (not reject for reject in rejects)
+            # e.g. if Stanza split a line of the base corpus into two sentences, the
+            # decisions would be misaligned with the lines they are masking
+            num_sents = count_sents(base_path)
+            assert num_sents == len(rejects), (
+                f"{base_path} has {num_sents} sentences (non-blank lines), but the "
+                f"filter made {len(rejects)} decisions"
+            )
+        accept_mask = MaskedCorpusView.from_decisions(
+            base_path, kept, num_sents, partition="accept"
+        )
+        accept_mask.save(self._accept_mask_path)
+        if self._reject_mask_path:
+            (~accept_mask).save(self._reject_mask_path)
+
+
+ENTRY_POINT_GROUP = "corpus_filtering.filters"
+
+
+@dataclass(frozen=True)
+class FilterSpec:
+    """Metadata describing a filter that is available without importing the filter's
+    implementation (and its dependencies).
+
+    Attributes:
+        name:
+            The name of the CLI subcommand associated with the filter.
+        import_path:
+            Where to find the filter class, as "package.module:ClassName".
+        annotations:
+            The Stanza annotation layers (processors) the filter's predicate reads, e.g.
+            ("pos", "depparse"). Empty for filters over plain text.
+        word_lists:
+            Paths, relative to the repository root, of the word lists the filter reads.
+        blimp_paradigms:
+            The BLiMP paradigms the filter targets, i.e. whose `sentence_good`
+            sentences it should reject (see the `validate` command).
+    """
+
+    name: str
+    import_path: str
+    annotations: tuple[str, ...] = ()
+    word_lists: tuple[str, ...] = ()
+    blimp_paradigms: tuple[str, ...] = ()
+
+    def load(self) -> Type[CorpusFilterWriter]:
+        """Import and return the filter class."""
+        module_name, _, cls_name = self.import_path.partition(":")
+        return getattr(importlib.import_module(module_name), cls_name)
+
+
+class FilterRegistry(Mapping[str, Type[CorpusFilterWriter]]):
+    """Mapping of CLI subcommand names to filter classes, which are imported lazily.
 
+    Every filter is registered as a `FilterSpec`, either explicitly (see
+    `register_lazy_filter`), implicitly when its class is decorated with
+    `@register_filter`, or through the "corpus_filtering.filters" entry-point group,
+    which lets filters defined in other packages register themselves. A filter's module
+    is only imported the first time the filter class is looked up, so listing the
+    registered filters and their metadata (e.g. for `--help`) never imports `stanza` or
+    any other heavy dependency of the filters.
 
-CLI_FILTERS: dict[str, Type[CorpusFilterWriter]] = {}
+    Out-of-tree filters register by declaring an entry point whose value is a
+    `FilterSpec` (defined in a module that is cheap to import) in their `setup.py`:
+
+        entry_points={
+            "corpus_filtering.filters": ["my-filter = my_package.specs:MY_FILTER_SPEC"],
+        }
+
+    An entry point may also point directly at a filter class. Entry points are never
+    loaded just to list the registered filters: a filter's entry point is only loaded
+    when its metadata (`spec`) or class is looked up, and one that fails to load is
+    warned about and left without metadata, rather than breaking every subcommand.
+
+    Note that iterating over `items()` or `values()` will import every registered filter.
+    """
+
+    def __init__(self):
+        self._specs: dict[str, FilterSpec] = {}
+        self._classes: dict[str, Type[CorpusFilterWriter]] = {}
+        self._entry_points_loaded = False
+        # the names of the filters registered through entry points that were not loaded
+        # yet, whose specs only hold the entry point's value as `import_path`
+        self._unresolved: set[str] = set()
+
+    def __getitem__(self, name: str) -> Type[CorpusFilterWriter]:
+        if name not in self._classes:
+            spec = self.spec(name)  # which may load the class, for an entry point
+            if name not in self._classes:
+                # importing the module registers the class itself via
+                # `@register_filter`, but load it explicitly in case it is not decorated
+                self._classes[name] = spec.load()
+        return self._classes[name]
+
+    def __iter__(self) -> Iterator[str]:
+        self._load_entry_points()
+        return iter(self._specs)
+
+    def __len__(self) -> int:
+        self._load_entry_points()
+        return len(self._specs)
+
+    def __contains__(self, name: object) -> bool:
+        self._load_entry_points()
+        return name in self._specs
+
+    def spec(self, name: str) -> FilterSpec:
+        """Return the metadata of a registered filter without importing it.
+
+        For a filter registered through an entry point, this loads the entry point
+        (which should point at a `FilterSpec`, in a module that is cheap to import).
+        """
+        self._load_entry_points()
+        if name in self._unresolved:
+            self._resolve_entry_point(name)
+        return self._specs[name]
+
+    def register(self, spec: FilterSpec, filter_cls: Optional[Type] = None):
+        """Register a filter by its spec, and optionally its (already imported) class.
+
+        Registering a class under a name that was previously registered lazily with the
+        import path of that very class (which is what happens when the module containing
+        a lazily-registered filter is imported) simply resolves the lazy entry.
+        """
+        if spec.name in self._unresolved and filter_cls is not None:
+            # the class of a filter registered through an entry point was imported
+            # before the entry point was loaded
+            self._unresolved.discard(spec.name)
+            self._specs[spec.name] = spec
+        existing = self._specs.get(spec.name)
+        assert (
+            existing is None or existing.import_path == spec.import_path
+        ), "Duplicate filter name registered to CLI"
+        if existing is None:
+            self._specs[spec.name] = spec
+        if filter_cls is not None:
+            self._classes[spec.name] = filter_cls
+
+    def _load_entry_points(self):
+        """Register the filters advertised through entry points, on first use."""
+        if self._entry_points_loaded:
+            return
+        self._entry_points_loaded = True
+
+        entry_points = importlib.metadata.entry_points()
+        if hasattr(entry_points, "select"):  # Python >= 3.10
+            group = entry_points.select(group=ENTRY_POINT_GROUP)
+        else:
+            group = entry_points.get(ENTRY_POINT_GROUP, [])
+        for entry_point in group:
+            if entry_point.name in self._specs:
+                warnings.warn(f"Ignoring duplicate filter entry point {entry_point}")
+                continue
+            self.register(
+                FilterSpec(entry_point.name, entry_point.value.replace(" ", ""))
+            )
+            self._unresolved.add(entry_point.name)
+
+    def _resolve_entry_point(self, name: str):
+        """Load the entry point of a filter, replacing its placeholder spec with the
+        `FilterSpec` the entry point points at, if it does."""
+        self._unresolved.discard(name)
+        placeholder = self._specs[name]
+        try:
+            target = placeholder.load()
+        except Exception as e:
+            warnings.warn(f"Could not load the entry point of filter {name}: {e!r}")
+            return
+        if isinstance(target, FilterSpec):
+            self._specs[name] = replace(target, name=name)
+        else:
+            self._classes[name] = target
+
+
+CLI_FILTERS = FilterRegistry()
 
 
 def register_filter(name=None):
@@ -204,6 +665,11 @@ def register_filter(name=None):
     with the filter will be named whatever the class is named, or pass an optional name
     parameter, e.g. `@register_filter("MyFilter")` or `@register_filter("name=MyFilter")`.
 
+    Filters registered with this decorator are only available once the module defining
+    them has been imported. To make a filter available to the CLI without importing its
+    module up front, also register its `FilterSpec` with `register_lazy_filter` or
+    through an entry point; see `FilterRegistry`.
+
     See __main__.py for more information.
     """
 
@@ -211,9 +677,21 @@ def register_filter(name=None):
         name = name or filter_cls.__name__
         # prohibit subcommands with whitespace in name (we might want to change this?)
         name = "".join(name.split())
-        assert name not in CLI_FILTERS, "Duplicate filter name registered to CLI"
-        CLI_FILTERS[name] = filter_cls
+        import_path = f"{filter_cls.__module__}:{filter_cls.__qualname__}"
+        CLI_FILTERS.register(FilterSpec(name, import_path), filter_cls)
 
         return filter_cls
 
     return functools.partial(decorate, name=name)
+
+
+def register_lazy_filter(spec: FilterSpec):
+    """Declare a filter part of the public CLI API without importing it.
+
+    The module containing the filter is only imported if the filter is actually used
+    (e.g. chosen as the CLI subcommand).
+
+    Args:
+        spec: The metadata of the filter, including where to import it from.
+    """
+    CLI_FILTERS.register(spec)
@@ -1,13 +1,19 @@
 import argparse
+from abc import abstractmethod
+from collections.abc import Callable
 from typing import Generator, Optional
 
-from stanza.models.common.doc import Sentence as StanzaSentence
+from stanza.models.common.doc import Sentence as StanzaSentence, Word as StanzaWord
 
 from corpus_filtering.filters.core_filters import (
     register_filter,
     CorpusFilterTextFileWriter,
 )
-from corpus_filtering.corpus_views import PickleStanzaDocCorpusView
+from corpus_filtering.corpus_views import CompactSentence, PickleStanzaDocCorpusView
+from corpus_filtering.filters.triggers import load_trigger_matcher, TriggerMatcher
+from corpus_filtering.filters.word_lists import load_word_list, WordList
+from corpus_filtering.reparse import AltParseCache, sent_fingerprint
+from corpus_filtering.threaded_io import DEFAULT_QUEUE_DEPTH, prefetch
 
 __all__ = [
     "PickleStanzaDocCorpusFilterWriter",
@@ -15,6 +21,10 @@ __all__ = [
     "RelativeClauseFilteredCorpusWriter",
     "NSubjBlimpFilteredCorpusWriter",
     "SuperlativeQuantifierFilteredCorpusWriter",
+    "NPIFilteredCorpusWriter",
+    "OnlyNPIFilteredCorpusWriter",
+    "SententialNegationNPIFilteredCorpusWriter",
+    "SimpleQuestionNPIFilteredCorpusWriter",
 ]
 
 
@@ -37,10 +47,43 @@ class PickleStanzaDocCorpusFilterWriter(CorpusFilterTextFileWriter[StanzaSentenc
         {
             "args": ["f_in"],
             "kwargs": {
-                "help": "Path to the input corpus.",
+                "help": "Path to the input corpus. Read as a sequence of zstd/lz4 "
+                "frames if the extension is .zst or .lz4.",
                 "metavar": "input_file_path",
             },
         },
+        {
+            "args": ["--compact"],
+            "kwargs": {
+                "action": "store_true",
+                "help": "Convert the input sentences to compact, slotted objects before "
+                "filtering them, which filters read like Stanza's but which take much "
+                "less memory. Only for filters that read no other annotations than "
+                "the words' text, lemma, upos, xpos, feats, head and deprel.",
+                "dest": "compact",
+            },
+        },
+        {
+            "args": ["--alt-parses"],
+            "kwargs": {
+                "help": "Path to a cache of alternative parses of the uncertain "
+                "sentences of the input corpus (see the `reparse` command). If given, "
+                "sentences that have alternatives are rejected if the predicate "
+                "rejects any of their top-k parses.",
+                "dest": "alt_parses_dir",
+            },
+        },
+        {
+            "args": ["--top-k"],
+            "kwargs": {
+                "type": int,
+                "default": 3,
+                "help": "How many parses of each sentence to evaluate the predicate on "
+                "with --alt-parses: the original one and up to k-1 alternatives. "
+                "Default: %(default)s.",
+                "dest": "top_k",
+            },
+        },
     ]
 
     cli_subcmd_arguments.extend(
@@ -53,11 +96,23 @@ class PickleStanzaDocCorpusFilterWriter(CorpusFilterTextFileWriter[StanzaSentenc
         f_accept_out_path: str,
         f_reject_out_path: Optional[str] = None,
         doc_block_size: int = 1,
+        dedup_index_path: Optional[str] = None,
+        base_corpus_path: Optional[str] = None,
+        stats_path: Optional[str] = None,
+        io_queue_depth: int = DEFAULT_QUEUE_DEPTH,
+        write_ids: bool = False,
+        compact: bool = False,
+        gc_mode: str = "default",
+        alt_parses_dir: Optional[str] = None,
+        top_k: int = 3,
     ):
         """Constructor for PickleStanzaDocCorpusFilterWriter.
 
         Args:
-            f_in: Path to the file containing the pickled `stanza.Document` objects.
+            f_in:
+                Path to the file containing the pickled `stanza.Document` objects,
+                compressed frame-per-document if its extension is `.zst`/`.zstd` or
+                `.lz4`.
             f_accept_out_path:
                 Path to where sentences for which the predicate evaluates False should
                 be written.
@@ -67,10 +122,61 @@ class PickleStanzaDocCorpusFilterWriter(CorpusFilterTextFileWriter[StanzaSentenc
             doc_block_size:
                 the number of `stanza.Document` objects that should be unpickled and
                 processed at a time.
+            dedup_index_path:
+                Path to the dedup index of the original corpus, if the input corpus was
+                annotated from a deduplicated corpus. Optional; see
+                `CorpusFilterTextFileWriter`.
+            base_corpus_path:
+                Path to the plaintext corpus that was annotated, over which `.mask`
+                outputs are written. Optional; see `CorpusFilterTextFileWriter`.
+            stats_path:
+                Path to where statistics about the filter's decisions should be written.
+                Optional; see `CorpusFilterTextFileWriter`.
+            io_queue_depth:
+                The maximum number of batches of input read ahead, and of chunks of
+                output waiting to be written, by background threads. If 0, all I/O is
+                done synchronously.
+            write_ids:
+                Whether to write the IDs of the sentences of each text output to a
+                `.ids` sidecar. Optional; see `CorpusFilterTextFileWriter`.
+            compact:
+                Whether to filter `CompactSentence` objects rather than Stanza
+                `Sentence` objects; see `corpus_views.compact_sentences`.
+            gc_mode:
+                How to tune the cyclic GC during filtering. Optional; see
+                `CorpusFilterTextFileWriter`.
+            alt_parses_dir:
+                Path to a cache of alternative parses written by the `reparse` command.
+                Optional; if given, sentences with alternative parses are rejected if
+                any of their `top_k` parses is; see `corpus_filtering.reparse`.
+            top_k:
+                The maximum number of parses of a sentence to evaluate the predicate
+                on, including the original one.
         """
-        super().__init__(f_accept_out_path, f_reject_out_path)
-
-        self._corpus_view = PickleStanzaDocCorpusView(f_in, doc_block_size)
+        super().__init__(
+            f_accept_out_path,
+            f_reject_out_path,
+            dedup_index_path,
+            base_corpus_path,
+            stats_path,
+            io_queue_depth,
+            write_ids,
+            gc_mode,
+        )
+
+        self._corpus_view = PickleStanzaDocCorpusView(f_in, doc_block_size, compact)
+        self._io_queue_depth = io_queue_depth
+        self._alt_parses: dict[int, list] = {}
+        if alt_parses_dir is not None:
+            assert top_k > 0, "top_k must be positive"
+            self._alt_parses = AltParseCache(alt_parses_dir).parses(
+                max_parses=top_k - 1
+            )
+            if compact:
+                self._alt_parses = {
+                    fp: [CompactSentence.from_stanza(sent) for sent in parses]
+                    for fp, parses in self._alt_parses.items()
+                }
 
     def _sent_to_str(self, sent: StanzaSentence) -> str:
         """Returns the text of a stanza `Sentence` object as a preprocessing step before
@@ -83,17 +189,38 @@ class PickleStanzaDocCorpusFilterWriter(CorpusFilterTextFileWriter[StanzaSentenc
         """
         return sent.text
 
+    def _sent_num_tokens(self, sent: StanzaSentence) -> int:
+        return len(sent.words)
+
     def _get_sents(self) -> Generator[StanzaSentence, None, None]:
         """Generator for stanza `Sentence` objects from `stanza.Document` objects
         deserialized in batches from a corpus.
 
         A wrapper around a `PickleStanzaDocCorpusView` object, which itself wraps NLTK's
-        `PickleCorpusView`.
+        `PickleCorpusView`, read ahead on a background thread (see
+        `corpus_filtering.threaded_io.prefetch`).
 
         Returns:
             A generator over the corpus, as stanza `Sentence` objects.
         """
-        yield from self._corpus_view
+        yield from prefetch(self._corpus_view, self._io_queue_depth)
+
+    def _sent_predicate(self) -> Callable[[StanzaSentence], bool]:
+        """Wraps `_exclude_sent` to also evaluate it on the alternative parses of a
+        sentence, if any were loaded, rejecting the sentence if any parse is rejected.
+        The alternatives are only looked at if the original parse is accepted."""
+        if not self._alt_parses:
+            return self._exclude_sent
+        exclude_sent = self._exclude_sent
+        alt_parses = self._alt_parses
+
+        def exclude_any_parse(sent: StanzaSentence) -> bool:
+            if exclude_sent(sent):
+                return True
+            parses = alt_parses.get(sent_fingerprint(sent))
+            return parses is not None and any(exclude_sent(alt) for alt in parses)
+
+        return exclude_any_parse
 
 
 # @register_filter() # if we wanted NModNSubjFilteredCorpusWriter as the subcommand name
@@ -166,7 +293,7 @@ class NModNSubjFilteredCorpusWriter(PickleStanzaDocCorpusFilterWriter):
                     nmod_id = word.id
                     nsubj_head_id = head.head
                     if nsubj_head_id > nmod_id and nmod_id > nsubj_id:
-                        return True
+                        return self._triggered_by(head.lemma)
         #             else:
         #                 unusual = True
         # if unusual:
@@ -211,12 +338,12 @@ class RelativeClauseFilteredCorpusWriter(PickleStanzaDocCorpusFilterWriter):
             if deprel == "acl:relcl":
                 # and the head of the relative clause is a subject noun,
                 if head.deprel.startswith("nsubj"):
-                    return True
+                    return self._triggered_by(head.lemma)
                 # and the head of the relative clause is a nominal modifier of a subject noun,
                 elif head.deprel == "nmod":
                     _, _, head_of_head = sent.dependencies[head.head - 1]
                     if head_of_head.deprel.startswith("nsubj"):
-                        return True
+                        return self._triggered_by(head_of_head.lemma)
         return False
 
 
@@ -242,10 +369,12 @@ class NSubjBlimpFilteredCorpusWriter(PickleStanzaDocCorpusFilterWriter):
         "formatter_class": argparse.RawDescriptionHelpFormatter,
     }
 
-    # reading file (noun list from blimp)
-    list_filename = "data/blimp/re-irr-sv-agr/nouns.txt"
-    with open(list_filename, "r") as f:
-        lower_noun_set = {line.strip().lower() for line in f}
+    # noun list from blimp
+    noun_list_path = "data/blimp/re-irr-sv-agr/nouns.txt"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lower_noun_set = load_word_list(self.noun_list_path)
 
     def _exclude_sent(self, sent: StanzaSentence) -> bool:
         """
@@ -262,8 +391,8 @@ class NSubjBlimpFilteredCorpusWriter(PickleStanzaDocCorpusFilterWriter):
         # filter: removing all nsubj that appeared in test data
         for _, _, word in sent.dependencies:
             if "nsubj" in word.deprel:
-                if word.text.lower() in NSubjBlimpFilteredCorpusWriter.lower_noun_set:
-                    return True
+                if self.lower_noun_set[word.text]:
+                    return self._triggered_by(word.lemma)
         return False
 
 
@@ -300,10 +429,11 @@ class SuperlativeQuantifierFilteredCorpusWriter(PickleStanzaDocCorpusFilterWrite
                 "Degree=Sup" in word.feats or "Degree=Cmp" in word.feats
             ):
                 # and track up the dependency path to see if the word is in object position
+                trigger = word.lemma
                 while word.head != 0:
                     # if a word in its dependency path has deprel=obl or deprel=obj or deprel=iobj
                     if deprel == "obl" or deprel == "obj" or deprel == "iobj":
-                        return True
+                        return self._triggered_by(trigger)
                     head, deprel, word = sent.dependencies[head.id - 1]
         return False
 
@@ -427,7 +557,7 @@ class DeterminerAdjectiveNounFilteredCorpusWriter(PickleStanzaDocCorpusFilterWri
     by anything other than a upos:NOUN, though theoretically upos:NUMBER might pass.
     """
 
-    demonstratives = {"this", "that", "these", "those"}
+    demonstratives = WordList({"this", "that", "these", "those"})
 
     def _exclude_sent(self, sent: StanzaSentence) -> bool:
         """Exclude a sentence if it contains a noun from blimp data noun list.
@@ -446,11 +576,12 @@ class DeterminerAdjectiveNounFilteredCorpusWriter(PickleStanzaDocCorpusFilterWri
 
         for word in sent.words:
             # If the word is a demonstrative determiner (this, that, these, those)...
-            if word.upos == "DET" and word.text.lower() in self.demonstratives:
+            if word.upos == "DET" and self.demonstratives[word.text]:
                 # ...and the next word is not a noun
                 # n.b.: words attribute is 0-indexed, but word.id is 1-indexed
                 if sent.words[word.id].upos not in {"NOUN", "PROPN"}:
-                    return True  # ...then filter the sentence out...
+                    # ...then filter the sentence out...
+                    return self._triggered_by(word.lemma)
         return False
 
 
@@ -486,14 +617,13 @@ class DeterminerNounAgreementFilteredCorpusWriter(PickleStanzaDocCorpusFilterWri
         "description": f"Description:\n{__doc__}",
         "formatter_class": argparse.RawDescriptionHelpFormatter,
     }
-    demonstratives = {"this", "that", "these", "those"}
+    demonstratives = WordList({"this", "that", "these", "those"})
     noun_list_path = "data/blimp/det-noun/nouns.txt"
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # read noun list
-        with open(self.noun_list_path, "r") as f:
-            self.noun_set: set[str] = {line.strip().lower() for line in f}
+        self.noun_set: WordList = load_word_list(self.noun_list_path)
 
     def _exclude_sent(self, sent: StanzaSentence) -> bool:
         """Exclude a sentence if it contains a noun from blimp data noun list.
@@ -514,11 +644,11 @@ class DeterminerNounAgreementFilteredCorpusWriter(PickleStanzaDocCorpusFilterWri
             # If the word is a demonstrative determiner (this, that, these, those)...
             # Second check is almost certainly redundant, but just in case...
             if deprel == "det" and (
-                word.text.lower() in self.demonstratives
-                or word.lemma.lower() in self.demonstratives
+                self.demonstratives[word.text] or self.demonstratives[word.lemma]
             ):
-                if head.text.lower() in self.noun_set:
-                    return True  # ...then filter the sentence out...
+                if self.noun_set[head.text]:
+                    # ...then filter the sentence out...
+                    return self._triggered_by(head.lemma)
         return False
 
 
@@ -571,7 +701,7 @@ class BindingCCommandFilteredCorpusWriter(PickleStanzaDocCorpusFilterWriter):
                             if relcl_deprel == "acl:relcl":
                                 while relcl_word.head != 0:
                                     if relcl_word.head == subj_word.id:
-                                        return True
+                                        return self._triggered_by(reflex_word.lemma)
                                     (
                                         relcl_head,
                                         relcl_deprel,
@@ -639,7 +769,7 @@ class BindingCaseFilteredCorpusWriter(PickleStanzaDocCorpusFilterWriter):
                 if next_word.upos == "PRON" and (
                     next_deprel == "nsubj" or next_deprel == "nsubj:pass"
                 ):
-                    return True
+                    return self._triggered_by(next_word.lemma)
             # case b: search for reflex
             if word.feats is not None and "Reflex=Yes" in word.feats:
                 # next word following the reflex should have the same head as the reflex and its deprel is either "xcomp" or "advcl"
@@ -647,7 +777,7 @@ class BindingCaseFilteredCorpusWriter(PickleStanzaDocCorpusFilterWriter):
                 if next_word.head == word.head and (
                     next_deprel == "xcomp" or next_deprel == "advcl"
                 ):
-                    return True
+                    return self._triggered_by(word.lemma)
         return False
 
 
@@ -701,12 +831,12 @@ class BindingDomainFilteredCorpusWriter(PickleStanzaDocCorpusFilterWriter):
                         and obj_word.upos == "PRON"
                         and (obj_deprel == "obj" or obj_deprel == "obl")
                     ):
-                        return True
+                        return self._triggered_by(obj_word.lemma)
             # case b: search for reflex
             if word.feats is not None and "Reflex=Yes" in word.feats:
                 # the head of reflex has a deprel as "ccomp" or "xcomp"
                 if head.deprel == "ccomp" or head.deprel == "xcomp":
-                    return True
+                    return self._triggered_by(word.lemma)
         return False
 
 
@@ -745,7 +875,7 @@ class BindingReconstructionFilteredCorpusWriter(PickleStanzaDocCorpusFilterWrite
                 for subj_head, subj_deprel, subj_word in sent.dependencies:
                     # if nsubj has reflex as the head
                     if subj_word.head == word.id and subj_deprel == "nsubj":
-                        return True
+                        return self._triggered_by(word.lemma)
 
         return False
 
@@ -804,8 +934,7 @@ class PassiveFilteredCorpusWriter(PickleStanzaDocCorpusFilterWriter):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # read verb list
-        with open(self.verb_list_path, "r") as f:
-            self.verb_set: set[str] = {line.strip().lower() for line in f}
+        self.verb_set: WordList = load_word_list(self.verb_list_path)
 
     def _exclude_sent(self, sent: StanzaSentence) -> bool:
         """Exclude a sentence if a verb from a list of verbs appearing in the BLiMP
@@ -823,16 +952,174 @@ class PassiveFilteredCorpusWriter(PickleStanzaDocCorpusFilterWriter):
         for head, deprel, word in sent.dependencies:
             # for _, _, word in sent.dependencies:
             if word.feats is not None and "Voice=Pass" in word.feats:
-                if (
-                    word.text.lower() in self.verb_set
-                    or word.lemma.lower() in self.verb_set
-                ):
-                    return True
+                if self.verb_set[word.text] or self.verb_set[word.lemma]:
+                    return self._triggered_by(word.lemma)
             # handle "copula + adjective" == "copula + passive" ambiguity
             if deprel == "cop" and head.id > 0:
-                if (
-                    head.text.lower() in self.verb_set
-                    or head.lemma.lower() in self.verb_set
-                ):
-                    return True
+                if self.verb_set[head.text] or self.verb_set[head.lemma]:
+                    return self._triggered_by(head.lemma)
+        return False
+
+
+class NPIFilteredCorpusWriter(PickleStanzaDocCorpusFilterWriter):
+    """
+    Base class for filters for sentences where a negative polarity item (NPI) such as
+    "ever", "any" or "at all" is licensed in a particular way. NPIs are (mostly)
+    ungrammatical unless licensed, e.g. by negation:
+
+        good: "Those banks had not ever lied."
+        bad: "Those banks had ever lied."
+
+    NPIs are rare, so sentences are first scanned for the NPIs in the list with a
+    `TriggerMatcher`, and only the sentences with an NPI are checked for a licensor (by
+    subclasses, in `_is_licensed`).
+    """
+
+    npi_list_path = "data/blimp/npi/npis.txt"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.npi_matcher: TriggerMatcher = load_trigger_matcher(self.npi_list_path)
+
+    def _exclude_sent(self, sent: StanzaSentence) -> bool:
+        """Exclude a sentence if it contains a licensed NPI.
+
+        Args:
+            sent: A stanza `Sentence` object that has been annotated with dependency
+            relations.
+
+        Returns:
+            True if the sentence contains an NPI licensed as the subclass requires;
+            False otherwise.
+        """
+        for start, end in self.npi_matcher.find(sent.words):
+            if self._is_licensed(sent, sent.words[start]):
+                return self._triggered_by(
+                    " ".join(word.lemma or word.text for word in sent.words[start:end])
+                )
+        return False
+
+    @abstractmethod
+    def _is_licensed(self, sent: StanzaSentence, npi: StanzaWord) -> bool:
+        """Whether an NPI (the first word of the NPI, if it has several) is licensed."""
+
+    # dependency relations of the heads of embedded clauses
+    clausal_deprels = frozenset({"acl", "acl:relcl", "advcl", "ccomp", "csubj"})
+
+    @classmethod
+    def _dominates(
+        cls,
+        sent: StanzaSentence,
+        head_id: int,
+        word: StanzaWord,
+        same_clause: bool = False,
+    ) -> bool:
+        """Whether the word with ID `head_id` is `word` or one of its ancestors (and, if
+        `same_clause`, no embedded clause boundary lies between them)."""
+        while word.id != head_id:
+            if not word.head or (same_clause and word.deprel in cls.clausal_deprels):
+                return False
+            word = sent.words[word.head - 1]
+        return True
+
+
+@register_filter("npi-only")
+class OnlyNPIFilteredCorpusWriter(NPIFilteredCorpusWriter):
+    """
+    A filter for sentences with an NPI following "only", which can license it. The
+    target BLiMP benchmark sets are:
+        only_npi_licensor_present
+        only_npi_scope
+
+    Some examples on good sentences and bad sentences:
+        good: "Only Bill would ever complain."
+        bad: "Even Bill would ever complain."
+        good: "Only the grandsons who these boys like have ever talked about Todd."
+        bad: "The grandsons who only these boys like have ever talked about Todd."
+
+    Whether "only" actually scopes over the NPI (as in the bad sentence of the second
+    pair, it may not) is not checked: any NPI preceded by "only" is targeted, since we
+    prefer stronger filters to weaker ones.
+    """
+
+    cli_subcmd_constructor_kwargs = {
+        "description": f"Description:\n{__doc__}",
+        "formatter_class": argparse.RawDescriptionHelpFormatter,
+    }
+
+    licensors = WordList({"only"})
+
+    def _is_licensed(self, sent: StanzaSentence, npi: StanzaWord) -> bool:
+        # n.b.: words attribute is 0-indexed, but word.id is 1-indexed
+        return any(self.licensors[word.text] for word in sent.words[: npi.id - 1])
+
+
+@register_filter("npi-sent-neg")
+class SententialNegationNPIFilteredCorpusWriter(NPIFilteredCorpusWriter):
+    """
+    A filter for sentences with an NPI in the scope of sentential negation. The target
+    BLiMP benchmark sets are:
+        sentential_negation_npi_licensor_present
+        sentential_negation_npi_scope
+
+    Some examples on good sentences and bad sentences:
+        good: "Those banks had not ever lied."
+        bad: "Those banks had really ever lied."
+        good: "The associations that had worried Jeffrey had not ever hurt Carl."
+        bad: "The associations that had not worried Jeffrey had ever hurt Carl."
+
+    Sentential negation is a negator ("not", "n't" or "never") preceding the NPI, whose
+    head (the negated predicate) is the NPI itself or one of its ancestors. This
+    excludes negation in e.g. a relative clause that the NPI is not in, as in the bad
+    sentence of the second pair.
+    """
+
+    cli_subcmd_constructor_kwargs = {
+        "description": f"Description:\n{__doc__}",
+        "formatter_class": argparse.RawDescriptionHelpFormatter,
+    }
+
+    negators = WordList({"not", "n't", "never"})
+
+    def _is_licensed(self, sent: StanzaSentence, npi: StanzaWord) -> bool:
+        for word in sent.words[: npi.id - 1]:
+            if self.negators[word.text] and self._dominates(sent, word.head, npi):
+                return True
+        return False
+
+
+@register_filter("npi-sim-ques")
+class SimpleQuestionNPIFilteredCorpusWriter(NPIFilteredCorpusWriter):
+    """
+    A filter for questions with an NPI in the matrix clause, which questions can
+    license. The target BLiMP benchmark set is:
+        matrix_question_npi_licensor_present
+
+    An example of a good sentence and a bad sentence:
+        good: "Had Bruce ever played?"
+        bad: "Bruce had ever played."
+
+    A (simple) question is detected by subject-auxiliary inversion: an auxiliary that
+    precedes the subject of its own head. The NPI must be in the clause of that head,
+    i.e. the head is the NPI or one of its ancestors, with no embedded clause between
+    them. In contrast, an NPI in e.g. a relative clause of a question is not targeted:
+        "Had the teacher who ever played lied?"
+    """
+
+    cli_subcmd_constructor_kwargs = {
+        "description": f"Description:\n{__doc__}",
+        "formatter_class": argparse.RawDescriptionHelpFormatter,
+    }
+
+    def _is_licensed(self, sent: StanzaSentence, npi: StanzaWord) -> bool:
+        if sent.words[-1].text != "?":
+            return False
+        for head, deprel, word in sent.dependencies:
+            if deprel.startswith("aux") and self._dominates(
+                sent, head.id, npi, same_clause=True
+            ):
+                # is the auxiliary followed by the subject of its head?
+                for subj in sent.words[word.id :]:
+                    if subj.head == head.id and subj.deprel.startswith("nsubj"):
+                        return True
         return False
@@ -0,0 +1,137 @@
+"""Lexical trigger matching, for filters that only apply to sentences with given words.
+
+Many filters target constructions that are marked by a small set of words or phrases
+(e.g. negative polarity items like "ever" or "at all"), which occur in only a small
+fraction of the corpus. Such filters first scan each sentence for their triggers with a
+`TriggerMatcher`, and only run their (comparatively slow) dependency checks on the
+sentences with a hit, so they run at close to the speed of reading the corpus.
+
+A `TriggerMatcher` compiles its trigger phrases into an Aho–Corasick automaton over
+token IDs, and finds all the (possibly overlapping) occurrences of all the phrases in a
+single pass over the words of a sentence. Words are mapped to token IDs through a memo
+of surface forms, just like `WordList` lookups, so the vast majority of words (those
+that are not part of any trigger) cost a single dictionary lookup.
+"""
+
+import functools
+from collections.abc import Iterable, Sequence
+from typing import Any
+
+from corpus_filtering.filters.word_lists import load_word_list
+
+__all__ = ["TriggerMatcher", "load_trigger_matcher"]
+
+# token ID of the words that are not part of any trigger
+NOT_A_TRIGGER = -1
+
+
+class _TokenIds(dict):
+    """Memo of the token IDs of surface forms; see `WordList`."""
+
+    __slots__ = ("_vocab", "_max_memo_size")
+
+    def __init__(self, vocab: dict[str, int], max_memo_size: int = 1 << 20):
+        super().__init__()
+        self._vocab = vocab
+        self._max_memo_size = max_memo_size
+
+    def __missing__(self, form: str) -> int:
+        token_id = NOT_A_TRIGGER
+        if form:  # lemmas may be missing (`None`)
+            token_id = self._vocab.get(form.lower(), NOT_A_TRIGGER)
+        if len(self) < self._max_memo_size:
+            self[form] = token_id
+        return token_id
+
+
+class TriggerMatcher:
+    """Finds all occurrences of a set of (multi-word) trigger phrases in sentences."""
+
+    def __init__(self, phrases: Iterable[str], attr: str = "text"):
+        """Constructor for TriggerMatcher.
+
+        Args:
+            phrases:
+                The trigger phrases, as whitespace-separated words. Matching is
+                case-insensitive.
+            attr:
+                The attribute of the words that is matched against the phrases, e.g.
+                "text" or "lemma".
+        """
+        self.attr = attr
+        self.phrases = sorted(
+            {" ".join(phrase.lower().split()) for phrase in phrases} - {""}
+        )
+        vocab: dict[str, int] = {}
+        # the trie: transitions, failure links and the lengths of the phrases that end
+        # in each state
+        self._goto: list[dict[int, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[tuple[int, ...]] = [()]
+        for phrase in self.phrases:
+            state = 0
+            for token in phrase.split():
+                token_id = vocab.setdefault(token, len(vocab))
+                if token_id not in self._goto[state]:
+                    self._goto[state][token_id] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = self._goto[state][token_id]
+            self._out[state] += (len(phrase.split()),)
+        self._link()
+        self._token_ids = _TokenIds(vocab)
+
+    def _link(self):
+        """Compute the failure links, breadth-first, as in Aho–Corasick."""
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for token_id, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and token_id not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(token_id, 0)
+                self._out[next_state] += self._out[self._fail[next_state]]
+
+    def find(self, words: Sequence[Any]) -> list[tuple[int, int]]:
+        """Find all occurrences of the trigger phrases among a sentence's words.
+
+        Args:
+            words: The words of the sentence, e.g. the `words` of a Stanza `Sentence`.
+        Returns:
+            The (start, end) word indices (0-based, end exclusive) of every occurrence,
+            ordered by end index.
+        """
+        token_ids = self._token_ids
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        attr = self.attr
+        matches = []
+        state = 0
+        for idx, word in enumerate(words):
+            token_id = token_ids[getattr(word, attr)]
+            if token_id == NOT_A_TRIGGER:
+                state = 0
+                continue
+            while state and token_id not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token_id, 0)
+            for length in out[state]:
+                matches.append((idx + 1 - length, idx + 1))
+        return matches
+
+
+@functools.lru_cache(maxsize=None)
+def load_trigger_matcher(path: str, attr: str = "text") -> TriggerMatcher:
+    """Compile a newline-separated list of trigger phrases into a `TriggerMatcher`.
+
+    Like word lists, every list is read and compiled at most once per process (see
+    `word_lists.py`).
+
+    Args:
+        path: Path to the list, relative to the repository root (or absolute).
+        attr: The attribute of the words that is matched against the phrases.
+    """
+    return TriggerMatcher(load_word_list(path).words, attr)
@@ -0,0 +1,89 @@
+"""Loading of the word lists (e.g. `data/blimp/passive/verbs.txt`) used by some filters.
+
+Word-list paths are given relative to the root of this repository, so filters work
+regardless of the current working directory. Every list is read and compiled into a
+`WordList` lookup table at most once per process, the first time a filter that uses it
+is constructed. Processes forked after that (e.g. by `multiprocessing`) share the
+compiled table with their parent rather than each building their own, so parallel
+drivers should load the word lists they need before starting their workers.
+"""
+
+import functools
+from collections.abc import Iterable
+from pathlib import Path
+
+__all__ = ["REPO_ROOT", "resolve_data_path", "load_word_list", "WordList"]
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+
+
+def resolve_data_path(path: str) -> Path:
+    """Resolve a (data) path relative to the root of this repository.
+
+    Args:
+        path: A path relative to the repository root, e.g. "data/blimp/det-noun/nouns.txt".
+            Absolute paths are returned unchanged.
+
+    Returns:
+        The resolved path.
+    """
+    return REPO_ROOT / path
+
+
+class WordList(dict):
+    """Memoizing, case-insensitive lookup table over a frozen set of words.
+
+    Filters test every token of the corpus against their word lists, and most tokens are
+    not in the list. Rather than lowercasing the token's text (and often its lemma too)
+    on every test, membership is memoized per surface form: the first time a form is
+    looked up, it is lowercased and checked against the list, and every later lookup of
+    the same form is a single dictionary lookup. Since the vocabulary of the corpus is
+    bounded (the Gulordava corpus has a 50K word vocabulary), so is the memo;
+    `max_memo_size` caps it regardless, after which unseen forms are still looked up
+    correctly, just without being memoized.
+
+    The memo is the dictionary itself, so the fast way to test membership is by
+    indexing, i.e. `word_list[word.text]`, which returns a boolean. `word.text in
+    word_list` also gives the correct answer, but is slower.
+    """
+
+    __slots__ = ("_words", "_max_memo_size")
+
+    def __init__(self, words: Iterable[str], max_memo_size: int = 1 << 20):
+        """Constructor for WordList.
+
+        Args:
+            words: The words in the list; they are lowercased.
+            max_memo_size: The maximum number of surface forms to memoize.
+        """
+        super().__init__()
+        self._words = frozenset(word.lower() for word in words)
+        self._max_memo_size = max_memo_size
+
+    def __missing__(self, form: str) -> bool:
+        hit = form.lower() in self._words
+        if len(self) < self._max_memo_size:
+            self[form] = hit
+        return hit
+
+    def __contains__(self, form: object) -> bool:
+        return self[form]
+
+    @property
+    def words(self) -> frozenset[str]:
+        """The (lowercased) words in the list."""
+        return self._words
+
+
+@functools.lru_cache(maxsize=None)
+def load_word_list(path: str) -> WordList:
+    """Read a newline-separated word list into a `WordList`.
+
+    Args:
+        path: Path to the word list, relative to the repository root (or absolute).
+
+    Returns:
+        A `WordList` of the (stripped) words in the list.
+    """
+    with open(resolve_data_path(path), "r") as f:
+        return WordList(line.strip() for line in f)
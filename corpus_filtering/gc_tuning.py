@@ -0,0 +1,160 @@
+"""Tuning of CPython's cyclic garbage collector for long filtering and annotation runs.
+
+Unpickling a block of `stanza.Document` objects creates millions of objects, most of
+which (the words, sentences and documents, which refer to each other) die together
+once the block has been filtered. By default, the cyclic GC runs every 700 net
+allocations, and each of its (occasional) full collections traverses every live object,
+including the long-lived ones made at startup (models, word lists, memos), so a
+significant share of a run can go to GC pauses that free nothing. `tune_gc` wraps a run
+in one of the following modes:
+
+    * "default": the GC is left as it is (its pauses are still measured).
+    * "freeze": objects alive at the start of the run are moved to the permanent
+        generation (`gc.freeze`), so that collections no longer traverse them, and the
+        youngest generation is collected less often.
+    * "manual": as "freeze", but automatic collection is disabled altogether; instead,
+        readers call `collect_between_blocks` whenever they are done with a block (e.g.
+        `PickleStanzaDocCorpusView`, before reading the next one), which frees the
+        cyclic garbage of the blocks read so far in one collection every
+        `MANUAL_COLLECTION_INTERVAL` blocks. Only for inputs that are read in blocks:
+        otherwise, cyclic garbage is not freed until the end of the run.
+
+On a synthetic corpus of 120,000 parsed sentences (in documents of 2,000), the passive
+filter spent 82% of its run in GC pauses by default; "freeze" doubled its throughput,
+and "manual" nearly tripled it at the same peak memory as "default" (see
+`scripts/gc_benchmark.py`).
+
+Either way, `tune_gc` yields a `GCMonitor`, which times every collection (through
+`gc.callbacks`); filters add its report to their `--stats`.
+"""
+
+import contextlib
+import gc
+import time
+from collections.abc import Iterator
+from typing import Any, Optional
+
+__all__ = ["GC_MODES", "GCMonitor", "tune_gc", "collect_between_blocks"]
+
+GC_MODES = ("default", "freeze", "manual")
+
+# Threshold of the youngest generation in "freeze" mode (CPython's default is 700)
+FREEZE_GEN0_THRESHOLD = 50_000
+
+# How many blocks "manual" mode reads between collections: each collection traverses
+# the blocks still in use as well as the garbage, so collecting after every block would
+# traverse every block several times
+MANUAL_COLLECTION_INTERVAL = 4
+
+# whether `collect_between_blocks` collects, i.e. whether a "manual" run is in progress,
+# and how many blocks were read since the last collection
+_manual_collection = False
+_num_blocks = 0
+# whether a "freeze" or "manual" run is in progress, in which nested runs leave the GC
+# as it is
+_tuned = False
+
+
+class GCMonitor:
+    """Counts and times the collections of the cyclic GC while it is started."""
+
+    def __init__(self, mode: str = "default"):
+        """Constructor for GCMonitor.
+
+        Args:
+            mode: The GC mode of the run, for the report.
+        """
+        self.mode = mode
+        self.num_collections = [0, 0, 0]
+        self.num_collected = 0
+        self.pause_seconds = 0.0
+        self.max_pause_seconds = 0.0
+        self._collection_start: Optional[float] = None
+        self._run_start: Optional[float] = None
+        self._run_seconds = 0.0
+
+    def _callback(self, phase: str, info: dict[str, int]):
+        if phase == "start":
+            self._collection_start = time.perf_counter()
+        elif self._collection_start is not None:
+            pause = time.perf_counter() - self._collection_start
+            self._collection_start = None
+            self.num_collections[info["generation"]] += 1
+            self.num_collected += info["collected"]
+            self.pause_seconds += pause
+            self.max_pause_seconds = max(self.max_pause_seconds, pause)
+
+    def start(self):
+        self._run_start = time.perf_counter()
+        gc.callbacks.append(self._callback)
+
+    def stop(self):
+        gc.callbacks.remove(self._callback)
+        assert self._run_start is not None, "The monitor was not started"
+        self._run_seconds += time.perf_counter() - self._run_start
+        self._run_start = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "collections": dict(zip(("gen0", "gen1", "gen2"), self.num_collections)),
+            "collected_objects": self.num_collected,
+            "pause_seconds": self.pause_seconds,
+            "max_pause_seconds": self.max_pause_seconds,
+            "run_seconds": self._run_seconds,
+            "pause_fraction": self.pause_seconds / (self._run_seconds or 1),
+        }
+
+
+@contextlib.contextmanager
+def tune_gc(mode: str = "default") -> Iterator[GCMonitor]:
+    """Run the enclosed code with the GC tuned as per `mode` (see the module docstring),
+    and restore the GC's settings afterwards.
+
+    Meant to be entered once startup (e.g. loading models and word lists) is done, so
+    that "freeze" and "manual" freeze what startup allocated. Runs nested in a "freeze"
+    or "manual" run keep the GC tuned as the outer run has it.
+    """
+    global _manual_collection, _num_blocks, _tuned
+    assert mode in GC_MODES, f"Unknown GC mode: {mode}"
+    if _tuned:
+        mode = "default"
+    monitor = GCMonitor(mode)
+    thresholds = gc.get_threshold()
+    was_enabled = gc.isenabled()
+    if mode != "default":
+        _tuned = True
+        gc.collect()
+        gc.freeze()
+        if mode == "freeze":
+            gc.set_threshold(FREEZE_GEN0_THRESHOLD, *thresholds[1:])
+        else:
+            gc.disable()
+            _manual_collection = True
+            _num_blocks = 0
+    monitor.start()
+    try:
+        yield monitor
+    finally:
+        monitor.stop()
+        if mode != "default":
+            _tuned = False
+            _manual_collection = False
+            gc.set_threshold(*thresholds)
+            if was_enabled:
+                gc.enable()
+            gc.unfreeze()
+
+
+def collect_between_blocks():
+    """Count a block as processed and, every `MANUAL_COLLECTION_INTERVAL` blocks,
+    collect the garbage, in "manual" mode.
+
+    A no-op in the other modes, so readers can call it unconditionally.
+    """
+    global _num_blocks
+    if _manual_collection:
+        _num_blocks += 1
+        if _num_blocks >= MANUAL_COLLECTION_INTERVAL:
+            _num_blocks = 0
+            gc.collect()
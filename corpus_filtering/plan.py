@@ -0,0 +1,488 @@
+"""Cost estimates for filtering an annotated corpus, and how to split the work.
+
+Filtering a split of the Gulordava corpus takes hours, most of it spent unpickling the
+annotated corpus rather than in the filters' predicates, and `build-all` shares that
+cost by running a group of filters in every pass over the corpus (see
+`corpus_filtering/build.py`). The `plan` command estimates, before any job is launched,
+what a set of filters will cost over a corpus, from a few thousand of its sentences:
+
+    python -m corpus_filtering plan data/gulordava_corpus/train.pkl.zst -j 32
+
+It reads documents of the corpus until it has `--sample-size` sentences (random
+documents, if the corpus has an up-to-date `SentenceIndex`; otherwise, the first ones),
+timing the unpickling of each, and times every filter's `_exclude_sent` on a random
+sample of their sentences. From these, it extrapolates to the whole corpus (whose number
+of sentences is read from its index, or else estimated from its size):
+
+    * the CPU time of every filter on its own, and of a single pass running them all;
+    * the size of every filter's accepted and rejected outputs, and of its `.mask`;
+    * the peak memory (RSS) of a worker: that of this process once the filters are
+        loaded, plus the decoded documents a worker holds at once.
+
+Finally, it splits the filters into groups, one pass over the corpus each, for the
+number of workers (at most `--cores`, and as many as fit in `--memory-gb`) past which
+adding workers no longer shortens the longest pass by more than 5%. Filters are assigned
+to groups longest first, each to the cheapest group so far.
+
+Estimates are only as good as the sample: they assume the rest of the corpus is like it,
+and GC pauses grow with the size of the heap, so unpickling a large corpus tends to take
+longer per sentence than the sample did (see `corpus_filtering.gc_tuning`).
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Optional
+
+from corpus_filtering import filters
+from corpus_filtering.commands import CorpusCommand
+from corpus_filtering.compression import get_codec, load_pickle
+from corpus_filtering.corpus_views.compact_sentences import CompactSentence
+from corpus_filtering.corpus_views.sentence_index import SentenceIndex
+from corpus_filtering.gc_tuning import GC_MODES, MANUAL_COLLECTION_INTERVAL, tune_gc
+
+__all__ = ["PlanCommand", "group_filters"]
+
+DEFAULT_SAMPLE_SIZE = 2000
+# how much longer the longest pass may be than with as many workers as possible, for the
+# fewer workers to be recommended
+WORKER_SPEEDUP_TOLERANCE = 1.05
+
+
+def current_rss() -> int:
+    """The resident set size of this process, in bytes (its peak, where the current one
+    is not available)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def physical_memory() -> Optional[int]:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def group_filters(costs: dict[str, float], num_groups: int) -> list[list[str]]:
+    """Split filters into groups of similar total cost, longest first, each into the
+    cheapest group so far.
+
+    Args:
+        costs: The cost (e.g. seconds per sentence) of every filter.
+        num_groups: The number of groups.
+    Returns:
+        The non-empty groups.
+    """
+    groups: list[list[str]] = [[] for _ in range(num_groups)]
+    totals = [0.0] * num_groups
+    for name in sorted(costs, key=costs.get, reverse=True):
+        idx = totals.index(min(totals))
+        groups[idx].append(name)
+        totals[idx] += costs[name]
+    return [group for group in groups if group]
+
+
+def _format_hours(hours: float) -> str:
+    return f"{hours:.2f} h" if hours >= 1 else f"{60 * hours:.1f} min"
+
+
+def _format_bytes(num_bytes: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TiB"
+
+
+class PlanCommand(CorpusCommand):
+    """Estimate the CPU time, memory and output sizes of running filters over an
+    annotated corpus from a sample of it, and recommend how many workers to run them on
+    and how to group them into passes over the corpus.
+    """
+
+    cli_subcmd_constructor_kwargs = {
+        "description": f"Description:\n{__doc__}",
+        "formatter_class": argparse.RawDescriptionHelpFormatter,
+    }
+
+    cli_subcmd_arguments = [
+        {
+            "args": ["corpus_path"],
+            "kwargs": {
+                "help": "Path to the annotated corpus (pickled `stanza.Document` "
+                "objects).",
+                "metavar": "input_file_path",
+            },
+        },
+        {
+            "args": ["-f", "--filters"],
+            "kwargs": {
+                "nargs": "+",
+                "dest": "filter_names",
+                "help": "The filters to plan for. Default: all registered filters.",
+            },
+        },
+        {
+            "args": ["-n", "--sample-size"],
+            "kwargs": {
+                "type": int,
+                "default": DEFAULT_SAMPLE_SIZE,
+                "dest": "sample_size",
+                "help": "Number of sentences to time the filters on. Default: "
+                "%(default)s.",
+            },
+        },
+        {
+            "args": ["-j", "--cores"],
+            "kwargs": {
+                "type": int,
+                "default": os.cpu_count(),
+                "dest": "num_cores",
+                "help": "Number of cores available to the job. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["--memory-gb"],
+            "kwargs": {
+                "type": float,
+                "dest": "memory_gb",
+                "help": "Memory available to the job, in GiB. Default: the physical "
+                "memory of this machine.",
+            },
+        },
+        {
+            "args": ["--doc-block-size"],
+            "kwargs": {
+                "type": int,
+                "default": 1,
+                "dest": "doc_block_size",
+                "help": "Number of documents the filters will read at a time. "
+                "Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["--compact"],
+            "kwargs": {
+                "action": "store_true",
+                "help": "Plan for filters run with --compact.",
+            },
+        },
+        {
+            "args": ["--gc"],
+            "kwargs": {
+                "choices": GC_MODES,
+                "default": "default",
+                "dest": "gc_mode",
+                "help": "Plan for filters run with this --gc mode. Default: "
+                "%(default)s.",
+            },
+        },
+        {
+            "args": ["-s", "--seed"],
+            "kwargs": {
+                "type": int,
+                "default": 42,
+                "help": "Random seed for sampling. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["-o", "--out"],
+            "kwargs": {
+                "dest": "out_path",
+                "help": "Path to file where the plan should be written as JSON.",
+            },
+        },
+    ]
+
+    def __init__(
+        self,
+        corpus_path: str,
+        filter_names: Optional[list[str]] = None,
+        sample_size: int = DEFAULT_SAMPLE_SIZE,
+        num_cores: Optional[int] = None,
+        memory_gb: Optional[float] = None,
+        doc_block_size: int = 1,
+        compact: bool = False,
+        gc_mode: str = "default",
+        seed: int = 42,
+        out_path: Optional[str] = None,
+    ):
+        """Constructor for PlanCommand.
+
+        Args:
+            corpus_path: Path to the annotated corpus.
+            filter_names: The filters to plan for. Optional; defaults to all of them.
+            sample_size: Number of sentences to time the filters on.
+            num_cores: Number of cores available. Defaults to the number of CPUs.
+            memory_gb: Memory available, in GiB. Defaults to the physical memory.
+            doc_block_size: Number of documents the filters will read at a time.
+            compact: Whether the filters will be run with `compact`.
+            gc_mode: The GC mode the filters will be run with.
+            seed: Random seed for sampling.
+            out_path: Path to where the JSON plan should be written. Optional.
+        """
+        assert sample_size > 0, "The sample size must be positive"
+        self.corpus_path = corpus_path
+        self.filter_names = filter_names or list(filters.CLI_FILTERS)
+        self.sample_size = sample_size
+        self.num_cores = num_cores or os.cpu_count() or 1
+        memory = memory_gb * 2**30 if memory_gb else physical_memory()
+        self.memory_bytes = int(memory) if memory else None
+        self.doc_block_size = doc_block_size
+        self.compact = compact
+        self.gc_mode = gc_mode
+        self.rng = random.Random(seed)
+        self.out_path = out_path
+
+    def _read_docs(self) -> dict[str, Any]:
+        """Read documents of the corpus until there are `sample_size` sentences, and
+        measure what they cost to read and hold."""
+        codec = get_codec(self.corpus_path)
+        corpus_size = os.path.getsize(self.corpus_path)
+        index = SentenceIndex.load_current(self.corpus_path)
+        if index is not None:
+            doc_order = list(range(len(index.docs)))
+            self.rng.shuffle(doc_order)
+            offsets = [index.docs[doc_idx][0] for doc_idx in doc_order]
+        else:
+            offsets = [0]  # then read on from wherever the last document ended
+
+        sents = []
+        num_docs = 0
+        num_bytes = 0
+        unpickle_seconds = 0.0
+        with open(self.corpus_path, "rb") as f:
+            for offset in offsets:
+                while len(sents) < self.sample_size:
+                    f.seek(offset)
+                    start = time.perf_counter()
+                    try:
+                        doc_sents = self._load_doc_sents(f, codec)
+                    except EOFError:
+                        break
+                    unpickle_seconds += time.perf_counter() - start
+                    num_docs += 1
+                    num_bytes += f.tell() - offset
+                    sents.extend(doc_sents)
+                    offset = f.tell()
+                    if index is not None:
+                        break
+                if len(sents) >= self.sample_size:
+                    break
+            assert sents, f"No sentences in {self.corpus_path}"
+
+            # what a document's sentences take once decoded (tracing allocations slows
+            # unpickling down, so the first document is read again for this)
+            f.seek(offsets[0])
+            tracemalloc.start()
+            try:
+                doc_sents = self._load_doc_sents(f, codec)
+                gc.collect()  # e.g. the Stanza objects `compact` sentences replace
+                memory_per_sent = tracemalloc.get_traced_memory()[0] / len(doc_sents)
+            finally:
+                tracemalloc.stop()
+            del doc_sents
+
+        if index is not None:
+            num_sents = len(index)
+        else:
+            num_sents = round(corpus_size * len(sents) / num_bytes)
+        return {
+            "sents": sents,
+            "num_docs_read": num_docs,
+            "num_sents_read": len(sents),
+            "num_sents": num_sents,
+            "num_sents_exact": index is not None,
+            "sents_per_doc": len(sents) / num_docs,
+            "unpickle_seconds_per_sent": unpickle_seconds / len(sents),
+            "memory_per_sent": memory_per_sent,
+        }
+
+    def _load_doc_sents(self, f, codec: Optional[str]) -> list:
+        sents = load_pickle(f, codec).sentences
+        if self.compact:
+            return [CompactSentence.from_stanza(sent) for sent in sents]
+        return sents
+
+    def run(self):
+        # load the filters (and their word lists) first, to measure what a worker holds
+        # before it reads anything
+        corpus_filters = {
+            name: filters.CLI_FILTERS[name](
+                f_in=self.corpus_path, f_accept_out_path=os.devnull
+            )
+            for name in self.filter_names
+        }
+        base_rss = current_rss()
+
+        with tune_gc(self.gc_mode):
+            corpus = self._read_docs()
+            sents = corpus.pop("sents")
+            sample = self.rng.sample(sents, min(self.sample_size, len(sents)))
+            del sents
+            filter_results = {}
+            for name, corpus_filter in corpus_filters.items():
+                rejected = []
+                start = time.perf_counter()
+                for sent in sample:
+                    rejected.append(corpus_filter._exclude_sent(sent))
+                seconds = time.perf_counter() - start
+                corpus_filter.close()
+                filter_results[name] = self._extrapolate(
+                    corpus, sample, rejected, seconds
+                )
+
+        plan = {
+            "corpus": self.corpus_path,
+            **corpus,
+            "filters": filter_results,
+            **self._recommend(corpus, filter_results, base_rss),
+        }
+        self._print_plan(plan)
+        if self.out_path:
+            with open(self.out_path, "w") as f:
+                json.dump(plan, f, indent=2)
+            print(f"Wrote the plan to {self.out_path}.")
+
+    def _extrapolate(
+        self,
+        corpus: dict[str, Any],
+        sample: list,
+        rejected: list[bool],
+        seconds: float,
+    ) -> dict[str, Any]:
+        """Scale a filter's cost and outputs on the sample up to the whole corpus."""
+        num_sents = corpus["num_sents"]
+        scale = num_sents / len(sample)
+        text_bytes = [len(sent.text.encode("utf-8")) + 1 for sent in sample]
+        seconds_per_sent = seconds / len(sample)
+        return {
+            "seconds_per_sent": seconds_per_sent,
+            "reject_rate": sum(rejected) / len(sample),
+            "cpu_hours": num_sents
+            * (corpus["unpickle_seconds_per_sent"] + seconds_per_sent)
+            / 3600,
+            "accept_bytes": scale
+            * sum(size for size, reject in zip(text_bytes, rejected) if not reject),
+            "reject_bytes": scale
+            * sum(size for size, reject in zip(text_bytes, rejected) if reject),
+            "mask_bytes": math.ceil(num_sents / 8),
+        }
+
+    def _recommend(
+        self,
+        corpus: dict[str, Any],
+        filter_results: dict[str, dict[str, Any]],
+        base_rss: int,
+    ) -> dict[str, Any]:
+        """Choose the number of workers, and the filters each one runs in its pass."""
+        # a worker holds the block it filters and the one read ahead of it, and in
+        # "manual" GC mode, the garbage of the blocks read since the last collection
+        blocks_held = 2
+        if self.gc_mode == "manual":
+            blocks_held += MANUAL_COLLECTION_INTERVAL
+        worker_rss = base_rss + blocks_held * self.doc_block_size * (
+            corpus["sents_per_doc"] * corpus["memory_per_sent"]
+        )
+        max_workers = min(self.num_cores, len(filter_results))
+        if self.memory_bytes:
+            max_workers = min(max_workers, int(self.memory_bytes // worker_rss))
+        max_workers = max(max_workers, 1)
+
+        costs = {
+            name: result["seconds_per_sent"] for name, result in filter_results.items()
+        }
+
+        def pass_hours(group: list[str]) -> float:
+            seconds_per_sent = corpus["unpickle_seconds_per_sent"] + sum(
+                costs[name] for name in group
+            )
+            return corpus["num_sents"] * seconds_per_sent / 3600
+
+        wall_hours = {
+            num_workers: max(
+                pass_hours(group) for group in group_filters(costs, num_workers)
+            )
+            for num_workers in range(1, max_workers + 1)
+        }
+        best = min(wall_hours.values())
+        num_workers = min(
+            num_workers
+            for num_workers, hours in wall_hours.items()
+            if hours <= best * WORKER_SPEEDUP_TOLERANCE
+        )
+        groups = group_filters(costs, num_workers)
+        return {
+            "worker_rss_bytes": worker_rss,
+            "single_pass_cpu_hours": pass_hours(list(costs)),
+            "recommended_workers": len(groups),
+            "max_workers": max_workers,
+            "groups": [
+                {"filters": group, "hours": pass_hours(group)} for group in groups
+            ],
+            "wall_hours": wall_hours[num_workers],
+            "cpu_hours": sum(pass_hours(group) for group in groups),
+            "peak_rss_bytes": len(groups) * worker_rss,
+        }
+
+    @staticmethod
+    def _print_plan(plan: dict[str, Any]):
+        num_sents = f"{plan['num_sents']:,}"
+        if not plan["num_sents_exact"]:
+            num_sents += " (estimated)"
+        print(
+            f"\n{plan['corpus']}: {num_sents} sentences; sampled "
+            f"{plan['num_sents_read']} from {plan['num_docs_read']} documents"
+        )
+        print(
+            f"Unpickling: {1000 * plan['unpickle_seconds_per_sent']:.3f} ms/sent; "
+            f"decoded sentences: {_format_bytes(plan['memory_per_sent'])} each"
+        )
+
+        def print_row(name, ms_per_sent, rate, cpu_time, accept, reject):
+            print(
+                f"{name:<30}{ms_per_sent:>10}{rate:>9}{cpu_time:>11}{accept:>13}"
+                f"{reject:>13}"
+            )
+
+        print()
+        print_row("filter", "ms/sent", "rejects", "CPU time", "accepted", "rejected")
+        for name, result in plan["filters"].items():
+            print_row(
+                name,
+                f"{1000 * result['seconds_per_sent']:.3f}",
+                f"{result['reject_rate']:.2%}",
+                _format_hours(result["cpu_hours"]),
+                _format_bytes(result["accept_bytes"]),
+                _format_bytes(result["reject_bytes"]),
+            )
+        one_at_a_time = sum(result["cpu_hours"] for result in plan["filters"].values())
+        print(
+            f"\nCPU time of all filters in one pass: "
+            f"{_format_hours(plan['single_pass_cpu_hours'])}; one at a time: "
+            f"{_format_hours(one_at_a_time)}"
+        )
+        print(
+            f"\nRecommended: {plan['recommended_workers']} worker(s) (of up to "
+            f"{plan['max_workers']}), ~{_format_bytes(plan['worker_rss_bytes'])} RSS "
+            f"each, {_format_bytes(plan['peak_rss_bytes'])} in total; "
+            f"{_format_hours(plan['wall_hours'])} wall-clock, "
+            f"{_format_hours(plan['cpu_hours'])} CPU time"
+        )
+        for idx, group in enumerate(plan["groups"]):
+            print(
+                f"  pass {idx} ({_format_hours(group['hours'])}): "
+                f"{' '.join(group['filters'])}"
+            )
@@ -0,0 +1,277 @@
+"""Alternative parses of the uncertain sentences of an annotated corpus.
+
+A filter misses a sentence when the parse it reads is wrong, and wrong parses cluster in
+the sentences the parser was least sure about. Given the confidence sidecar of an
+annotated corpus (see `corpus_filtering.confidence`), the `reparse` command re-parses
+only the sentences with some POS tag or head less confident than a threshold, with one
+or more alternative Stanza models (packages, e.g. trained on other treebanks), and
+caches the alternative parses by sentence fingerprint. For example:
+
+    python stanza_serialize.py w train.corpus train.pkl.zst --confidence
+    python -m corpus_filtering reparse train.pkl.zst train.reparse -t 0.6
+    python -m corpus_filtering passive train.pkl.zst train.accept.corpus \\
+        --alt-parses train.reparse --top-k 3
+
+Filters given the cache with `--alt-parses` evaluate their predicate over the top-k
+parses of every sentence that has alternatives (the original parse, followed by those
+of the packages in the order given to `reparse`), and reject the sentence if any of them
+is rejected, since the construction a filter targets is present if any plausible parse
+has it. Every other sentence costs a fingerprint lookup.
+
+The cache directory holds, for every package, the alternative parses (`<package>.pkl`,
+pickled `stanza.Document` objects, appended to by every run) and an index
+(`index.json`) of the byte offset and first sentence of every document and the
+fingerprint of every sentence, so that reruns (e.g. with a lower threshold, or over
+another corpus with overlapping sentences) only parse what is not cached yet.
+"""
+
+import argparse
+import itertools
+import json
+import os
+from collections.abc import Iterable
+from typing import Any, Optional
+
+from tqdm import tqdm
+
+from corpus_filtering.commands import CorpusCommand
+from corpus_filtering.compression import dump_pickle, load_pickle
+from corpus_filtering.confidence import CONFIDENCE_EXTENSION, ParseConfidences
+from corpus_filtering.dedup import fingerprint, normalize_sent
+
+__all__ = ["AltParseCache", "ReparseCommand"]
+
+CACHE_INDEX_NAME = "index.json"
+DEFAULT_PACKAGES = ["ewt", "gum"]
+DEFAULT_THRESHOLD = 0.5
+DEFAULT_BATCH_SIZE = 1000
+# filters read no constituency parses, so alternatives do without
+PROCESSORS = "tokenize,pos,lemma,depparse"
+
+
+def sent_fingerprint(sent) -> int:
+    """The fingerprint under which the alternative parses of a sentence are cached."""
+    return fingerprint(normalize_sent(sent.text))
+
+
+class AltParseCache:
+    """A directory of alternative parses, by package and sentence fingerprint."""
+
+    def __init__(self, directory: str):
+        """Constructor for AltParseCache.
+
+        Args:
+            directory: The cache directory; created on the first `add`, if need be.
+        """
+        self.directory = directory
+        self.index: dict[str, dict[str, Any]] = {}
+        index_path = os.path.join(directory, CACHE_INDEX_NAME)
+        if os.path.exists(index_path):
+            with open(index_path, "r") as f:
+                self.index = json.load(f)
+
+    @property
+    def packages(self) -> list[str]:
+        """The packages with cached parses, in the order they were first added."""
+        return list(self.index)
+
+    def fingerprints(self, package: str) -> set[int]:
+        entry = self.index.get(package)
+        return set(entry["fingerprints"]) if entry else set()
+
+    def add(self, package: str, doc, fingerprints: list[int]):
+        """Append the parses of a package to the cache.
+
+        Args:
+            package: The Stanza package that parsed the document.
+            doc: A `stanza.Document`.
+            fingerprints:
+                The fingerprints of the (original) sentences of the document, in order.
+        """
+        assert len(doc.sentences) == len(fingerprints), "Stanza split or merged lines"
+        os.makedirs(self.directory, exist_ok=True)
+        entry = self.index.setdefault(
+            package, {"corpus": f"{package}.pkl", "docs": [], "fingerprints": []}
+        )
+        with open(os.path.join(self.directory, entry["corpus"]), "ab") as f:
+            entry["docs"].append((f.tell(), len(entry["fingerprints"])))
+            dump_pickle(doc, f)
+        entry["fingerprints"].extend(fingerprints)
+        self.save()
+
+    def save(self):
+        with open(os.path.join(self.directory, CACHE_INDEX_NAME), "w") as f:
+            json.dump(self.index, f)
+
+    def parses(
+        self, packages: Optional[Iterable[str]] = None, max_parses: Optional[int] = None
+    ) -> dict[int, list]:
+        """Load the alternative parses into memory.
+
+        Args:
+            packages:
+                The packages whose parses to load, in order of preference. Optional; by
+                default, all of them, in the order they were added.
+            max_parses: The maximum number of alternative parses to keep per sentence.
+        Returns:
+            The alternative parses (Stanza `Sentence` objects) of every cached sentence,
+            by fingerprint, in order of preference.
+        """
+        alternatives: dict[int, list] = {}
+        for package in self.packages if packages is None else packages:
+            entry = self.index.get(package)
+            if not entry:
+                continue
+            fingerprints = entry["fingerprints"]
+            with open(os.path.join(self.directory, entry["corpus"]), "rb") as f:
+                for offset, start in entry["docs"]:
+                    f.seek(offset)
+                    doc = load_pickle(f)
+                    for fp, sent in zip(fingerprints[start:], doc.sentences):
+                        parses = alternatives.setdefault(fp, [])
+                        if max_parses is None or len(parses) < max_parses:
+                            parses.append(sent)
+        return alternatives
+
+
+class ReparseCommand(CorpusCommand):
+    """Re-parse the low-confidence sentences of an annotated corpus with alternative
+    Stanza models, caching the parses for filters to use with `--alt-parses`.
+    """
+
+    cli_subcmd_constructor_kwargs = {
+        "description": f"Description:\n{__doc__}",
+        "formatter_class": argparse.RawDescriptionHelpFormatter,
+    }
+
+    cli_subcmd_arguments = [
+        {
+            "args": ["corpus_path"],
+            "kwargs": {
+                "help": "Path to the annotated corpus (pickled `stanza.Document` "
+                "objects).",
+                "metavar": "input_file_path",
+            },
+        },
+        {
+            "args": ["cache_dir"],
+            "kwargs": {
+                "help": "Directory where the alternative parses are cached.",
+                "metavar": "cache_dir",
+            },
+        },
+        {
+            "args": ["--confidence"],
+            "kwargs": {
+                "help": "Path to the confidence sidecar of the corpus. Default: the "
+                f"corpus path with {CONFIDENCE_EXTENSION} appended.",
+                "dest": "confidence_path",
+            },
+        },
+        {
+            "args": ["-t", "--threshold"],
+            "kwargs": {
+                "type": float,
+                "default": DEFAULT_THRESHOLD,
+                "help": "Re-parse the sentences with any POS tag or head less "
+                "confident than this. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["-p", "--packages"],
+            "kwargs": {
+                "nargs": "+",
+                "default": DEFAULT_PACKAGES,
+                "help": "The alternative Stanza packages (models) to re-parse with, in "
+                "order of preference. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["-b", "--batch-size"],
+            "kwargs": {
+                "type": int,
+                "default": DEFAULT_BATCH_SIZE,
+                "dest": "batch_size",
+                "help": "How many sentences to parse per `stanza.Document`. Default: "
+                "%(default)s.",
+            },
+        },
+    ]
+
+    def __init__(
+        self,
+        corpus_path: str,
+        cache_dir: str,
+        confidence_path: Optional[str] = None,
+        threshold: float = DEFAULT_THRESHOLD,
+        packages: list[str] = DEFAULT_PACKAGES,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ):
+        """Constructor for ReparseCommand.
+
+        Args:
+            corpus_path: Path to the annotated corpus.
+            cache_dir: Directory where the alternative parses are cached.
+            confidence_path: Path to the confidence sidecar of the corpus.
+            threshold: The confidence below which sentences are re-parsed.
+            packages: The alternative Stanza packages, in order of preference.
+            batch_size: How many sentences to parse per `stanza.Document`.
+        """
+        assert batch_size > 0, "The batch size must be positive"
+        self.corpus_path = corpus_path
+        self.cache_dir = cache_dir
+        self.confidence_path = confidence_path or corpus_path + CONFIDENCE_EXTENSION
+        self.threshold = threshold
+        self.packages = packages
+        self.batch_size = batch_size
+
+    def _uncertain_sents(self) -> dict[int, list[str]]:
+        """The tokens of the (distinct) uncertain sentences, by fingerprint."""
+        from corpus_filtering.corpus_views import PickleStanzaDocCorpusView
+
+        confidences = ParseConfidences.load(self.confidence_path)
+        uncertain = set(confidences.uncertain(self.threshold))
+        sents: dict[int, list[str]] = {}
+        num_sents = 0
+        for sent_id, sent in enumerate(PickleStanzaDocCorpusView(self.corpus_path)):
+            num_sents += 1
+            if sent_id in uncertain:
+                sents.setdefault(
+                    sent_fingerprint(sent), [token.text for token in sent.tokens]
+                )
+        assert num_sents == len(
+            confidences
+        ), f"{self.confidence_path} does not match {self.corpus_path}"
+        print(
+            f"{len(uncertain)} of {num_sents} sentences ({len(sents)} distinct) are "
+            f"less confident than {self.threshold}."
+        )
+        return sents
+
+    def run(self):
+        import stanza
+
+        sents = self._uncertain_sents()
+        cache = AltParseCache(self.cache_dir)
+        for package in self.packages:
+            cached = cache.fingerprints(package)
+            todo = [fp for fp in sents if fp not in cached]
+            print(f"{package}: {len(sents) - len(todo)} cached, {len(todo)} to parse.")
+            if not todo:
+                continue
+            pipeline = stanza.Pipeline(
+                lang="en",
+                package=package,
+                processors=PROCESSORS,
+                tokenize_pretokenized=True,
+            )
+            todo_iter = iter(todo)
+            with tqdm(total=len(todo), desc=package, dynamic_ncols=True) as progress:
+                while True:
+                    batch = list(itertools.islice(todo_iter, self.batch_size))
+                    if not batch:
+                        break
+                    doc = pipeline([sents[fp] for fp in batch])
+                    cache.add(package, doc, batch)
+                    progress.update(len(batch))
+        print(f"Alternative parses cached in {self.cache_dir}.")
@@ -0,0 +1,347 @@
+"""Streaming random sampling of corpuses, e.g. to draw the 10K-sentence test sets.
+
+Sampling is done in a single pass with reservoir sampling: only the sampled sentences
+(and their positions in the input) are ever held in memory, however large the corpus.
+Sampled sentences are written in the order they appear in the input, and the same seed
+always draws the same sample from the same input. For example:
+
+    python -m corpus_filtering sample train.corpus test.10k.corpus -n 10000
+
+Sampling can be stratified, in which case a sample of `-n` sentences is drawn from every
+stratum (rather than from the corpus as a whole). Sentences can be stratified by length
+(`--length-bins`) and/or by whether a filter rejected them (`--reject-file`, the reject
+output of a filter run on this very corpus).
+
+The input may also be an annotated corpus of pickled `stanza.Document` objects (a `.pkl`
+file, possibly compressed; see `stanza_serialize.py`), in which case the output is an
+annotated corpus of the sampled sentences, which can be filtered without annotating
+them again.
+"""
+
+import argparse
+import bisect
+import os
+import random
+from collections.abc import Iterable, Iterator
+from typing import Any, Callable, Hashable, Optional, TypeVar
+
+from tqdm import tqdm
+
+from corpus_filtering.commands import CorpusCommand
+from corpus_filtering.compression import dump_pickle, get_codec, open_compressed
+
+__all__ = [
+    "reservoir_sample",
+    "stratified_reservoir_sample",
+    "RejectStatus",
+    "SampleCommand",
+]
+
+T = TypeVar("T")
+
+PICKLE_EXTENSIONS = (".pkl", ".pickle")
+
+
+def reservoir_sample(items: Iterable[T], k: int, rng: random.Random) -> list[T]:
+    """Draw a uniform random sample of `k` items in a single pass, keeping input order.
+
+    Args:
+        items: The items to sample from; consumed lazily, exactly once.
+        k: The sample size. If there are fewer than `k` items, all of them are returned.
+        rng: The random number generator; seed it for a reproducible sample.
+    Returns:
+        The sampled items, in the order they were yielded by `items`.
+    """
+    return stratified_reservoir_sample(items, k, rng, lambda item: None).get(None, [])
+
+
+def stratified_reservoir_sample(
+    items: Iterable[T],
+    k: int,
+    rng: random.Random,
+    stratum: Callable[[T], Hashable],
+) -> dict[Hashable, list[T]]:
+    """Draw a uniform random sample of `k` items from every stratum, in a single pass.
+
+    Args:
+        items: The items to sample from; consumed lazily, exactly once.
+        k: The sample size per stratum.
+        rng: The random number generator; seed it for a reproducible sample.
+        stratum: Function mapping an item to its stratum.
+    Returns:
+        Mapping from each stratum to its sampled items, in the order they were yielded by
+        `items`.
+    """
+    # per stratum: [number of items seen so far, reservoir of (input index, item)]
+    reservoirs: dict[Hashable, list[Any]] = {}
+    for idx, item in enumerate(items):
+        key = stratum(item)
+        state = reservoirs.get(key)
+        if state is None:
+            state = reservoirs[key] = [0, []]
+        state[0] += 1
+        seen, reservoir = state
+        if len(reservoir) < k:
+            reservoir.append((idx, item))
+        else:
+            slot = rng.randrange(seen)
+            if slot < k:
+                reservoir[slot] = (idx, item)
+    return {
+        key: [item for _, item in sorted(reservoir, key=lambda entry: entry[0])]
+        for key, (_, reservoir) in reservoirs.items()
+    }
+
+
+class RejectStatus:
+    """Determines, one sentence at a time, whether a filter rejected each sentence of the
+    corpus it was run on.
+
+    Filters write their rejected sentences in corpus order, so the reject output of a
+    filter is a subsequence of its input; a sentence is rejected just in case it matches
+    the next not-yet-matched line of the reject file. This needs a single pass over both
+    files and no memory beyond the current line of each.
+    """
+
+    def __init__(self, reject_file_path: str):
+        """Constructor for RejectStatus.
+
+        Args:
+            reject_file_path: Path to the filter's reject output.
+        """
+        self.reject_file_path = reject_file_path
+        self._f_reject = open_compressed(reject_file_path, "r")
+        self._next_reject = self._read_reject()
+
+    def _read_reject(self) -> Optional[str]:
+        for line in self._f_reject:
+            sent = " ".join(line.split())
+            if sent:
+                return sent
+        return None
+
+    def __call__(self, sent: str) -> bool:
+        """Whether the filter rejected the next sentence of the corpus.
+
+        Args:
+            sent: The (whitespace-normalized) next sentence the filter was run on.
+        """
+        rejected = sent == self._next_reject
+        if rejected:
+            self._next_reject = self._read_reject()
+        return rejected
+
+    def close(self):
+        self._f_reject.close()
+        assert (
+            self._next_reject is None
+        ), f"{self.reject_file_path} is not a subsequence of the corpus"
+
+
+def is_pickle_path(path: str) -> bool:
+    """Whether a (possibly compressed) file holds pickled `stanza.Document` objects."""
+    if get_codec(path):
+        path = os.path.splitext(path)[0]
+    return os.path.splitext(path)[1].lower() in PICKLE_EXTENSIONS
+
+
+class SampleCommand(CorpusCommand):
+    """Randomly sample sentences from a corpus, in a single pass and bounded memory.
+
+    The input is either a plaintext corpus (one sentence per line) or an annotated
+    corpus of pickled `stanza.Document` objects (with a `.pkl` extension). The sampled
+    sentences are written in input order, in the same format as the input.
+    """
+
+    cli_subcmd_constructor_kwargs = {
+        "description": f"Description:\n{__doc__}",
+        "formatter_class": argparse.RawDescriptionHelpFormatter,
+    }
+
+    cli_subcmd_arguments = [
+        {
+            "args": ["f_in_path"],
+            "kwargs": {
+                "help": "Path to the input corpus, plaintext or pickled (.pkl).",
+                "metavar": "input_file_path",
+            },
+        },
+        {
+            "args": ["f_out_path"],
+            "kwargs": {
+                "help": "Path to file where the sampled sentences should be written.",
+                "metavar": "output_file_path",
+            },
+        },
+        {
+            "args": ["-n", "--num-sents"],
+            "kwargs": {
+                "type": int,
+                "required": True,
+                "dest": "num_sents",
+                "help": "Number of sentences to sample (per stratum, if stratified).",
+            },
+        },
+        {
+            "args": ["-s", "--seed"],
+            "kwargs": {
+                "type": int,
+                "default": 42,
+                "help": "Random seed. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["--max-words"],
+            "kwargs": {
+                "type": int,
+                "default": 512,
+                "dest": "max_words",
+                "help": "Skip sentences longer than this many words. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["--length-bins"],
+            "kwargs": {
+                "type": int,
+                "nargs": "+",
+                "dest": "length_bins",
+                "help": "Stratify by sentence length, with bins whose upper bounds (in "
+                "words) are the given numbers, plus one for longer sentences.",
+            },
+        },
+        {
+            "args": ["--reject-file"],
+            "kwargs": {
+                "dest": "reject_file_path",
+                "help": "Stratify by filter decision, given the reject output of a filter "
+                "run on the input corpus. Only supported for plaintext input.",
+            },
+        },
+    ]
+
+    def __init__(
+        self,
+        f_in_path: str,
+        f_out_path: str,
+        num_sents: int,
+        seed: int = 42,
+        max_words: Optional[int] = 512,
+        length_bins: Optional[list[int]] = None,
+        reject_file_path: Optional[str] = None,
+    ):
+        """Constructor for SampleCommand.
+
+        Args:
+            f_in_path: Path to the input corpus, plaintext or pickled.
+            f_out_path: Path to where the sampled sentences should be written.
+            num_sents: Number of sentences to sample (per stratum, if stratified).
+            seed: The random seed.
+            max_words: If not `None`, skip sentences longer than this many words.
+            length_bins: If not `None`, stratify by length with these bin upper bounds.
+            reject_file_path: If not `None`, stratify by this filter reject output.
+        """
+        self.f_in_path = f_in_path
+        self.f_out_path = f_out_path
+        self.num_sents = num_sents
+        self.seed = seed
+        self.max_words = max_words
+        self.length_bins = sorted(length_bins) if length_bins else None
+        self.reject_file_path = reject_file_path
+        self.is_pickle = is_pickle_path(f_in_path)
+        assert not (
+            self.is_pickle and reject_file_path
+        ), "--reject-file is only supported for plaintext corpuses"
+
+    def _iter_text(self) -> Iterator[tuple[str, int, bool]]:
+        reject_status = self.reject_file_path and RejectStatus(self.reject_file_path)
+        with open_compressed(self.f_in_path, "r") as f_in:
+            for line in f_in:
+                sent = " ".join(line.split())
+                if sent:
+                    yield sent, len(sent.split()), bool(
+                        reject_status and reject_status(sent)
+                    )
+        if reject_status:
+            reject_status.close()
+
+    def _iter_pickle(self) -> Iterator[tuple[Any, int, bool]]:
+        from corpus_filtering.corpus_views import PickleStanzaDocCorpusView
+
+        for sent in PickleStanzaDocCorpusView(self.f_in_path):
+            # detach the sentence from its document, so that keeping it in the sample
+            # does not keep the (much larger) rest of the document in memory
+            sent._doc = None
+            yield sent, len(sent.words), False
+
+    def _write_text(self, sents: list[str]):
+        with open_compressed(self.f_out_path, "w") as f_out:
+            for sent in sents:
+                f_out.write(f"{sent}\n")
+
+    def _write_pickle(self, sents: list):
+        from stanza import Document
+
+        doc = Document([])
+        doc.sentences = sents
+        for sent in sents:
+            sent._doc = doc
+        doc._count_words()
+        with open(self.f_out_path, "wb") as f_out:
+            dump_pickle(doc, f_out, get_codec(self.f_out_path))
+
+    def _stratum(self, item: tuple) -> tuple:
+        _, _, length, rejected = item
+        key = ()
+        if self.length_bins:
+            key += (bisect.bisect_left(self.length_bins, length),)
+        if self.reject_file_path:
+            key += (rejected,)
+        return key
+
+    def run(self):
+        # items are (input index, sentence, length, rejected) tuples
+        items: Iterable[tuple[int, Any, int, bool]] = (
+            (idx, *item)
+            for idx, item in enumerate(
+                tqdm(
+                    self._iter_pickle() if self.is_pickle else self._iter_text(),
+                    desc="Sampling sentences",
+                    dynamic_ncols=True,
+                )
+            )
+        )
+        if self.max_words is not None:
+            items = (item for item in items if item[2] <= self.max_words)
+
+        samples = stratified_reservoir_sample(
+            items, self.num_sents, random.Random(self.seed), self._stratum
+        )
+        for key, sample in sorted(samples.items()):
+            print(f"Stratum {self._describe(key)}: sampled {len(sample)} sentences")
+
+        # merge the strata back into input order
+        sents = [
+            item[1]
+            for item in sorted(
+                (item for sample in samples.values() for item in sample),
+                key=lambda item: item[0],
+            )
+        ]
+        if self.is_pickle:
+            self._write_pickle(sents)
+        else:
+            self._write_text(sents)
+        print(f"Wrote {len(sents)} sampled sentences to {self.f_out_path}")
+
+    def _describe(self, key: tuple) -> str:
+        parts = []
+        if self.length_bins:
+            bin_idx, key = key[0], key[1:]
+            lower = self.length_bins[bin_idx - 1] + 1 if bin_idx else 1
+            upper = (
+                self.length_bins[bin_idx] if bin_idx < len(self.length_bins) else None
+            )
+            parts.append(f"length {lower}-{upper}" if upper else f"length {lower}+")
+        if self.reject_file_path:
+            parts.append("rejected" if key[0] else "accepted")
+        return ", ".join(parts) or "all"
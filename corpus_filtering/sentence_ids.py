@@ -0,0 +1,125 @@
+"""Sidecar files recording which sentences of the source corpus a filter output holds.
+
+A filtered corpus written as text (e.g. `train.accept.corpus`) cannot be traced back to
+the positions of its sentences in the source corpus without matching texts. When a
+filter is run with `--ids`, it also writes, next to each of its text outputs, a `.ids`
+sidecar holding the global ID of every sentence of the output, in output order, e.g.
+`train.accept.corpus.ids` for `train.accept.corpus`. Line `i` of the output is then
+sentence `load_sentence_ids(...)[i]` of the source corpus, so outputs, caches and
+evaluation results can be joined on integer IDs.
+
+The global ID of a sentence is its index among the sentences (i.e. non-blank lines) of
+the source corpus, counting from 0: the original corpus if the filter is given a dedup
+index (so duplicate sentences keep distinct IDs), and otherwise the input corpus. These
+are also the bit indices of `.mask` outputs, which are the bitmap equivalent of a
+sidecar (see `corpus_filtering.corpus_views.masked_corpus_views`).
+
+Since outputs preserve the order of the source corpus, the IDs are strictly increasing,
+and stored as the gaps between consecutive IDs (minus 1, starting from -1) in unsigned
+LEB128 varints: most outputs keep long runs of consecutive sentences, so most IDs take a
+single byte. Sidecar files consist of a one-line JSON header (number of IDs, the source
+corpus if known) followed by the varints.
+"""
+
+import json
+from array import array
+from collections.abc import Iterable
+from typing import Optional
+
+__all__ = [
+    "IDS_EXTENSION",
+    "encode_sentence_ids",
+    "decode_sentence_ids",
+    "SentenceIdWriter",
+    "load_sentence_ids",
+]
+
+IDS_EXTENSION = ".ids"
+
+
+def _encode_gap(gap: int, out: bytearray):
+    while gap >= 0x80:
+        out.append(gap & 0x7F | 0x80)
+        gap >>= 7
+    out.append(gap)
+
+
+def encode_sentence_ids(sent_ids: Iterable[int]) -> bytes:
+    """Delta-encode strictly increasing sentence IDs as varints."""
+    out = bytearray()
+    prev = -1
+    for sent_id in sent_ids:
+        assert sent_id > prev, "Sentence IDs must be strictly increasing"
+        _encode_gap(sent_id - prev - 1, out)
+        prev = sent_id
+    return bytes(out)
+
+
+def decode_sentence_ids(data: bytes) -> array:
+    """Decode the output of `encode_sentence_ids` into an array (typecode "Q")."""
+    sent_ids = array("Q")
+    prev = -1
+    gap = 0
+    shift = 0
+    for byte in data:
+        gap |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        prev += gap + 1
+        sent_ids.append(prev)
+        gap = 0
+        shift = 0
+    assert shift == 0, "Truncated sentence IDs"
+    return sent_ids
+
+
+class SentenceIdWriter:
+    """Collects the IDs of the sentences written to a filter output, and saves them to
+    its sidecar on `close`."""
+
+    def __init__(self, path: str, base_path: Optional[str] = None):
+        """Constructor for SentenceIdWriter.
+
+        Args:
+            path: Path to where the sidecar should be written.
+            base_path: Path to the corpus the IDs index into, if known.
+        """
+        self.path = path
+        self.base_path = base_path
+        self.num_ids = 0
+        self._data = bytearray()
+        self._prev = -1
+
+    def add(self, sent_id: int):
+        assert sent_id > self._prev, "Sentence IDs must be strictly increasing"
+        _encode_gap(sent_id - self._prev - 1, self._data)
+        self._prev = sent_id
+        self.num_ids += 1
+
+    def close(self):
+        """Write the sidecar to file."""
+        header = {"num_ids": self.num_ids, "base_path": self.base_path}
+        with open(self.path, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            f.write(self._data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def load_sentence_ids(path: str) -> array:
+    """Read the sentence IDs of a sidecar written by `SentenceIdWriter`.
+
+    Returns:
+        An array (typecode "Q") of the global ID of each sentence of the output, in
+        output order.
+    """
+    with open(path, "rb") as f:
+        header = json.loads(f.readline())
+        sent_ids = decode_sentence_ids(f.read())
+    assert len(sent_ids) == header["num_ids"], f"{path} is truncated"
+    return sent_ids
@@ -0,0 +1,127 @@
+"""Statistics about a filter's decisions, collected during the filtering pass itself.
+
+When a filter is given a stats path (`--stats`), `filter_write` tallies, as it goes:
+
+    * the number of accepted and rejected sentences, and of their tokens (words);
+    * the distribution of sentence lengths (in words) of either partition;
+    * the most frequent triggers of the rejections, i.e. the (lemmas of the) words that
+        caused the filter to reject a sentence, for filters that record them (see
+        `CorpusFilterWriter._triggered_by`).
+
+and writes them as JSON once the pass is done, along with the garbage collector's pauses
+during the pass (see `corpus_filtering.gc_tuning`). Triggers are counted with the
+Space-Saving heavy-hitters sketch, so memory stays bounded however many distinct
+triggers there are; every other statistic is a handful of counters per sentence.
+
+If the input corpus is deduplicated (see `corpus_filtering.dedup`), the statistics are
+over the unique sentences.
+"""
+
+import json
+from collections.abc import Hashable
+from typing import Any, Optional
+
+__all__ = ["SpaceSaving", "FilterStats"]
+
+DEFAULT_NUM_TRIGGERS = 100
+
+
+class SpaceSaving:
+    """The Space-Saving sketch (Metwally et al., 2005) of the most frequent items of a
+    stream, using memory for at most `k` items.
+
+    Every item that occurs more than `n / k` times in a stream of `n` items is kept, and
+    the count of every kept item overestimates its true count by at most its recorded
+    error (and at most `n / k`).
+    """
+
+    def __init__(self, k: int = DEFAULT_NUM_TRIGGERS):
+        """Constructor for SpaceSaving.
+
+        Args:
+            k: The number of items (counters) to keep.
+        """
+        assert k > 0, "The sketch must keep at least one item"
+        self.k = k
+        # item -> [count, overestimation error]
+        self._counters: dict[Hashable, list[int]] = {}
+
+    def add(self, item: Hashable):
+        counter = self._counters.get(item)
+        if counter is not None:
+            counter[0] += 1
+        elif len(self._counters) < self.k:
+            self._counters[item] = [1, 0]
+        else:
+            # replace the least frequent item; its count bounds the new item's count
+            # n.b.: a linear scan, which is fine as long as additions of new items are
+            # rare compared to the filtered sentences (or k is small)
+            min_item = min(self._counters, key=lambda key: self._counters[key][0])
+            min_count = self._counters.pop(min_item)[0]
+            self._counters[item] = [min_count + 1, min_count]
+
+    def top(self, n: Optional[int] = None) -> list[tuple[Hashable, int, int]]:
+        """The `n` (default: all kept) most frequent items, as (item, count, error)."""
+        return sorted(
+            ((item, count, error) for item, (count, error) in self._counters.items()),
+            key=lambda entry: -entry[1],
+        )[:n]
+
+
+class FilterStats:
+    """Streaming aggregates of a filter's decisions; see the module docstring."""
+
+    def __init__(self, num_triggers: int = DEFAULT_NUM_TRIGGERS):
+        """Constructor for FilterStats.
+
+        Args:
+            num_triggers: The number of distinct triggers to keep counts for.
+        """
+        # index 0: accepted, index 1: rejected
+        self.num_sents = [0, 0]
+        self.num_tokens = [0, 0]
+        self.lengths: tuple[dict[int, int], dict[int, int]] = ({}, {})
+        self.triggers = SpaceSaving(num_triggers)
+        # the report of the `GCMonitor` of the pass, if any
+        self.gc: Optional[dict[str, Any]] = None
+
+    def add(self, num_tokens: int, reject: bool, trigger: Optional[str] = None):
+        """Tally one sentence.
+
+        Args:
+            num_tokens: The length of the sentence, in tokens (words).
+            reject: Whether the filter rejected the sentence.
+            trigger: What caused the sentence to be rejected, if known.
+        """
+        self.num_sents[reject] += 1
+        self.num_tokens[reject] += num_tokens
+        lengths = self.lengths[reject]
+        lengths[num_tokens] = lengths.get(num_tokens, 0) + 1
+        if trigger is not None:
+            self.triggers.add(trigger)
+
+    def to_dict(self) -> dict[str, Any]:
+        partitions = ("accepted", "rejected")
+        stats = {
+            "num_sents": dict(zip(partitions, self.num_sents)),
+            "num_tokens": dict(zip(partitions, self.num_tokens)),
+            "rejected_fraction": {
+                "sents": self.num_sents[1] / (sum(self.num_sents) or 1),
+                "tokens": self.num_tokens[1] / (sum(self.num_tokens) or 1),
+            },
+            "length_histogram": {
+                partition: dict(sorted(lengths.items()))
+                for partition, lengths in zip(partitions, self.lengths)
+            },
+            "top_triggers": [
+                {"trigger": trigger, "count": count, "max_overcount": error}
+                for trigger, count, error in self.triggers.top()
+            ],
+        }
+        if self.gc is not None:
+            stats["gc"] = self.gc
+        return stats
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
@@ -0,0 +1,168 @@
+"""Background-thread reading and writing, so that filtering does not wait on storage.
+
+Filters read their input and write their outputs on the same thread that evaluates
+their predicate, so on a network filesystem every stall in a read or write stalls the
+whole pass. This module moves that I/O onto dedicated threads:
+
+    * `BackgroundWriter` wraps an output file: `write` only appends to an in-memory
+        chunk, and full chunks are handed to a writer thread through a bounded queue.
+    * `prefetch` wraps an input iterator (e.g. a `PickleStanzaDocCorpusView`): a reader
+        thread runs ahead of the consumer, handing over batches of items through a
+        bounded queue.
+
+In both cases, the queue depth bounds how far the I/O thread can fall behind (or run
+ahead), and so the memory used: once the queue is full, the producer blocks until the
+other side catches up (backpressure). Reading and writing (and decompressing) files
+release the GIL, so they overlap with predicate evaluation; unpickling does not, so the
+gain for reading is in hiding I/O latency rather than in parallel decoding.
+
+Exceptions raised on an I/O thread are re-raised on the main thread, at the next call
+to `write`/`close`, or when the next item is taken from `prefetch`.
+"""
+
+import queue
+import threading
+from collections.abc import Iterable, Iterator
+from typing import IO, Any, Optional, TypeVar
+
+__all__ = ["DEFAULT_QUEUE_DEPTH", "BackgroundWriter", "prefetch"]
+
+T = TypeVar("T")
+
+# How many chunks (of writes) or batches (of items read) may be in flight at once
+DEFAULT_QUEUE_DEPTH = 64
+# Approximate number of characters per chunk handed to the writer thread
+WRITE_CHUNK_SIZE = 1 << 16
+# Number of items per batch handed over by the reader thread
+PREFETCH_BATCH_SIZE = 256
+# How often (in seconds) a blocked reader thread checks whether it was abandoned
+_POLL_INTERVAL = 0.1
+
+_DONE = object()
+
+
+class BackgroundWriter:
+    """A (text or binary) file whose writes are performed on a background thread."""
+
+    def __init__(self, f: IO, queue_depth: int = DEFAULT_QUEUE_DEPTH):
+        """Constructor for BackgroundWriter.
+
+        Args:
+            f: The file to write to; it is closed along with the `BackgroundWriter`.
+            queue_depth: The maximum number of chunks waiting to be written.
+        """
+        assert queue_depth > 0, "The queue depth must be positive"
+        self._f = f
+        self._chunk: list = []
+        self._chunk_size = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_depth)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is _DONE:
+                return
+            if self._error is None:
+                try:
+                    self._f.write(chunk)
+                except BaseException as e:
+                    # keep draining the queue, so that the main thread never blocks
+                    self._error = e
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, data: Any):
+        self._chunk.append(data)
+        self._chunk_size += len(data)
+        if self._chunk_size >= WRITE_CHUNK_SIZE:
+            self._flush_chunk()
+
+    def _flush_chunk(self):
+        self._check()
+        if self._chunk:
+            self._queue.put(self._chunk[0][:0].join(self._chunk))
+            self._chunk = []
+            self._chunk_size = 0
+
+    def close(self):
+        """Write out everything still buffered, then close the underlying file."""
+        if self._thread is None:
+            return
+        try:
+            self._flush_chunk()
+        finally:
+            self._queue.put(_DONE)
+            self._thread.join()
+            self._thread = None
+            self._f.close()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def prefetch(items: Iterable[T], queue_depth: int = DEFAULT_QUEUE_DEPTH) -> Iterator[T]:
+    """Iterate over `items` on a background thread, ahead of the consumer.
+
+    Args:
+        items: The items to iterate over, e.g. the sentences of a corpus view.
+        queue_depth:
+            The maximum number of batches (of `PREFETCH_BATCH_SIZE` items) read ahead.
+            If not positive, `items` is iterated over on the calling thread.
+    Returns:
+        An iterator over the same items, in the same order.
+    """
+    if queue_depth <= 0:
+        yield from items
+        return
+
+    batches: queue.Queue = queue.Queue(maxsize=queue_depth)
+    abandoned = threading.Event()
+
+    def put(batch) -> bool:
+        # give up if the consumer stopped iterating, rather than block forever
+        while not abandoned.is_set():
+            try:
+                batches.put(batch, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run():
+        batch = []
+        try:
+            for item in items:
+                batch.append(item)
+                if len(batch) >= PREFETCH_BATCH_SIZE:
+                    if not put(batch):
+                        return
+                    batch = []
+        except BaseException as e:
+            # hand over the items read before the error first
+            if put(batch):
+                put(e)
+            return
+        if put(batch):
+            put(_DONE)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is _DONE:
+                break
+            if isinstance(batch, BaseException):
+                raise batch
+            yield from batch
+    finally:
+        abandoned.set()
@@ -0,0 +1,352 @@
+"""Validation of the registered filters against BLiMP and a sample of the corpus.
+
+A filter should reject every `sentence_good` sentence of the BLiMP paradigms it targets
+(its recall), while rejecting as little of the rest of the corpus as possible (its
+rejection rate). The `validate` command measures both, for every registered filter with
+target paradigms (see `FilterSpec.blimp_paradigms`), in parallel worker processes:
+
+    python -m corpus_filtering validate --sample data/gulordava_corpus/train.10k.pkl
+
+The annotated BLiMP sentences are read from the indexed corpus the `blimp-corpus`
+command writes to `blimp_dir` (see `corpus_filtering/blimp.py`), or else from
+`{blimp_dir}/{paradigm}.pkl` (optionally compressed), i.e. the `sentence_good`
+sentences of each paradigm (see `data/blimp/scripts/blimp_json2corpus.sh`) annotated
+with `stanza_serialize.py`, so that validation never runs Stanza itself. The sample is
+any annotated corpus, e.g. the 10K training sentences drawn with the `sample` command.
+Paradigms without annotations are skipped with a warning.
+
+With `--alt-parses`, filters also evaluate their predicate on the cached alternative
+parses of uncertain sentences (see `corpus_filtering.reparse`), exactly as they do when
+filtering with `--alt-parses`.
+
+Besides the recall and rejection-rate tables, the report includes the time each filter
+took per sentence and a random sample of its false negatives (target sentences it did
+not reject) along with their parses, which are the starting point for debugging it.
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import random
+import time
+from typing import Any, Optional
+
+from corpus_filtering import filters
+from corpus_filtering.blimp import BLIMP_INDEX_NAME, BlimpCorpus
+from corpus_filtering.commands import CorpusCommand
+from corpus_filtering.compression import CODEC_EXTENSIONS
+from corpus_filtering.filters.word_lists import load_word_list, resolve_data_path
+from corpus_filtering.reparse import CACHE_INDEX_NAME
+from corpus_filtering.sampling import reservoir_sample
+
+__all__ = ["format_parse", "ValidateCommand"]
+
+DEFAULT_BLIMP_DIR = "data/blimp/annotated"
+
+
+def format_parse(sent) -> str:
+    """Format the dependency parse of a Stanza `Sentence`, one word per line."""
+    return "\n".join(
+        f"{word.id}\t{word.text}\t{word.lemma}\t{word.upos}\t{word.feats or '_'}\t"
+        f"{word.head}\t{word.deprel}"
+        for word in sent.words
+    )
+
+
+def find_annotated(directory: str, name: str) -> Optional[str]:
+    """Find `{directory}/{name}.pkl`, possibly with a compression extension."""
+    for ext in ("", *CODEC_EXTENSIONS):
+        path = os.path.join(directory, f"{name}.pkl{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def run_filter(task: tuple[str, str, str, int, int, dict[str, Any]]) -> dict[str, Any]:
+    """Run one filter's predicate over one annotated corpus, in a worker process.
+
+    Args:
+        task:
+            The filter name, the label of the corpus (a BLiMP paradigm or "sample"), the
+            path to the corpus (or to the directory of an indexed BLiMP corpus holding
+            the paradigm), the number of false negatives to sample and the seed to
+            sample them with, and extra keyword arguments of the filter (e.g. its
+            alternative parses).
+    Returns:
+        The number of sentences, of rejected sentences, the time taken, and (for BLiMP
+        paradigms) the sampled false negatives.
+    """
+    filter_name, label, path, num_false_negatives, seed, filter_kwargs = task
+    blimp = BlimpCorpus(path) if os.path.isdir(path) else None
+    # the filter is only used for its predicate and reader, so discard its output
+    corpus_filter = filters.CLI_FILTERS[filter_name](
+        f_in=blimp.corpus_path if blimp else path,
+        f_accept_out_path=os.devnull,
+        **filter_kwargs,
+    )
+    with corpus_filter:
+        exclude_sent = corpus_filter._sent_predicate()
+        num_sents = 0
+        num_rejected = 0
+        false_negatives = []
+        start = time.perf_counter()
+        sents = blimp.sentences(label) if blimp else corpus_filter._get_sents()
+        for sent in sents:
+            num_sents += 1
+            if exclude_sent(sent):
+                num_rejected += 1
+            elif label != "sample":
+                false_negatives.append(sent)
+        seconds = time.perf_counter() - start
+    return {
+        "filter": filter_name,
+        "corpus": label,
+        "num_sents": num_sents,
+        "num_rejected": num_rejected,
+        "seconds": seconds,
+        "false_negatives": [
+            {"text": sent.text, "parse": format_parse(sent)}
+            for sent in reservoir_sample(
+                false_negatives, num_false_negatives, random.Random(seed)
+            )
+        ],
+    }
+
+
+class ValidateCommand(CorpusCommand):
+    """Report each filter's recall on the BLiMP sentences it targets and its rejection
+    rate on a sample of the corpus, with timings and sampled false negatives.
+    """
+
+    cli_subcmd_constructor_kwargs = {
+        "description": f"Description:\n{__doc__}",
+        "formatter_class": argparse.RawDescriptionHelpFormatter,
+    }
+
+    cli_subcmd_arguments = [
+        {
+            "args": ["--blimp-dir"],
+            "kwargs": {
+                "default": DEFAULT_BLIMP_DIR,
+                "dest": "blimp_dir",
+                "help": "Directory with the annotated `sentence_good` sentences of the "
+                "BLiMP paradigms, as written by `blimp-corpus` or as {paradigm}.pkl. "
+                "Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["--sample"],
+            "kwargs": {
+                "dest": "sample_path",
+                "help": "Path to an annotated sample of the corpus, on which to measure "
+                "rejection rates.",
+            },
+        },
+        {
+            "args": ["-f", "--filters"],
+            "kwargs": {
+                "nargs": "+",
+                "dest": "filter_names",
+                "help": "The filters to validate. Default: all filters with target "
+                "BLiMP paradigms.",
+            },
+        },
+        {
+            "args": ["-j", "--workers"],
+            "kwargs": {
+                "type": int,
+                "default": os.cpu_count(),
+                "dest": "num_workers",
+                "help": "Number of worker processes. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["-k", "--false-negatives"],
+            "kwargs": {
+                "type": int,
+                "default": 5,
+                "dest": "num_false_negatives",
+                "help": "Number of false negatives to sample per filter and paradigm. "
+                "Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["-s", "--seed"],
+            "kwargs": {
+                "type": int,
+                "default": 42,
+                "help": "Random seed for sampling false negatives. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["--alt-parses"],
+            "kwargs": {
+                "dest": "alt_parses_dir",
+                "help": "Path to a cache of alternative parses (see the `reparse` "
+                "command), for the filters to also evaluate their predicate on.",
+            },
+        },
+        {
+            "args": ["--top-k"],
+            "kwargs": {
+                "type": int,
+                "default": 3,
+                "dest": "top_k",
+                "help": "How many parses of each sentence to evaluate the predicate on "
+                "with --alt-parses. Default: %(default)s.",
+            },
+        },
+        {
+            "args": ["-o", "--out"],
+            "kwargs": {
+                "dest": "out_path",
+                "help": "Path to file where the full report should be written as JSON.",
+            },
+        },
+    ]
+
+    def __init__(
+        self,
+        blimp_dir: str = DEFAULT_BLIMP_DIR,
+        sample_path: Optional[str] = None,
+        filter_names: Optional[list[str]] = None,
+        num_workers: Optional[int] = None,
+        num_false_negatives: int = 5,
+        seed: int = 42,
+        alt_parses_dir: Optional[str] = None,
+        top_k: int = 3,
+        out_path: Optional[str] = None,
+    ):
+        """Constructor for ValidateCommand.
+
+        Args:
+            blimp_dir: Directory with the annotated BLiMP paradigms.
+            sample_path: Path to an annotated sample of the corpus. Optional.
+            filter_names: The filters to validate. Optional; defaults to all filters
+                with target BLiMP paradigms.
+            num_workers: Number of worker processes. Defaults to the number of CPUs.
+            num_false_negatives: Number of false negatives to sample per paradigm.
+            seed: Random seed for sampling false negatives.
+            alt_parses_dir: Path to a cache of alternative parses. Optional.
+            top_k: How many parses of each sentence to evaluate the predicate on.
+            out_path: Path to where the JSON report should be written. Optional.
+        """
+        self.blimp_dir = (
+            blimp_dir if os.path.isdir(blimp_dir) else str(resolve_data_path(blimp_dir))
+        )
+        self.sample_path = sample_path
+        self.filter_names = filter_names or [
+            name
+            for name in filters.CLI_FILTERS
+            if filters.CLI_FILTERS.spec(name).blimp_paradigms
+        ]
+        self.num_workers = num_workers or os.cpu_count()
+        self.num_false_negatives = num_false_negatives
+        self.seed = seed
+        assert alt_parses_dir is None or os.path.exists(
+            os.path.join(alt_parses_dir, CACHE_INDEX_NAME)
+        ), f"No alternative parses in {alt_parses_dir}"
+        self.filter_kwargs = (
+            {"alt_parses_dir": alt_parses_dir, "top_k": top_k} if alt_parses_dir else {}
+        )
+        self.out_path = out_path
+
+    def _tasks(self) -> list[tuple[str, str, str, int, int, dict[str, Any]]]:
+        blimp = (
+            BlimpCorpus(self.blimp_dir)
+            if os.path.exists(os.path.join(self.blimp_dir, BLIMP_INDEX_NAME))
+            else None
+        )
+        tasks = []
+        for filter_name in self.filter_names:
+            spec = filters.CLI_FILTERS.spec(filter_name)
+            for paradigm in spec.blimp_paradigms:
+                if blimp and paradigm in blimp and "good" in blimp.index["kinds"]:
+                    path = self.blimp_dir
+                else:
+                    path = find_annotated(self.blimp_dir, paradigm)
+                if path is None:
+                    print(f"Warning: no annotations of {paradigm} in {self.blimp_dir}")
+                    continue
+                tasks.append(
+                    (
+                        filter_name,
+                        paradigm,
+                        path,
+                        self.num_false_negatives,
+                        self.seed,
+                        self.filter_kwargs,
+                    )
+                )
+            if self.sample_path:
+                tasks.append(
+                    (
+                        filter_name,
+                        "sample",
+                        self.sample_path,
+                        0,
+                        self.seed,
+                        self.filter_kwargs,
+                    )
+                )
+        return tasks
+
+    def run(self):
+        tasks = self._tasks()
+        # import the filters and compile their word lists before forking, so that the
+        # workers share them (see `filters/word_lists.py`)
+        for filter_name in self.filter_names:
+            filters.CLI_FILTERS[filter_name]
+            for word_list_path in filters.CLI_FILTERS.spec(filter_name).word_lists:
+                load_word_list(word_list_path)
+
+        results = []
+        with mp.Pool(min(self.num_workers, len(tasks) or 1)) as pool:
+            for result in pool.imap(run_filter, tasks):
+                results.append(result)
+                print(
+                    f"Ran {result['filter']} over {result['corpus']} "
+                    f"({len(results)}/{len(tasks)})"
+                )
+        self._print_report(results)
+        if self.out_path:
+            with open(self.out_path, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Wrote the full report to {self.out_path}.")
+
+    def _print_report(self, results: list[dict[str, Any]]):
+        blimp_results = [result for result in results if result["corpus"] != "sample"]
+        sample_results = [result for result in results if result["corpus"] == "sample"]
+
+        def print_row(name, corpus, rejected, rate, ms_per_sent):
+            print(f"{name:<30}{corpus:<48}{rejected:>12}{rate:>9}{ms_per_sent:>10}")
+
+        if blimp_results:
+            print("\nRecall on target BLiMP paradigms (sentence_good rejected):")
+            print_row("filter", "paradigm", "rejected", "recall", "ms/sent")
+            for result in blimp_results:
+                print_row(*self._row(result))
+
+        if sample_results:
+            print("\nRejection rate on the corpus sample:")
+            print_row("filter", "corpus", "rejected", "rate", "ms/sent")
+            for result in sample_results:
+                print_row(*self._row(result))
+
+        for result in blimp_results:
+            for false_negative in result["false_negatives"]:
+                print(f"\nFalse negative of {result['filter']} ({result['corpus']}):")
+                print(false_negative["text"])
+                print(false_negative["parse"])
+
+    @staticmethod
+    def _row(result: dict[str, Any]) -> tuple:
+        num_sents = result["num_sents"] or 1
+        return (
+            result["filter"],
+            result["corpus"],
+            f"{result['num_rejected']}/{result['num_sents']}",
+            f"{result['num_rejected'] / num_sents:.2%}",
+            f"{1000 * result['seconds'] / num_sents:.3f}",
+        )
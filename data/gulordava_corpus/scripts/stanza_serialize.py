@@ -1,11 +1,15 @@
 import argparse
+import contextlib
 import itertools
-import pickle
 import sys
 from typing import Optional
 
 import stanza
 
+from corpus_filtering.compression import dump_pickle, get_codec, load_pickle, open_compressed
+from corpus_filtering.confidence import CONFIDENCE_EXTENSION, score_document, write_confidences
+from corpus_filtering.gc_tuning import GC_MODES, collect_between_blocks, tune_gc
+
 DEFAULT_BATCH_SIZE = 10000
 LOG_LEVEL = "DEBUG"
 PROCESSORS = "tokenize,pos,lemma,depparse,constituency"
@@ -32,13 +36,15 @@ def parse_args():
         "corpus_file_path",
         metavar="corpus_file_path",
         type=str,
-        help="Path to file that contains the sentences to annotate and serialize.",
+        help="Path to file that contains the sentences to annotate and serialize. Decompressed on the fly if the "
+        "extension is .zst or .lz4.",
     )
     write_parser.add_argument(
         "output_file_path",
         metavar="output_file_path",
         type=str,
-        help="Path to file where the serialized bytes are to be written.",
+        help="Path to file where the serialized bytes are to be written. If the extension is .zst or .lz4, each "
+        "`stanza.Document` is written as its own zstd/lz4 frame.",
     )
     write_parser.add_argument(
         "-b",
@@ -55,6 +61,21 @@ def parse_args():
         action="store_true",
         help="Tells stanza that it should tokenize the input corpus before further processing. By default, if this flag is not set, the sentences from the input corpus are assumed to have already been tokenized, so stanza will not tokenize them further.",
     )
+    write_parser.add_argument(
+        "--gc",
+        choices=GC_MODES,
+        default="default",
+        dest="gc_mode",
+        help="How to tune Python's cyclic garbage collector once the pipeline is loaded: leave it as is (default), "
+        "freeze the objects made at startup and collect less often (freeze), or also collect only between batches "
+        "(manual). See `corpus_filtering.gc_tuning`.",
+    )
+    write_parser.add_argument(
+        "--confidence",
+        action="store_true",
+        help=f"Also write the confidence of the POS tag and head of every word to a sidecar (the output path with "
+        f"{CONFIDENCE_EXTENSION} appended), for the `reparse` command. See `corpus_filtering.confidence`.",
+    )
 
     # Create a subparser for the `r` sub-command
     read_parser = subparsers.add_parser(
@@ -67,7 +88,8 @@ def parse_args():
         "input_file_path",
         metavar="input_file_path",
         type=str,
-        help="Path to file that contains the serialized `stanza.Document` objects.",
+        help="Path to file that contains the serialized `stanza.Document` objects. Decompressed on the fly if the "
+        "extension is .zst or .lz4.",
     )
 
     return parser.parse_args()
@@ -78,12 +100,19 @@ def serialize(
     fpath_out: str,
     batch_size: Optional[int] = DEFAULT_BATCH_SIZE,
     tokenize: bool = False,
+    gc_mode: str = "default",
+    confidence: bool = False,
 ) -> None:
     """Use stanza to annotate a corpus of sentences from file and batch-serialize them as `stanza.Document` objects.
 
     Args:
-        fpath_in: Path to file that contains the sentences to annotate and serialize.
-        fpath_out: Path to file where the serialized bytes are to be written.
+        fpath_in:
+            Path to file that contains the sentences to annotate and serialize. If its extension is `.zst`/`.zstd` or
+            `.lz4`, it is decompressed on the fly.
+        fpath_out:
+            Path to file where the serialized bytes are to be written. If its extension is `.zst`/`.zstd` or `.lz4`,
+            each `stanza.Document` is compressed as its own frame, so `PickleStanzaDocCorpusView` can still seek to
+            the start of any document.
         batch_size:
             How many lines (sentences) of the input file to annotate and write to file per batch. One batch corresponds
             to one `stanza.Document` instance. A non-positive or `None` value ` indicates that the function should
@@ -92,6 +121,12 @@ def serialize(
             Boolean indicating whether the sentences in the input file are already tokenized. If `False`, the sentences
             will be passed to the `stanza.Pipeline` object as a list of tokens, rather than as a string. If `True`,
             the sentences will be passed as a string, and the `stanza.Pipeline` object will tokenize them.
+        gc_mode:
+            How to tune the cyclic GC once the pipeline is loaded: "default", "freeze" or "manual". See
+            `corpus_filtering.gc_tuning`.
+        confidence:
+            Whether to also append the POS and head confidences of every word to `fpath_out` + `.conf`. See
+            `corpus_filtering.confidence`.
     """
     print("Constructing Stanza pipeline...")
     pipeline = stanza.Pipeline(
@@ -111,9 +146,17 @@ def serialize(
     else:
         print(f"Batch size: {batch_size} lines.")
 
-    with open(fpath_out, "ab") as f_out:
+    codec = get_codec(fpath_out)
+    fpath_conf = fpath_out + CONFIDENCE_EXTENSION
+    with tune_gc(gc_mode) as gc_monitor, open(fpath_out, "ab") as f_out, (
+        open(fpath_conf, "ab") if confidence else contextlib.nullcontext()
+    ) as f_conf:
         print(f"Serialization output file: {fpath_out}.")
-        with open(fpath_in, "r") as f_in:
+        if confidence:
+            print(f"Confidence output file: {fpath_conf}.")
+        if codec:
+            print(f"Compressing each Document as a {codec} frame.")
+        with open_compressed(fpath_in, "r") as f_in:
             keep_going = True
             batch_num = 0
             tot_sents = 0
@@ -137,7 +180,11 @@ def serialize(
                     d = pipeline("\n".join(batch))
                     print(f"Batch #{batch_num}: Annotated {len(batch)} sentences.")
                     print(f"Batch #{batch_num}: Serializing to file...")
-                    pickle.dump(d, f_out)
+                    dump_pickle(d, f_out, codec)
+                    if confidence:
+                        write_confidences(f_conf, score_document(pipeline, d))
+                    del d
+                    collect_between_blocks()  # frees finished batches, in "manual" GC mode
                     tot_sents += len(batch)
                     print(
                         f"Batch #{batch_num}: Serializing batch to file. Serialized {tot_sents} in {batch_num} batches."
@@ -147,6 +194,11 @@ def serialize(
                 f"No more batches. Annotated and serialized {tot_sents} in {batch_num} batches."
             )
 
+    gc_report = gc_monitor.to_dict()
+    print(
+        f"GC ({gc_mode}): {sum(gc_report['collections'].values())} collections, paused for "
+        f"{gc_report['pause_seconds']:.2f}s ({gc_report['pause_fraction']:.1%} of the run)."
+    )
     print("Annotating & serializing Documents complete!")
 
 
@@ -157,16 +209,19 @@ def deserialize(fpath_in: str) -> list[stanza.Document]:
     cause memory issues if used for deserializing very large files.
 
     Args:
-        fpath_in: Path to file that contains the serialized `stanza.Document` objects.
+        fpath_in:
+            Path to file that contains the serialized `stanza.Document` objects, compressed frame-per-document if its
+            extension is `.zst`/`.zstd` or `.lz4`.
     Returns:
         A list of `stanza.Document` objects.
     """
+    codec = get_codec(fpath_in)
     with open(fpath_in, "rb") as f_in:
         print(f"Deserializing Stanza Document objects from file {fpath_in}...")
         docs = []
         try:
             while True:
-                docs.append(pickle.load(f_in))
+                docs.append(load_pickle(f_in, codec))
                 print(
                     f"Stanza Document deserialized! Total number of Documents deserialized so far: {len(docs)}"
                 )
@@ -212,6 +267,8 @@ if __name__ == "__main__":
             fpath_out=args.output_file_path,
             batch_size=args.batch_size,
             tokenize=args.tokenize,
+            gc_mode=args.gc_mode,
+            confidence=args.confidence,
         )
     elif args.command == "r":
         docs = deserialize(args.input_file_path)
@@ -1,4 +1,7 @@
-from typing import Dict, List, Optional, Union
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Union
 
 import datasets
 import numpy as np
@@ -8,6 +11,8 @@ from torch import Tensor
 
 datasets.utils.logging.disable_progress_bar()
 
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+
 
 all_paradigms = [
     "adjunct_island",
@@ -85,15 +90,161 @@ def reduce_log_probs(log_probs: Tensor) -> float:
     return log_probs.sum(0).item()
 
 
+def load_blimp(
+    paradigms: Optional[List[str]] = None,
+    cache_dir: Optional[str] = CACHE_DIR,
+) -> Dict[str, Dict[str, List[str]]]:
+    """ Loads the good and bad sentences of BLiMP paradigms.
+    All 67 paradigms are downloaded once with `datasets` and stored in a
+    single local JSON file, so later calls read one small file instead of
+    calling `datasets.load_dataset` 67 times.
+
+    Parameters
+    ----------
+    paradigms : List[str]
+        Optional argument to specify a subset of paradigms to load.
+    cache_dir : str
+        Directory of the local BLiMP cache. Set to None to disable caching.
+
+    Returns
+    -------
+    blimp : Dict[str, Dict[str, List[str]]]
+        Dictionary mapping each paradigm name to a dictionary with the lists of
+        `sentence_good` and `sentence_bad` sentences.
+    """
+    if paradigms is None:
+        paradigms = all_paradigms
+
+    cache_file = cache_dir and os.path.join(cache_dir, "blimp.json")
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            blimp = json.load(f)
+    else:
+        blimp = {}
+        for paradigm in all_paradigms:
+            dataset = datasets.load_dataset("blimp", paradigm, split="train")
+            blimp[paradigm] = {
+                "sentence_good": dataset["sentence_good"],
+                "sentence_bad": dataset["sentence_bad"],
+            }
+        if cache_file:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_file, "w") as f:
+                json.dump(blimp, f)
+
+    return {paradigm: blimp[paradigm] for paradigm in paradigms}
+
+
+def checkpoint_cache_key(model_name: str) -> str:
+    """ Returns the key of a model checkpoint in the log-prob cache.
+    A local checkpoint is identified by its absolute path and a digest of its
+    config and weights, so that a checkpoint retrained (or replaced) at the
+    same path is scored again; a hub model is identified by its name.
+    """
+    if not os.path.exists(model_name):
+        return model_name
+
+    path = os.path.abspath(model_name)
+    if os.path.isdir(path):
+        files = sorted(
+            os.path.join(path, file_name)
+            for file_name in os.listdir(path)
+            if file_name == "config.json"
+            or file_name.endswith((".bin", ".safetensors", ".pt"))
+        )
+    else:
+        files = [path]
+    digest = hashlib.blake2b(digest_size=16)
+    for file_path in files:
+        digest.update(os.path.basename(file_path).encode())
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return f"{path}@{digest.hexdigest()}"
+
+
+def log_prob_cache_file(cache_key: str, cache_dir: str = CACHE_DIR) -> str:
+    """ Returns the path of the per-sentence log-prob cache of a model checkpoint. """
+    file_name = hashlib.blake2b(cache_key.encode(), digest_size=16).hexdigest()
+    return os.path.join(cache_dir, "log_probs", f"{file_name}.json")
+
+
+def load_log_probs(cache_file: Optional[str]) -> Dict[str, float]:
+    """ Loads a per-sentence log-prob cache, or returns an empty one if there
+    is no cache file (yet). """
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            return json.load(f)
+    return {}
+
+
+def save_log_probs(cache_file: str, log_probs: Dict[str, float]):
+    """ Writes a per-sentence log-prob cache. """
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    with open(cache_file, "w") as f:
+        json.dump(log_probs, f)
+
+
+def score_sentences(
+    model: scorer.IncrementalLMScorer,
+    sentences: Iterable[str],
+    batch_size: int = 64,
+    log_probs: Optional[Dict[str, float]] = None,
+) -> Dict[str, float]:
+    """ Computes the log probability of every distinct sentence.
+    Sentences are deduplicated, sentences that already have a score in
+    `log_probs` are skipped, and the rest are scored in batches of sentences
+    of similar length, which minimises padding.
+
+    Parameters
+    ----------
+    model : scorer.IncrementalLMScorer
+        The minicons scorer of the model.
+    sentences : Iterable[str]
+        The sentences to score.
+    batch_size : int
+        Number of sentences per `sequence_score` call.
+    log_probs : Dict[str, float]
+        Optional dictionary of already computed scores, which is updated
+        in place.
+
+    Returns
+    -------
+    log_probs : Dict[str, float]
+        Dictionary mapping each sentence to its log probability.
+    """
+    if log_probs is None:
+        log_probs = {}
+
+    todo = sorted(
+        {sen for sen in sentences if sen not in log_probs},
+        key=lambda sen: len(sen.split()),
+    )
+    for idx in range(0, len(todo), batch_size):
+        batch = todo[idx : idx + batch_size]
+        scores = model.sequence_score(batch, reduction=reduce_log_probs)
+        log_probs.update(zip(batch, scores))
+
+    return log_probs
+
+
 def evaluate_blimp(
     model_name: Union[nn.Module, str],
     paradigms: Optional[List[str]] = None,
     device: str = "cuda",
     verbose: bool = True,
+    batch_size: int = 64,
+    cache_key: Optional[str] = None,
+    cache_dir: Optional[str] = CACHE_DIR,
 ) -> Dict[str, float]:
     """ Computes the model accuracy on all BLiMP tasks.
     Good/bad sentence comparisons are done based on sentence probability.
-    Model probabilities are extracted using the `minicons` library.    
+    Model probabilities are extracted using the `minicons` library.
+
+    The sentences of all paradigms are scored together: each distinct
+    sentence is scored once, in length-sorted batches. Per-sentence log-probs
+    are cached on disk per model checkpoint, so re-evaluating a checkpoint
+    (e.g. on other paradigms) only scores sentences it has not seen yet.
     
     Parameters
     ----------
@@ -106,28 +257,73 @@ def evaluate_blimp(
         Model device, defaults to cuda.
     verbose : bool
         Set to True to print paradigm accuracies.
+    batch_size : int
+        Number of sentences scored per batch.
+    cache_key : str
+        Name identifying the model checkpoint in the log-prob cache. Defaults
+        to `checkpoint_cache_key(model_name)` if `model_name` is a string; if
+        it is an initialised torch model and no key is given, log-probs are
+        not cached.
+    cache_dir : str
+        Directory of the BLiMP and log-prob caches. Set to None to disable
+        caching.
 
     Returns
     -------
     score_dict : Dict[str, float]
         Dictionary mapping each paradigm name to an accuracy score.
     """
-    model = scorer.IncrementalLMScorer(model_name, device)
+    blimp = load_blimp(paradigms, cache_dir)
 
-    if paradigms is None:
-        paradigms = all_paradigms
+    if cache_dir and cache_key is None and isinstance(model_name, str):
+        cache_key = checkpoint_cache_key(model_name)
+    cache_file = cache_dir and cache_key and log_prob_cache_file(cache_key, cache_dir)
 
-    score_dict: Dict[str, float] = {}
+    log_probs = load_log_probs(cache_file)
 
-    for paradigm in all_paradigms:
-        dataset = datasets.load_dataset("blimp", paradigm, split="train")
+    all_sentences = [
+        sen
+        for pairs in blimp.values()
+        for sen in pairs["sentence_good"] + pairs["sentence_bad"]
+    ]
+    num_cached = len(log_probs)
+    if any(sen not in log_probs for sen in all_sentences):
+        model = scorer.IncrementalLMScorer(model_name, device)
+        score_sentences(model, all_sentences, batch_size, log_probs)
 
-        good_log_probs = model.sequence_score(
-            dataset["sentence_good"], reduction=reduce_log_probs
-        )
-        bad_log_probs = model.sequence_score(
-            dataset["sentence_bad"], reduction=reduce_log_probs
-        )
+    if cache_file and len(log_probs) > num_cached:
+        save_log_probs(cache_file, log_probs)
+
+    return blimp_accuracy(blimp, log_probs, verbose)
+
+
+def blimp_accuracy(
+    blimp: Dict[str, Dict[str, List[str]]],
+    log_probs: Dict[str, float],
+    verbose: bool = False,
+) -> Dict[str, float]:
+    """ Computes the accuracy on each paradigm from per-sentence log-probs.
+
+    Parameters
+    ----------
+    blimp : Dict[str, Dict[str, List[str]]]
+        The paradigms to evaluate, as returned by `load_blimp`.
+    log_probs : Dict[str, float]
+        Dictionary mapping each sentence to its log probability, as returned
+        by `score_sentences`.
+    verbose : bool
+        Set to True to print paradigm accuracies.
+
+    Returns
+    -------
+    score_dict : Dict[str, float]
+        Dictionary mapping each paradigm name to an accuracy score.
+    """
+    score_dict: Dict[str, float] = {}
+
+    for paradigm, pairs in blimp.items():
+        good_log_probs = [log_probs[sen] for sen in pairs["sentence_good"]]
+        bad_log_probs = [log_probs[sen] for sen in pairs["sentence_bad"]]
 
         accuracy = np.mean(np.array(good_log_probs) > np.array(bad_log_probs))
 
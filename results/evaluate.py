@@ -0,0 +1,332 @@
+""" Evaluates a grid of model checkpoints on BLiMP and perplexity.
+
+BLiMP is loaded once, in the parent process, and shipped to a pool of worker
+processes, which stream the perplexity corpora from disk. BLiMP sentences are
+scored through the per-checkpoint log-prob cache of `blimp.evaluate_blimp`, so
+a rerun only scores the sentences a checkpoint has not been scored on yet.
+Each worker pins itself to its own slice of the CPU cores, builds one scorer
+per checkpoint and uses it for every metric. Results are written by the parent
+to a single SQLite table, with one row per (model, metric, key), where `model`
+is the checkpoint's `checkpoint_cache_key` (the hub name, or the absolute path
+and a digest of the weights of a local checkpoint, so that retraining into the
+same directory is evaluated again) and `key` is the BLiMP paradigm for `blimp`
+and the corpus name for `ppl`; (model, metric, key) triples that already have
+a row are skipped, so an interrupted or extended grid (e.g. with more
+paradigms or perplexity corpora) only evaluates what is missing.
+
+Example:
+
+    python results/evaluate.py results/data/results.sqlite \\
+        --corpora passive det-noun --archs gpt2 lstm --seeds 0 1 2 \\
+        --ppl test=data/gulordava_corpus/test.txt --device cpu --workers 8
+
+    sqlite3 results/data/results.sqlite \\
+        "SELECT model, AVG(value) FROM results WHERE metric = 'blimp' GROUP BY model"
+"""
+import argparse
+import glob
+import multiprocessing as mp
+import os
+import sqlite3
+import traceback
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from blimp import (
+    CACHE_DIR,
+    all_paradigms,
+    blimp_accuracy,
+    checkpoint_cache_key,
+    load_blimp,
+    load_log_probs,
+    log_prob_cache_file,
+    save_log_probs,
+    score_sentences,
+)
+from ppl import corpus_ppl, iter_lines
+
+METRICS = ("blimp", "ppl")
+
+# Per-worker state, set by `init_worker`
+_worker_data: dict = {}
+
+
+def checkpoint_grid(
+    corpora: Iterable[str],
+    archs: Iterable[str],
+    seeds: Iterable[int],
+    hub_prefix: str = "CLMBR",
+) -> List[str]:
+    """ Returns the HF hub names of a grid of trained models, which are named
+    `{corpus}-{arch}-{seed}`. """
+    return [
+        f"{hub_prefix}/{corpus}-{arch}-{seed}"
+        for corpus in corpora
+        for arch in archs
+        for seed in seeds
+    ]
+
+
+def find_checkpoints(outputs_dir: str) -> List[str]:
+    """ Returns all the intermediate checkpoints saved under a training
+    outputs directory (e.g. `outputs/`), sorted by path. """
+    pattern = os.path.join(outputs_dir, "**", "checkpoint-*")
+    return sorted(
+        path for path in glob.glob(pattern, recursive=True) if os.path.isdir(path)
+    )
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """ Opens the results database, creating the results table if needed. """
+    db = sqlite3.connect(db_path)
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS results ("
+        "model TEXT, metric TEXT, key TEXT, value REAL, "
+        "PRIMARY KEY (model, metric, key))"
+    )
+    return db
+
+
+def done_keys(db: sqlite3.Connection) -> Dict[str, set]:
+    """ Returns the (metric, key) pairs that have already been stored for each
+    model. """
+    done: Dict[str, set] = {}
+    for model, metric, key in db.execute("SELECT model, metric, key FROM results"):
+        done.setdefault(model, set()).add((metric, key))
+    return done
+
+
+def init_worker(
+    counter: "mp.Value",
+    num_workers: int,
+    blimp: Dict[str, Dict[str, List[str]]],
+    ppl_files: Dict[str, str],
+    device: str,
+    batch_size: int,
+    cache_dir: Optional[str],
+):
+    """ Pool initializer: pins the worker to its share of the CPU cores and
+    stores the evaluation data. """
+    import torch
+
+    with counter.get_lock():
+        worker_idx = counter.value
+        counter.value += 1
+
+    cores = sorted(os.sched_getaffinity(0))
+    per_worker = max(len(cores) // num_workers, 1)
+    start = (worker_idx * per_worker) % len(cores)
+    worker_cores = cores[start : start + per_worker]
+    os.sched_setaffinity(0, worker_cores)
+    torch.set_num_threads(len(worker_cores))
+
+    _worker_data.update(
+        blimp=blimp,
+        ppl_files=ppl_files,
+        device=device,
+        batch_size=batch_size,
+        cache_dir=cache_dir,
+    )
+
+
+def evaluate_checkpoint(
+    task: Tuple[str, str, Dict[str, List[str]]]
+) -> Tuple[str, List[Tuple[str, str, float]], Optional[str]]:
+    """ Evaluates one checkpoint on the given keys of each metric (BLiMP
+    paradigms or perplexity corpus names), inside a worker. An error is
+    returned rather than raised, so that it does not abort the whole grid.
+
+    Returns
+    -------
+    model_key : str
+        The key of the checkpoint in the results database.
+    rows : List[Tuple[str, str, float]]
+        The (metric, key, value) rows of the checkpoint, including those
+        computed before an error, if any.
+    error : str
+        The traceback of the error that interrupted the evaluation, or None.
+    """
+    model_name, model_key, todo = task
+    rows: List[Tuple[str, str, float]] = []
+    try:
+        _score_checkpoint(model_name, model_key, todo, rows)
+    except Exception:
+        return model_key, rows, traceback.format_exc()
+    return model_key, rows, None
+
+
+def _score_checkpoint(
+    model_name: str,
+    model_key: str,
+    todo: Dict[str, List[str]],
+    rows: List[Tuple[str, str, float]],
+):
+    """ Appends the (metric, key, value) rows of a checkpoint to `rows`, as
+    they are computed. """
+    from minicons import scorer
+
+    model = None
+
+    if todo.get("blimp"):
+        blimp = {
+            paradigm: _worker_data["blimp"][paradigm] for paradigm in todo["blimp"]
+        }
+        sentences = [
+            sen
+            for pairs in blimp.values()
+            for sen in pairs["sentence_good"] + pairs["sentence_bad"]
+        ]
+        cache_dir = _worker_data["cache_dir"]
+        cache_file = cache_dir and log_prob_cache_file(model_key, cache_dir)
+        log_probs = load_log_probs(cache_file)
+        num_cached = len(log_probs)
+        if any(sen not in log_probs for sen in sentences):
+            model = scorer.IncrementalLMScorer(model_name, _worker_data["device"])
+            score_sentences(model, sentences, _worker_data["batch_size"], log_probs)
+        if cache_file and len(log_probs) > num_cached:
+            save_log_probs(cache_file, log_probs)
+        for paradigm, accuracy in blimp_accuracy(blimp, log_probs).items():
+            rows.append(("blimp", paradigm, float(accuracy)))
+
+    if todo.get("ppl") and model is None:
+        model = scorer.IncrementalLMScorer(model_name, _worker_data["device"])
+    for corpus_name in todo.get("ppl", []):
+        corpus_file = _worker_data["ppl_files"][corpus_name]
+        ppl = corpus_ppl(model, iter_lines(corpus_file))
+        rows.append(("ppl", corpus_name, ppl))
+
+
+def evaluate_grid(
+    model_names: List[str],
+    db_path: str,
+    metrics: Iterable[str] = METRICS,
+    ppl_files: Optional[Dict[str, str]] = None,
+    paradigms: Optional[List[str]] = None,
+    device: str = "cpu",
+    num_workers: int = 1,
+    batch_size: int = 64,
+    cache_dir: Optional[str] = CACHE_DIR,
+):
+    """ Evaluates every model on every BLiMP paradigm and perplexity corpus
+    that is not already stored in the results database.
+
+    Parameters
+    ----------
+    model_names : List[str]
+        HF hub names or local checkpoint directories of the models.
+    db_path : str
+        Path to the SQLite results database.
+    metrics : Iterable[str]
+        The metrics to compute, out of `METRICS`.
+    ppl_files : Dict[str, str]
+        Dictionary mapping corpus names to the corpus files for which
+        perplexity will be computed.
+    paradigms : List[str]
+        Optional argument to specify a subset of BLiMP paradigms.
+    device : str
+        Model device. With a single GPU, use one worker.
+    num_workers : int
+        Number of worker processes.
+    batch_size : int
+        Number of BLiMP sentences scored per batch.
+    cache_dir : str
+        Directory of the local BLiMP and log-prob caches. Set to None to
+        disable caching.
+    """
+    ppl_files = ppl_files or {}
+    all_keys = {"blimp": list(paradigms or all_paradigms), "ppl": list(ppl_files)}
+    metric_keys = {metric: all_keys[metric] for metric in metrics if metric in METRICS}
+
+    db = connect(db_path)
+    done = done_keys(db)
+    tasks = []
+    for model_name in model_names:
+        model_key = checkpoint_cache_key(model_name)
+        model_done = done.get(model_key, set())
+        todo = {
+            metric: [key for key in keys if (metric, key) not in model_done]
+            for metric, keys in metric_keys.items()
+        }
+        if any(todo.values()):
+            tasks.append((model_name, model_key, todo))
+    print(f"{len(tasks)} of {len(model_names)} models have results to compute")
+    if not tasks:
+        return
+
+    # load only the paradigms that some model is missing
+    todo_paradigms = sorted({p for *_, todo in tasks for p in todo.get("blimp", [])})
+    blimp = load_blimp(todo_paradigms, cache_dir) if todo_paradigms else {}
+
+    # spawn rather than fork, since forking after torch/CUDA is initialised
+    # is unsafe
+    ctx = mp.get_context("spawn")
+    num_workers = min(num_workers, len(tasks))
+    counter = ctx.Value("i", 0)
+    init_args = (
+        counter, num_workers, blimp, ppl_files, device, batch_size, cache_dir
+    )
+    failed = []
+    with ctx.Pool(num_workers, init_worker, init_args) as pool:
+        results = pool.imap_unordered(evaluate_checkpoint, tasks)
+        for model_key, rows, error in results:
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                    [(model_key, *row) for row in rows],
+                )
+            print(f"Stored {len(rows)} results for {model_key}")
+            if error is not None:
+                failed.append(model_key)
+                print(f"Failed to evaluate {model_key}:\n{error}")
+    db.close()
+    if failed:
+        print(f"{len(failed)} models failed; rerun to retry them: {', '.join(failed)}")
+
+
+def parse_ppl_file(arg: str) -> Tuple[str, str]:
+    name, sep, path = arg.partition("=")
+    if not sep:
+        return os.path.splitext(os.path.basename(arg))[0], arg
+    return name, path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Evaluate a grid of model checkpoints on BLiMP and perplexity."
+    )
+    parser.add_argument("db_path", help="Path to the SQLite results database.")
+    parser.add_argument("--models", nargs="*", default=[], help="Model names or paths.")
+    parser.add_argument("--corpora", nargs="*", default=[])
+    parser.add_argument("--archs", nargs="*", default=[])
+    parser.add_argument("--seeds", nargs="*", type=int, default=[])
+    parser.add_argument(
+        "--outputs-dir",
+        help="Also evaluate every `checkpoint-*` directory under this directory.",
+    )
+    parser.add_argument("--metrics", nargs="*", default=list(METRICS), choices=METRICS)
+    parser.add_argument(
+        "--ppl",
+        nargs="*",
+        default=[],
+        type=parse_ppl_file,
+        help="Corpus files for perplexity, optionally named as `name=path`.",
+    )
+    parser.add_argument("--paradigms", nargs="*", help="Subset of BLiMP paradigms.")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    model_names = args.models + checkpoint_grid(args.corpora, args.archs, args.seeds)
+    if args.outputs_dir:
+        model_names += find_checkpoints(args.outputs_dir)
+
+    evaluate_grid(
+        model_names,
+        args.db_path,
+        metrics=args.metrics,
+        ppl_files=dict(args.ppl),
+        paradigms=args.paradigms,
+        device=args.device,
+        num_workers=args.workers,
+        batch_size=args.batch_size,
+    )
@@ -1,18 +1,35 @@
-from typing import Union
+import hashlib
+import multiprocessing as mp
+import os
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+import numpy as np
 import torch
 import torch.nn as nn
 from minicons import scorer
 
+from blimp import checkpoint_cache_key
+from corpus_filtering.corpus_views import MASK_EXTENSION, MaskedCorpusView
+from corpus_filtering.corpus_views.masked_corpus_views import corpus_fingerprint
+
 
 def evaluate_ppl(
     model_name: Union[nn.Module, str],
     corpus_file: str,
     device: str = "cuda",
+    max_tokens: int = 4096,
+    num_shards: int = 1,
+    report_every: Optional[int] = None,
 ) -> float:
     """ Returns the perplexity of a single corpus file.
     Model probabilities are extracted using the `minicons` library.
 
+    The corpus is streamed: lines are read lazily and scored in batches of
+    at most `max_tokens` padded whitespace-separated words, and only running
+    sums of the log-probs and token counts are kept, so memory use does not
+    grow with the size of the corpus.
+
     Parameters
     ----------
     model_name : str | nn.Module
@@ -22,19 +39,301 @@ def evaluate_ppl(
         Path to the corpus file for which ppl will be computed.
     device : str
         Model device, defaults to cuda.
+    max_tokens : int
+        Maximum number of padded whitespace-separated words (not model
+        tokens) per `sequence_score` call; see `token_batches`.
+    num_shards : int
+        Number of byte-range shards of the corpus that are scored in
+        parallel, each by its own worker process and scorer. Requires
+        `model_name` to be a string.
+    report_every : int
+        If set, print the running perplexity every `report_every` sentences.
+
+    Returns
+    -------
+    perplexity : float
+    """
+    if num_shards > 1:
+        assert not corpus_file.endswith(MASK_EXTENSION), "Cannot shard a mask"
+        assert isinstance(model_name, str), "Sharding requires a model name"
+        tasks = [
+            (model_name, corpus_file, device, max_tokens, start, end, report_every)
+            for start, end in shard_offsets(corpus_file, num_shards)
+        ]
+        with mp.get_context("spawn").Pool(num_shards) as pool:
+            sums = pool.map(_score_shard, tasks)
+        log_prob_sum = sum(shard_sum for shard_sum, _ in sums)
+        num_tokens = sum(shard_tokens for _, shard_tokens in sums)
+    else:
+        model = scorer.IncrementalLMScorer(model_name, device)
+        log_prob_sum, num_tokens = log_prob_sums(
+            model, iter_lines(corpus_file), max_tokens, report_every
+        )
+
+    return sums_to_ppl(log_prob_sum, num_tokens)
+
+
+def corpus_ppl(
+    model: scorer.IncrementalLMScorer,
+    corpus: Iterable[str],
+    max_tokens: int = 4096,
+) -> float:
+    """ Returns the perplexity of a stream of sentences under an already
+    constructed minicons scorer.
+
+    Parameters
+    ----------
+    model : scorer.IncrementalLMScorer
+        The minicons scorer of the model.
+    corpus : Iterable[str]
+        The sentences of the corpus, e.g. `iter_lines(corpus_file)`.
+    max_tokens : int
+        Maximum number of padded whitespace-separated words (not model
+        tokens) per `sequence_score` call; see `token_batches`.
 
     Returns
     -------
     perplexity : float
     """
+    return sums_to_ppl(*log_prob_sums(model, corpus, max_tokens))
+
+
+def sums_to_ppl(log_prob_sum: float, num_tokens: int) -> float:
+    """ Returns the perplexity corresponding to a total log-prob, or NaN if
+    no tokens were scored (e.g. the corpus is empty). """
+    if num_tokens == 0:
+        return float("nan")
+    return torch.exp(torch.tensor(-log_prob_sum / num_tokens)).item()
+
+
+def log_prob_sums(
+    model: scorer.IncrementalLMScorer,
+    corpus: Iterable[str],
+    max_tokens: int = 4096,
+    report_every: Optional[int] = None,
+) -> Tuple[float, int]:
+    """ Scores a stream of sentences, keeping only running totals.
+
+    Returns
+    -------
+    log_prob_sum : float
+        Sum of the log-probs of all the scored tokens.
+    num_tokens : int
+        Number of scored tokens.
+    """
+    log_prob_sum = 0.0
+    num_tokens = 0
+    num_sentences = 0
+    for sen_log_prob, sen_tokens in sentence_scores(model, corpus, max_tokens):
+        log_prob_sum += sen_log_prob
+        num_tokens += sen_tokens
+        num_sentences += 1
+        if report_every and num_sentences % report_every == 0:
+            print(
+                f"{num_sentences} sentences, {num_tokens} tokens, "
+                f"ppl {sums_to_ppl(log_prob_sum, num_tokens):.3f}"
+            )
+    return log_prob_sum, num_tokens
+
+
+def sentence_scores(
+    model: scorer.IncrementalLMScorer,
+    corpus: Iterable[str],
+    max_tokens: int = 4096,
+) -> Iterator[Tuple[float, int]]:
+    """ Lazily scores a stream of sentences in token-budgeted batches,
+    yielding the log-prob sum and the number of scored tokens of each
+    sentence, in corpus order. """
+    for batch in token_batches(corpus, max_tokens):
+        for log_probs in model.sequence_score(batch, reduction=lambda probs: probs):
+            yield log_probs.sum().item(), len(log_probs)
+
+
+def token_batches(corpus: Iterable[str], max_tokens: int) -> Iterator[List[str]]:
+    """ Groups a stream of sentences into consecutive batches whose padded
+    size (number of sentences times the length of the longest one, in
+    whitespace-separated words) is at most `max_tokens`. Longer sentences are
+    batched on their own. The budget is in words rather than model tokens, so
+    that batching needs no tokenizer; since subword tokenizers split words
+    into one or more tokens, batches hold more model tokens than words. """
+    batch: List[str] = []
+    batch_max_len = 0
+    for sentence in corpus:
+        sen_len = len(sentence.split())
+        new_max_len = max(batch_max_len, sen_len)
+        if batch and (len(batch) + 1) * new_max_len > max_tokens:
+            yield batch
+            batch, new_max_len = [], sen_len
+        batch.append(sentence)
+        batch_max_len = new_max_len
+    if batch:
+        yield batch
+
+
+def iter_lines(
+    corpus_file: str, start: int = 0, end: Optional[int] = None
+) -> Iterator[str]:
+    """ Lazily reads the non-empty lines of a corpus file that start within
+    the byte range [`start`, `end`). The corpus file may also be a `.mask`
+    view of a filtered corpus (see `corpus_filtering.corpus_views`), which
+    cannot be sharded. """
+    if corpus_file.endswith(MASK_EXTENSION):
+        assert start == 0 and end is None, "Masked corpora cannot be sharded"
+        yield from MaskedCorpusView.load(corpus_file)
+        return
+    with open(corpus_file, "rb") as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()  # skip the line that started before `start`
+        while end is None or f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            line = line.decode("utf-8").strip()
+            if line:
+                yield line
+
+
+def shard_offsets(corpus_file: str, num_shards: int) -> List[Tuple[int, int]]:
+    """ Splits a corpus file into `num_shards` byte ranges of similar size.
+    Together with `iter_lines`, every line belongs to exactly one shard. """
+    size = os.path.getsize(corpus_file)
+    bounds = [size * idx // num_shards for idx in range(num_shards + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _score_shard(task: tuple) -> Tuple[float, int]:
+    model_name, corpus_file, device, max_tokens, start, end, report_every = task
     model = scorer.IncrementalLMScorer(model_name, device)
+    return log_prob_sums(
+        model, iter_lines(corpus_file, start, end), max_tokens, report_every
+    )
+
+
+def partition_ppl(
+    model_name: Union[nn.Module, str],
+    corpus_file: str,
+    reject_files: Dict[str, str],
+    device: str = "cuda",
+    max_tokens: int = 4096,
+    cache_file: Optional[str] = None,
+) -> Dict[str, Dict[str, float]]:
+    """ Returns the perplexity of the sentences each filter accepted and
+    rejected, from a single scoring pass over the full corpus.
+
+    Every sentence of the corpus is scored once, and its log-prob sum and
+    token count are kept (and optionally cached on disk). A filter's
+    decisions are read from its reject file as a multiset of lines,
+    regardless of their order: each line of the corpus is rejected if the
+    reject file has an equal line (up to whitespace) that no earlier line of
+    the corpus matched. Since a filter decides identically on identical
+    sentences, this also handles duplicate sentences correctly.
+    Alternatively, a filter's decisions can be given by the `.mask` of its
+    accepted or rejected sentences over the corpus.
+
+    Parameters
+    ----------
+    model_name : str | nn.Module
+        Either a model name that refers to a HF model,
+        or an initialised torch model.
+    corpus_file : str
+        Path to the full (unfiltered) corpus.
+    reject_files : Dict[str, str]
+        Dictionary mapping filter names to their `*.reject.corpus` files, or
+        to their accept or reject `.mask` files.
+    device : str
+        Model device, defaults to cuda.
+    max_tokens : int
+        Maximum number of padded whitespace-separated words (not model
+        tokens) per `sequence_score` call; see `token_batches`.
+    cache_file : str
+        Optional `.npz` file in which the per-sentence scores are cached,
+        so that further filters can be evaluated without scoring again. The
+        cache records the `checkpoint_cache_key` of the model and a digest of
+        the corpus, and the corpus is scored again if either differs. Only
+        used if `model_name` is a string.
+
+    Returns
+    -------
+    ppl_dict : Dict[str, Dict[str, float]]
+        Dictionary mapping each filter name to the perplexities of its
+        `accept` and `reject` partitions, which is NaN for an empty
+        partition (e.g. if the filter rejected nothing). The perplexity of
+        the whole corpus is stored under `all`, and is NaN if the corpus has
+        no sentences to score.
+    """
+    if not isinstance(model_name, str):
+        cache_file = None
+    if cache_file:
+        cache_id = {
+            "model_key": checkpoint_cache_key(model_name),
+            "corpus_digest": file_digest(corpus_file),
+        }
+    cache = np.load(cache_file) if cache_file and os.path.exists(cache_file) else None
+    if cache is not None and all(
+        key in cache.files and str(cache[key]) == value
+        for key, value in cache_id.items()
+    ):
+        log_probs, num_tokens = cache["log_probs"], cache["num_tokens"]
+    else:
+        if cache is not None:
+            print(f"{cache_file} is for another model or corpus; scoring again")
+        model = scorer.IncrementalLMScorer(model_name, device)
+        scores = sentence_scores(model, iter_lines(corpus_file), max_tokens)
+        scores = list(scores)
+        # explicit dtypes, so that an empty corpus gives empty arrays
+        log_probs = np.array([log_prob for log_prob, _ in scores], dtype=np.float64)
+        num_tokens = np.array([tokens for _, tokens in scores], dtype=np.int64)
+        if cache_file:
+            np.savez(
+                cache_file, log_probs=log_probs, num_tokens=num_tokens, **cache_id
+            )
+
+    ppl_dict = {"all": {"all": sums_to_ppl(log_probs.sum(), num_tokens.sum())}}
+    for filter_name, reject_file in reject_files.items():
+        rejected = reject_mask(corpus_file, reject_file)
+        assert len(rejected) == len(log_probs), f"{corpus_file} has changed"
+        ppl_dict[filter_name] = {
+            partition: sums_to_ppl(log_probs[mask].sum(), num_tokens[mask].sum())
+            for partition, mask in (("accept", ~rejected), ("reject", rejected))
+        }
+
+    return ppl_dict
+
 
-    with open(corpus_file) as f:
-        corpus = f.read().strip().split("\n")
+def file_digest(path: str) -> str:
+    """ Returns a digest of the full contents of a file. """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    all_log_probs = model.sequence_score(corpus, reduction=lambda probs: probs)
 
-    mean_log_prob = torch.concatenate(all_log_probs).mean()
-    perplexity = torch.exp(-mean_log_prob)
+def reject_mask(corpus_file: str, reject_file: str) -> np.ndarray:
+    """ Returns a boolean array marking the (non-empty) lines of the corpus
+    that a filter rejected, given the filter's reject file, or its accept or
+    reject mask (as recorded in the header of the mask). """
+    if reject_file.endswith(MASK_EXTENSION):
+        mask = MaskedCorpusView.load(reject_file)
+        assert mask.fingerprint == corpus_fingerprint(
+            corpus_file
+        ), f"{reject_file} is a mask over {mask.base_path}, not {corpus_file}"
+        assert (
+            mask.partition is not None
+        ), f"{reject_file} is neither the accept nor the reject mask of a filter"
+        bits = np.unpackbits(
+            np.frombuffer(mask.bitmap, dtype=np.uint8), bitorder="little"
+        )[: mask.num_sents].astype(bool)
+        return bits if mask.partition == "reject" else ~bits
 
-    return perplexity
+    remaining = Counter(" ".join(line.split()) for line in iter_lines(reject_file))
+    rejected = []
+    for line in iter_lines(corpus_file):
+        line = " ".join(line.split())
+        is_rejected = remaining[line] > 0
+        if is_rejected:
+            remaining[line] -= 1
+        rejected.append(is_rejected)
+    assert not +remaining, f"{reject_file} has sentences not in {corpus_file}"
+    return np.array(rejected, dtype=bool)
@@ -0,0 +1,103 @@
+"""Benchmark the throughput of a filter under each GC mode (see `gc_tuning.py`).
+
+Runs the filter over the same annotated corpus once per mode and repetition, each run in
+its own process (so no run inherits another's heap), and reports the median throughput
+and GC pause time of each mode. For example:
+
+    python scripts/gc_benchmark.py passive data/gulordava_corpus/valid.pkl.zst -r 3
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from corpus_filtering.gc_tuning import GC_MODES
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("filter_name", help="The filter to run, e.g. passive.")
+    parser.add_argument("corpus_path", help="Path to the annotated (pickled) corpus.")
+    parser.add_argument(
+        "-r", "--repeats", type=int, default=3, help="Runs per mode. Default: 3."
+    )
+    parser.add_argument(
+        "-m",
+        "--modes",
+        nargs="+",
+        choices=GC_MODES,
+        default=list(GC_MODES),
+        help="The GC modes to compare. Default: all of them.",
+    )
+    parser.add_argument(
+        "--filter-args",
+        default="",
+        help="Extra arguments for the filter, e.g. '--compact --io-queue-depth 0'.",
+    )
+    return parser.parse_args()
+
+
+def run_once(args, mode: str, tmp_dir: str) -> dict:
+    stats_path = os.path.join(tmp_dir, f"{mode}.stats.json")
+    start = time.perf_counter()
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "corpus_filtering",
+            args.filter_name,
+            args.corpus_path,
+            os.devnull,
+            "--stats",
+            stats_path,
+            "--gc",
+            mode,
+            *args.filter_args.split(),
+        ],
+        check=True,
+        stderr=subprocess.DEVNULL,  # progress bars
+    )
+    wall_seconds = time.perf_counter() - start
+    with open(stats_path, "r") as f:
+        stats = json.load(f)
+    num_sents = sum(stats["num_sents"].values())
+    return {
+        "sents_per_second": num_sents / stats["gc"]["run_seconds"],
+        "pause_seconds": stats["gc"]["pause_seconds"],
+        "pause_fraction": stats["gc"]["pause_fraction"],
+        "max_pause_seconds": stats["gc"]["max_pause_seconds"],
+        "wall_seconds": wall_seconds,
+    }
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # interleave the modes, so that drifts in machine load affect them all alike
+        runs = {mode: [] for mode in args.modes}
+        for _ in range(args.repeats):
+            for mode in args.modes:
+                runs[mode].append(run_once(args, mode, tmp_dir))
+    baseline = None
+    print(
+        f"{'mode':<8} {'sents/s':>10} {'speedup':>8} {'GC pause':>9} {'% of run':>9} "
+        f"{'max pause':>10} {'wall':>8}"
+    )
+    for mode, mode_runs in runs.items():
+        median = {
+            key: statistics.median(run[key] for run in mode_runs)
+            for key in mode_runs[0]
+        }
+        baseline = baseline or median["sents_per_second"]
+        print(
+            f"{mode:<8} {median['sents_per_second']:>10.0f} "
+            f"{median['sents_per_second'] / baseline:>7.2f}x "
+            f"{median['pause_seconds']:>8.2f}s {median['pause_fraction']:>9.1%} "
+            f"{median['max_pause_seconds'] * 1000:>8.1f}ms "
+            f"{median['wall_seconds']:>7.1f}s"
+        )
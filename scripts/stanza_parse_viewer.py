@@ -1,13 +1,46 @@
 """Utility functions/script for viewing the stanza annotations of sentence(s).
 
 Run simply as `python stanza_parse_viewer.py` and follow instructions.
+
+Alternatively, run `python stanza_parse_viewer.py serve [annotated corpus paths]` to
+start a long-lived parse service on localhost, which keeps a single warm pipeline and
+parses the sentences of concurrent requests together in batches. Sentences that occur in
+one of the given annotated corpuses (pickled `stanza.Document` files) are looked up
+rather than parsed, and can also be fetched by their index in the corpus or by their
+fingerprint (see `corpus_filtering.dedup.fingerprint`). Lookups by text or fingerprint
+go through a sorted table of the fingerprints of the sentences of each corpus, which is
+built in one pass over the corpus the first time it is served, saved next to it
+(`<corpus>.fingerprints`) and memory-mapped from then on, so the service starts at once
+and holds little of it in memory. For example:
+
+    curl localhost:8765/parse -d '{"sentences": ["The dogs that bark sleep ."]}'
+    curl 'localhost:8765/sentence?corpus=0&id=1234'
+    curl 'localhost:8765/sentence?hash=1234567890123456789'
+
+All responses are JSON, with one entry per sentence giving its text, whether it was
+"parsed" or found in a "corpus", its annotations per word, and the same formatted lines
+the interactive mode prints (`sent_info`). See `serve --help` for options.
 """
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
 from collections.abc import Callable, Generator
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from typing import Optional
+from urllib.parse import parse_qs, urlparse
 
+import numpy as np
 import stanza
 from stanza.models.common.doc import Sentence as StanzaSentence
 
+from corpus_filtering.corpus_views import PickleStanzaDocCorpusView
+from corpus_filtering.dedup import fingerprint, normalize_sent
+
 
 def sent_info(sent: StanzaSentence) -> list[str]:
     """Get the stanza annotations associated with each word in a sentence.
@@ -81,6 +114,354 @@ def build_dep_printer(
     return _
 
 
+def sent_json(sent: StanzaSentence, source: str) -> dict:
+    """Get the stanza annotations of a sentence as a JSON-serializable dictionary.
+
+    Args:
+        sent: the `stanza.models.common.doc.Sentence` instance containing the
+        annotations.
+        source: where the annotations came from, "parsed" or "corpus".
+    """
+    return {
+        "text": sent.text,
+        "source": source,
+        "words": [
+            {
+                "id": word.id,
+                "text": word.text,
+                "lemma": word.lemma,
+                "upos": word.upos,
+                "xpos": word.xpos,
+                "feats": word.feats,
+                "head": word.head,
+                "deprel": word.deprel,
+            }
+            for word in sent.words
+        ],
+        "info": sent_info(sent),
+    }
+
+
+class ParseBatcher:
+    """Parses the sentences of concurrent requests together, in batches, with a single
+    stanza pipeline running on its own thread.
+
+    A batch is parsed as soon as it holds `max_batch_size` sentences, or `max_wait`
+    seconds after its first request arrived, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        pipeline: stanza.Pipeline,
+        max_batch_size: int = 256,
+        max_wait: float = 0.05,
+    ):
+        self._pipeline = pipeline
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._requests: queue.Queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def parse(self, sents: list[str]) -> list[StanzaSentence]:
+        """Parse sentences (one per string), blocking until their batch is done.
+
+        Raises:
+            ValueError: If a sentence is empty, since Stanza would parse no sentence
+                from it, and the sentences of the whole batch would be misaligned.
+        """
+        if not all(sent.strip() for sent in sents):
+            raise ValueError("Cannot parse an empty sentence")
+        future: Future = Future()
+        self._requests.put((sents, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._requests.get()]
+            num_sents = len(batch[0][0])
+            deadline = time.monotonic() + self._max_wait
+            while num_sents < self._max_batch_size:
+                try:
+                    request = self._requests.get(
+                        timeout=max(deadline - time.monotonic(), 0)
+                    )
+                except queue.Empty:
+                    break
+                batch.append(request)
+                num_sents += len(request[0])
+
+            lines = [" ".join(sent.split()) for sents, _ in batch for sent in sents]
+            try:
+                # with `tokenize_no_ssplit`, Stanza only splits sentences at blank
+                # lines; pretokenized text ignores them
+                parsed = self._pipeline("\n\n".join(lines)).sentences if lines else []
+                assert len(parsed) == len(lines), "Stanza split or merged sentences"
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for sents, future in batch:
+                future.set_result(parsed[start : start + len(sents)])
+                start += len(sents)
+
+
+FINGERPRINT_INDEX_EXTENSION = ".fingerprints"
+# an entry of a fingerprint index: a sentence's fingerprint, and its index in the corpus
+FINGERPRINT_ENTRY = np.dtype([("fp", "<u8"), ("sent_idx", "<u8")])
+
+
+class FingerprintIndex:
+    """The sentences of an annotated corpus, sorted by fingerprint.
+
+    Saved next to the corpus as a one-line JSON header (the size and modification time
+    of the corpus when it was indexed, and the number of sentences) followed by the
+    `FINGERPRINT_ENTRY` of every sentence, sorted by fingerprint (and, for equal
+    fingerprints, by sentence index).
+    """
+
+    def __init__(self, entries: np.ndarray):
+        self._entries = entries
+
+    @staticmethod
+    def sidecar_path(corpus_path: str) -> str:
+        return corpus_path + FINGERPRINT_INDEX_EXTENSION
+
+    @classmethod
+    def build(cls, corpus_path: str) -> "FingerprintIndex":
+        fps = np.fromiter(
+            (
+                fingerprint(normalize_sent(sent.text))
+                for sent in PickleStanzaDocCorpusView(corpus_path)
+            ),
+            dtype=np.uint64,
+        )
+        order = np.argsort(fps, kind="stable")
+        entries = np.empty(len(fps), dtype=FINGERPRINT_ENTRY)
+        entries["fp"] = fps[order]
+        entries["sent_idx"] = order
+        return cls(entries)
+
+    def save(self, corpus_path: str):
+        stat = os.stat(corpus_path)
+        header = {
+            "corpus_size": stat.st_size,
+            "corpus_mtime": stat.st_mtime,
+            "num_sents": len(self._entries),
+        }
+        with open(self.sidecar_path(corpus_path), "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            self._entries.tofile(f)
+
+    @classmethod
+    def load_current(cls, corpus_path: str) -> Optional["FingerprintIndex"]:
+        """Memory-map the saved index of a corpus, if any and if it is up to date."""
+        path = cls.sidecar_path(corpus_path)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            header_line = f.readline()
+        header = json.loads(header_line)
+        stat = os.stat(corpus_path)
+        indexed = (header["corpus_size"], header["corpus_mtime"])
+        if indexed != (stat.st_size, stat.st_mtime):
+            return None
+        if header["num_sents"] == 0:
+            return cls(np.empty(0, dtype=FINGERPRINT_ENTRY))
+        return cls(
+            np.memmap(
+                path,
+                dtype=FINGERPRINT_ENTRY,
+                mode="r",
+                offset=len(header_line),
+                shape=(header["num_sents"],),
+            )
+        )
+
+    @classmethod
+    def for_corpus(cls, corpus_path: str) -> "FingerprintIndex":
+        """The saved index of a corpus, or else a new one, saved if possible."""
+        index = cls.load_current(corpus_path)
+        if index is None:
+            print(f"Indexing the fingerprints of {corpus_path} (once)...")
+            index = cls.build(corpus_path)
+            try:
+                index.save(corpus_path)
+            except OSError:
+                pass  # e.g. a read-only directory; the index is just not reused
+        return index
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, fp: int) -> Optional[int]:
+        """The index of the first sentence of the corpus with a fingerprint, if any."""
+        fp = np.uint64(fp)
+        pos = np.searchsorted(self._entries["fp"], fp)
+        if pos < len(self._entries) and self._entries["fp"][pos] == fp:
+            return int(self._entries["sent_idx"][pos])
+        return None
+
+
+class AnnotatedCorpusIndex:
+    """Index of the sentences of annotated corpuses, by position and by fingerprint."""
+
+    def __init__(self, corpus_paths: list[str]):
+        self._views = [PickleStanzaDocCorpusView(path) for path in corpus_paths]
+        # the request handlers run on concurrent threads, and a view reads its corpus
+        # through a single file handle and document cache
+        self._lock = threading.Lock()
+        self._fingerprints = [FingerprintIndex.for_corpus(p) for p in corpus_paths]
+        num_sents = sum(len(index) for index in self._fingerprints)
+        print(f"Indexed {num_sents} sentences.")
+
+    def by_id(self, corpus_idx: int, sent_idx: int) -> StanzaSentence:
+        with self._lock:
+            return self._views[corpus_idx][sent_idx]
+
+    def by_fingerprint(self, fp: int) -> Optional[StanzaSentence]:
+        if not 0 <= fp < 1 << 64:
+            return None
+        for corpus_idx, index in enumerate(self._fingerprints):
+            sent_idx = index.lookup(fp)
+            if sent_idx is not None:
+                return self.by_id(corpus_idx, sent_idx)
+        return None
+
+    def by_text(self, text: str) -> Optional[StanzaSentence]:
+        return self.by_fingerprint(fingerprint(normalize_sent(text)))
+
+
+def build_parse_handler(
+    batcher: Optional[ParseBatcher], index: AnnotatedCorpusIndex
+) -> type:
+    """Factory function for the request handler class of the parse service."""
+
+    class ParseRequestHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body: dict):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            if url.path != "/sentence":
+                return self._send_json(404, {"error": f"Unknown path {url.path}"})
+            try:
+                if "hash" in params:
+                    sent = index.by_fingerprint(int(params["hash"]))
+                elif "text" in params:
+                    sent = index.by_text(params["text"])
+                else:
+                    sent = index.by_id(int(params.get("corpus", 0)), int(params["id"]))
+            except (KeyError, IndexError, ValueError) as e:
+                return self._send_json(400, {"error": repr(e)})
+            if sent is None:
+                return self._send_json(404, {"error": "Sentence not found"})
+            self._send_json(200, {"sentences": [sent_json(sent, "corpus")]})
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/parse":
+                return self._send_json(404, {"error": f"Unknown path {self.path}"})
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                sents = json.loads(self.rfile.read(length))["sentences"]
+                assert isinstance(sents, list), "`sentences` must be a list"
+                assert all(
+                    isinstance(sent, str) and sent.strip() for sent in sents
+                ), "`sentences` must be non-empty strings"
+            except (AssertionError, KeyError, ValueError) as e:
+                return self._send_json(400, {"error": repr(e)})
+
+            # look up the sentences that are already annotated; parse the rest
+            found = [index.by_text(sent) for sent in sents]
+            to_parse = [sent for sent, annot in zip(sents, found) if annot is None]
+            if to_parse and batcher is None:
+                return self._send_json(404, {"error": "Sentences not in any corpus"})
+            try:
+                parsed = iter(batcher.parse(to_parse) if to_parse else [])
+            except Exception as e:
+                return self._send_json(500, {"error": repr(e)})
+            self._send_json(
+                200,
+                {
+                    "sentences": [
+                        sent_json(annot, "corpus")
+                        if annot is not None
+                        else sent_json(next(parsed), "parsed")
+                        for annot in found
+                    ]
+                },
+            )
+
+    return ParseRequestHandler
+
+
+def serve(args: argparse.Namespace) -> None:
+    index = AnnotatedCorpusIndex(args.corpus_paths)
+    batcher = None
+    if not args.lookup_only:
+        pipeline = stanza.Pipeline(
+            lang="en",
+            processors="tokenize,pos,lemma,depparse,constituency",
+            tokenize_pretokenized=not args.tokenize,
+            tokenize_no_ssplit=True,  # one sentence per input string
+        )
+        batcher = ParseBatcher(pipeline, args.max_batch_size, args.max_wait)
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", args.port), build_parse_handler(batcher, index)
+    )
+    print(f"Serving parses on http://127.0.0.1:{args.port} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+def parse_serve_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="stanza_parse_viewer.py serve",
+        description="Serve stanza parses over HTTP on localhost.",
+    )
+    parser.add_argument(
+        "corpus_paths",
+        nargs="*",
+        metavar="corpus_path",
+        help="Annotated corpuses (pickled `stanza.Document` files) in which to look up "
+        "sentences before parsing them.",
+    )
+    parser.add_argument("-p", "--port", type=int, default=8765)
+    parser.add_argument(
+        "-t",
+        "--tokenize",
+        action="store_true",
+        help="Tokenize the input sentences. By default, they are assumed to already be "
+        "whitespace-tokenized.",
+    )
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=256,
+        help="Maximum number of sentences to parse per batch.",
+    )
+    parser.add_argument(
+        "--max-wait",
+        type=float,
+        default=0.05,
+        help="Maximum number of seconds to wait for a batch to fill up.",
+    )
+    parser.add_argument(
+        "--lookup-only",
+        action="store_true",
+        help="Do not build a pipeline; only serve sentences from the corpuses.",
+    )
+    return parser.parse_args(sys.argv[2:])
+
+
 def main() -> None:
     pretok_prompt = "Are the sentences you will be providing already whitespace-tokenized? Enter any non-whitespace character(s) if they are; otherwise, just hit enter: "
     tokenize_pretokenized = bool(input(pretok_prompt).strip())
@@ -97,4 +478,7 @@ def main() -> None:
 
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:2] == ["serve"]:
+        serve(parse_serve_args())
+    else:
+        main()
@@ -18,4 +18,10 @@ setup(
     long_description=long_description,
     packages=find_packages(),
     install_requires=[],  # need to fill if we want to distribute this package
+    entry_points={
+        "console_scripts": ["corpus_filtering = corpus_filtering.__main__:main"],
+        # Filters defined in other packages can register themselves with the CLI by
+        # adding entry points to this group; see `corpus_filtering.filters.FilterRegistry`
+        "corpus_filtering.filters": [],
+    },
 )
@@ -0,0 +1,79 @@
+import io
+
+import pytest
+
+from corpus_filtering.dedup import NO_SENT, DedupIndex
+from corpus_filtering.sentence_ids import SentenceIdWriter, load_sentence_ids
+
+CORPUS = "the cat sat\na  dog ran\n\nthe cat   sat\nbirds fly\na dog ran\n"
+
+
+@pytest.fixture
+def corpus_path(tmp_path):
+    path = tmp_path / "corpus.txt"
+    path.write_text(CORPUS)
+    return path
+
+
+@pytest.fixture
+def index(corpus_path, tmp_path):
+    return DedupIndex.build(str(corpus_path), str(tmp_path / "unique.txt"))
+
+
+def test_build(index, tmp_path):
+    assert index.num_unique == 3
+    assert list(index.unique_ids) == [0, 1, NO_SENT, 0, 2, 1]
+    unique_sents = (tmp_path / "unique.txt").read_text().splitlines()
+    assert unique_sents == ["the cat sat", "a dog ran", "birds fly"]
+
+
+def test_save_load_round_trip(index, tmp_path):
+    path = str(tmp_path / "corpus.dedup")
+    index.save(path)
+    loaded = DedupIndex.load(path)
+    assert loaded.source_path == index.source_path
+    assert loaded.unique_ids == index.unique_ids
+    assert loaded.fingerprints == index.fingerprints
+
+
+def test_lookup(index, tmp_path):
+    path = str(tmp_path / "corpus.dedup")
+    index.save(path)
+    for dedup_index in (index, DedupIndex.load(path)):
+        assert dedup_index.lookup("a dog ran") == 1
+        assert dedup_index.lookup("  birds   fly \n") == 2
+        assert dedup_index.lookup("fish swim") is None
+
+
+def test_expand(index, tmp_path):
+    f_accept_out, f_reject_out = io.StringIO(), io.StringIO()
+    accept_ids = SentenceIdWriter(str(tmp_path / "accept.ids"))
+    reject_ids = SentenceIdWriter(str(tmp_path / "reject.ids"))
+    # reject every copy of "a dog ran"
+    index.expand(
+        bytearray([0, 1, 0]),
+        f_accept_out,
+        f_reject_out,
+        accept_ids=accept_ids,
+        reject_ids=reject_ids,
+    )
+    accept_ids.close()
+    reject_ids.close()
+    assert f_accept_out.getvalue() == "the cat sat\nthe cat sat\nbirds fly\n"
+    assert f_reject_out.getvalue() == "a dog ran\na dog ran\n"
+    # IDs index the non-blank lines of the original corpus
+    assert list(load_sentence_ids(str(tmp_path / "accept.ids"))) == [0, 2, 3]
+    assert list(load_sentence_ids(str(tmp_path / "reject.ids"))) == [1, 4]
+
+
+def test_expand_from_moved_source(index, corpus_path, tmp_path):
+    moved_path = tmp_path / "moved.txt"
+    corpus_path.rename(moved_path)
+    f_accept_out = io.StringIO()
+    index.expand(bytearray(3), f_accept_out, source_path=str(moved_path))
+    assert f_accept_out.getvalue().count("\n") == 5
+
+
+def test_expand_rejects_wrong_number_of_decisions(index):
+    with pytest.raises(AssertionError):
+        index.expand(bytearray(2), io.StringIO())
@@ -0,0 +1,92 @@
+import pytest
+
+from corpus_filtering.corpus_views.masked_corpus_views import (
+    MaskedCorpusView,
+    count_sents,
+)
+
+SENTS = [f"sentence {i}" for i in range(11)]
+
+
+@pytest.fixture
+def base_path(tmp_path):
+    path = tmp_path / "base.txt"
+    # blank lines and extra whitespace are not sentences of their own
+    lines = [f"  {sent.replace(' ', '   ')}\n" for sent in SENTS]
+    lines.insert(3, "\n")
+    path.write_text("".join(lines))
+    return str(path)
+
+
+def mask(base_path, kept, partition=None):
+    return MaskedCorpusView.from_decisions(base_path, kept, len(SENTS), partition)
+
+
+def test_count_sents(base_path):
+    assert count_sents(base_path) == len(SENTS)
+
+
+def test_from_decisions(base_path):
+    kept = [i % 3 == 0 for i in range(len(SENTS))]
+    view = mask(base_path, kept, "accept")
+    assert view.num_sents == len(SENTS)
+    assert len(view.bitmap) == 2
+    assert len(view) == sum(kept)
+    assert [i for i in range(len(SENTS)) if i in view] == [0, 3, 6, 9]
+    assert list(view) == [SENTS[i] for i in (0, 3, 6, 9)]
+
+
+def test_from_decisions_infers_num_sents(base_path):
+    view = MaskedCorpusView.from_decisions(base_path, [True] * len(SENTS))
+    assert view.num_sents == len(SENTS)
+    assert list(view) == SENTS
+
+
+def test_save_load_round_trip(base_path, tmp_path):
+    view = mask(base_path, [i % 2 == 1 for i in range(len(SENTS))], "reject")
+    path = str(tmp_path / "train.reject.mask")
+    view.save(path)
+    loaded = MaskedCorpusView.load(path)
+    assert loaded.base_path == view.base_path
+    assert loaded.bitmap == view.bitmap
+    assert loaded.num_sents == view.num_sents
+    assert loaded.fingerprint == view.fingerprint
+    assert loaded.partition == "reject"
+    assert list(loaded) == SENTS[1::2]
+
+
+def test_combine(base_path):
+    a = mask(base_path, [i < 6 for i in range(len(SENTS))], "accept")
+    b = mask(base_path, [i % 2 == 0 for i in range(len(SENTS))], "accept")
+    assert list(a & b) == [SENTS[i] for i in (0, 2, 4)]
+    assert list(a | b) == [SENTS[i] for i in (0, 1, 2, 3, 4, 5, 6, 8, 10)]
+    assert (a & b).partition == (a | b).partition == "accept"
+    assert (a & mask(base_path, [True] * len(SENTS))).partition is None
+
+
+def test_invert(base_path):
+    a = mask(base_path, [i < 6 for i in range(len(SENTS))], "accept")
+    inverted = ~a
+    # the padding bits of the last byte stay unset
+    assert len(inverted) == len(SENTS) - 6
+    assert list(inverted) == SENTS[6:]
+    assert inverted.partition == "reject"
+    assert (~inverted).bitmap == a.bitmap
+    assert (~inverted).partition == "accept"
+
+
+def test_combine_rejects_different_base_corpus(base_path, tmp_path):
+    other_path = tmp_path / "other.txt"
+    other_path.write_text("".join(f"{sent}\n" for sent in SENTS[::-1]))
+    a = mask(base_path, [True] * len(SENTS))
+    b = mask(str(other_path), [True] * len(SENTS))
+    with pytest.raises(AssertionError):
+        a & b
+
+
+def test_iteration_rejects_changed_base_corpus(base_path):
+    view = mask(base_path, [True] * len(SENTS))
+    with open(base_path, "a") as f:
+        f.write("one more sentence\n")
+    with pytest.raises(AssertionError):
+        list(view)
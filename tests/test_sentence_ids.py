@@ -0,0 +1,62 @@
+import pytest
+
+from corpus_filtering.sentence_ids import (
+    SentenceIdWriter,
+    decode_sentence_ids,
+    encode_sentence_ids,
+    load_sentence_ids,
+)
+
+
+@pytest.mark.parametrize(
+    "sent_ids",
+    [
+        [],
+        [0],
+        [0, 1, 2, 3],
+        [5, 6, 200, 201, 20_000],
+        # gaps of 126, 127, 16383 and 16384 (the edges of 1-, 2- and 3-byte varints)
+        # and the largest ID
+        [126, 254, 16_638, 16_639 + 16_384, 2**64 - 1],
+    ],
+)
+def test_encode_decode_round_trip(sent_ids):
+    assert list(decode_sentence_ids(encode_sentence_ids(sent_ids))) == sent_ids
+
+
+def test_consecutive_ids_take_one_byte_each():
+    assert encode_sentence_ids(range(100)) == bytes(100)
+    assert len(encode_sentence_ids([0, 129])) == 3
+
+
+def test_encode_rejects_unsorted_ids():
+    with pytest.raises(AssertionError):
+        encode_sentence_ids([3, 3])
+    with pytest.raises(AssertionError):
+        encode_sentence_ids([4, 2])
+
+
+def test_decode_rejects_truncated_varint():
+    data = encode_sentence_ids([1000])
+    with pytest.raises(AssertionError):
+        decode_sentence_ids(data[:-1])
+
+
+def test_writer_round_trip(tmp_path):
+    path = str(tmp_path / "out.txt.ids")
+    sent_ids = [0, 2, 3, 300, 70_000]
+    with SentenceIdWriter(path, base_path="base.txt") as writer:
+        for sent_id in sent_ids:
+            writer.add(sent_id)
+    assert writer.num_ids == len(sent_ids)
+    assert list(load_sentence_ids(path)) == sent_ids
+
+
+def test_load_rejects_truncated_sidecar(tmp_path):
+    path = tmp_path / "out.txt.ids"
+    with SentenceIdWriter(str(path)) as writer:
+        for sent_id in (1, 5, 9):
+            writer.add(sent_id)
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(AssertionError):
+        load_sentence_ids(str(path))